@@ -0,0 +1,196 @@
+"""
+Schema migration + backfill of participant columns from the raw match cache.
+
+Adds any columns in db.PARTICIPANT_EXTRA_COLUMNS that an older database is
+missing, then re-derives them from match_cache payloads - never the API.
+Payload parsing runs in a process pool in chunks; the main process is the
+only writer and commits one chunk at a time together with its progress
+marker, so an interrupted run resumes where it stopped.
+
+With --shards, every active per-patch shard file (shards.py) is backfilled
+after riot.db, each with its own progress marker. Finalised shards are
+read-only and are skipped; their matches keep NULLs in the new columns.
+
+    python src/backfill.py                         # all extra columns
+    python src/backfill.py --columns team_position,time_played --workers 8
+    python src/backfill.py --restart               # ignore saved progress
+    python src/backfill.py --shards Data/Raw/shards
+"""
+import argparse
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from db import DEFAULT_DB_PATH, PARTICIPANT_EXTRA_COLUMNS, connect_readonly, connect_writer, init_db, maybe_checkpoint
+from match_payload import loads
+from shards import ShardSet
+
+CHUNK_SIZE = 500
+
+
+def init_progress(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS backfill_progress (
+        job TEXT PRIMARY KEY,
+        last_rowid INTEGER NOT NULL DEFAULT 0,
+        rows_done INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.commit()
+
+
+def job_name(columns: list[str]) -> str:
+    return "participants:" + ",".join(sorted(columns))
+
+
+def get_progress(conn: sqlite3.Connection, job: str) -> tuple[int, int]:
+    row = conn.execute("SELECT last_rowid, rows_done FROM backfill_progress WHERE job = ?", (job,)).fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+def parse_chunk(chunk: list[tuple[int, str, str]], keys: list[str]) -> tuple[int, list[tuple]]:
+    """Worker: (rowid, match_id, json) rows -> UPDATE parameter tuples."""
+    updates = []
+    for _, match_id, raw in chunk:
+        try:
+            info = loads(raw).get("info", {})
+        except ValueError:
+            continue
+        for p in info.get("participants", []):
+            puuid = p.get("puuid")
+            if not puuid:
+                continue
+            values = [int(v) if isinstance(v, bool) else v for v in (p.get(k) for k in keys)]
+            updates.append((*values, match_id, puuid))
+    return chunk[-1][0], updates
+
+
+def iter_chunks(conn: sqlite3.Connection, after_rowid: int, chunk_size: int):
+    last = after_rowid
+    while True:
+        rows = conn.execute(
+            "SELECT rowid, match_id, json FROM match_cache WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last, chunk_size),
+        ).fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [tuple(r) for r in rows]
+
+
+def backfill_participants(db_path=DEFAULT_DB_PATH, columns: list[str] | None = None,
+                          chunk_size: int = CHUNK_SIZE, workers: int | None = None,
+                          restart: bool = False, shard_root=None) -> int:
+    """Backfill riot.db, then each active shard under shard_root. Returns participant rows changed."""
+    known = {c: key for c, _, key in PARTICIPANT_EXTRA_COLUMNS}
+    columns = columns or list(known)
+    unknown = [c for c in columns if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown participant columns: {unknown}")
+
+    rows_done = backfill_file(db_path, columns, [known[c] for c in columns], chunk_size, workers, restart)
+    if shard_root is None:
+        return rows_done
+    shards = ShardSet(shard_root)
+    for patch in shards.patches():
+        if shards.is_final(patch):
+            print(f"Shard {patch} is finalised (read-only); skipping")
+            continue
+        print(f"Shard {patch}:")
+        rows_done += backfill_file(shards.path(patch), columns, [known[c] for c in columns],
+                                   chunk_size, workers, restart)
+    return rows_done
+
+
+def backfill_file(db_path, columns: list[str], keys: list[str], chunk_size: int = CHUNK_SIZE,
+                  workers: int | None = None, restart: bool = False) -> int:
+    """Backfill one database file; returns the participant rows changed (including earlier resumed runs)."""
+    conn = connect_writer(db_path)
+    init_db(conn)  # runs migrate_db, so the target columns exist
+    init_progress(conn)
+    # separate read cursor so chunk reads are not disturbed by our commits
+    reader = connect_readonly(db_path)
+
+    job = job_name(columns)
+    if restart:
+        with conn:
+            conn.execute("DELETE FROM backfill_progress WHERE job = ?", (job,))
+    last_rowid, rows_done = get_progress(conn, job)
+
+    total = conn.execute("SELECT COUNT(*) FROM match_cache WHERE rowid > ?", (last_rowid,)).fetchone()[0]
+    print(f"Backfilling {len(columns)} columns from {total} cached matches (resuming after rowid {last_rowid})")
+    if total == 0:
+        reader.close()
+        conn.close()
+        return rows_done
+
+    sql = (f"UPDATE participants SET {', '.join(f'{c} = ?' for c in columns)} "
+           f"WHERE match_id = ? AND puuid = ?")
+    workers = workers or os.cpu_count() or 1
+    t0 = time.perf_counter()
+    matches_done = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        chunks = iter_chunks(reader, last_rowid, chunk_size)
+
+        def submit_next() -> bool:
+            chunk = next(chunks, None)
+            if chunk is None:
+                return False
+            pending.append((len(chunk), pool.submit(parse_chunk, chunk, keys)))
+            return True
+
+        # keep a bounded number of chunks in flight; commit strictly in rowid order
+        for _ in range(workers * 2):
+            if not submit_next():
+                break
+        while pending:
+            n_matches, fut = pending.popleft()
+            chunk_last, updates = fut.result()
+            with conn:
+                # rows actually changed: a payload puuid missing from participants updates nothing
+                changed = conn.executemany(sql, updates).rowcount
+                conn.execute("""
+                    INSERT INTO backfill_progress (job, last_rowid, rows_done, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(job) DO UPDATE SET
+                        last_rowid = excluded.last_rowid,
+                        rows_done = backfill_progress.rows_done + ?,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (job, chunk_last, changed, changed))
+            maybe_checkpoint(conn, db_path)
+            rows_done += changed
+            matches_done += n_matches
+            submit_next()
+
+            elapsed = time.perf_counter() - t0
+            print(f"[{matches_done}/{total}] matches, {rows_done} participant rows, "
+                  f"{matches_done / elapsed:.0f} matches/s")
+
+    reader.close()
+    conn.close()
+    print(f"Backfill finished in {time.perf_counter() - t0:.1f}s")
+    return rows_done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill participant columns from match_cache")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    parser.add_argument("--columns", default=None, help="comma separated subset of the extra columns")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="matches per work unit")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--shards", default=None,
+                        help="also backfill the active per-patch shards in this directory (finalised ones are skipped)")
+    args = parser.parse_args()
+
+    columns = [c.strip() for c in args.columns.split(",")] if args.columns else None
+    backfill_participants(args.db, columns, args.chunk, args.workers, args.restart, args.shards)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Benchmark suite for the analytics stages against a synthetic database.
+
+Times each stage (meta_detection, player_performance, giveup_label,
+statistical_testing), records its tracemalloc peak and appends the run to
+Data/Bench/results.jsonl tagged with the current git commit so runs can be
+compared across commits.
+
+    python src/benchmark_pipeline.py --rows 1000000
+    python src/benchmark_pipeline.py --rows 1000000 --compare
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+# giveup_label pulls in riot_api/Config; no stage here touches the network
+os.environ.setdefault("RIOT_API_KEY", "offline-benchmark")
+
+import duos
+import giveup_label
+import giveup_model
+import matchups
+import meta_detection
+import meta_stream
+import player_baselines
+import sequence_features
+import sketches
+import statistical_testing
+from db import connect
+from synthetic_matches import champion_table, generate
+
+BENCH_DIR = Path("Data/Bench").resolve()
+RESULTS_PATH = BENCH_DIR / "results.jsonl"
+BENCH_PARTITIONS = 4
+BENCH_STRATA = ("position", "tier")
+
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run_stage(name: str, fn, *args, trace_memory: bool = True):
+    print(f"--- {name}")
+    if trace_memory:
+        tracemalloc.start()
+    t0 = time.perf_counter()
+    result, error = None, None
+    try:
+        result = fn(*args)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        print(f"stage {name} failed: {error}")
+    seconds = time.perf_counter() - t0
+    peak = None
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    record = {"stage": name, "seconds": round(seconds, 4)}
+    if peak is not None:
+        record["peak_mb"] = round(peak / 2**20, 2)
+    if error:
+        record["error"] = error
+    return result, record
+
+
+def write_ddragon_cache(work_dir: Path) -> None:
+    """meta_character_ids resolves names via DDragon; point it at the synthetic champions."""
+    data = {"data": {name: {"key": str(cid), "id": name, "name": name} for cid, name in champion_table()}}
+    cache = work_dir / "Data" / "Cache" / "ddragon_champion_full.json"
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    cache.write_text(json.dumps(data), encoding="utf-8")
+
+
+def run_benchmarks(db_path: Path, trace_memory: bool = True) -> list[dict]:
+    # Stage outputs use repo-relative paths; keep them out of the real Data/
+    work_dir = BENCH_DIR / "work"
+    work_dir.mkdir(parents=True, exist_ok=True)
+    write_ddragon_cache(work_dir)
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    records = []
+    try:
+        conn = connect(db_path)
+        rows, rec = run_stage("meta_detection.detect_meta_champs", meta_detection.detect_meta_champs, conn,
+                              trace_memory=trace_memory)
+        records.append(rec)
+        meta_detection.save_meta_champs_csv(rows or [])
+
+        sketches.create_sketch_tables(conn)
+        _, rec = run_stage("sketches.rebuild_sketches", sketches.rebuild_sketches, conn, trace_memory=trace_memory)
+        records.append(rec)
+        _, rec = run_stage("meta_detection.detect_meta_champs[approx]", meta_detection.detect_meta_champs, conn,
+                           meta_detection.get_sketch_stats_patches, trace_memory=trace_memory)
+        records.append(rec)
+        _, rec = run_stage("meta_detection.detect_meta_champs_by", meta_detection.detect_meta_champs_by, conn,
+                           BENCH_STRATA, trace_memory=trace_memory)
+        records.append(rec)
+        meta_stream.create_meta_stream_tables(conn)
+        _, rec = run_stage("meta_stream.replay", meta_stream.replay, conn, trace_memory=trace_memory)
+        records.append(rec)
+
+        # player_performance resolves meta champ ids at import time, so it
+        # must be (re)imported after meta_champs.csv exists
+        pp = importlib.reload(sys.modules["player_performance"]) if "player_performance" in sys.modules \
+            else importlib.import_module("player_performance")
+
+        games, rec = run_stage("player_performance.load_player_games", pp.load_player_games, db_path,
+                               trace_memory=trace_memory)
+        records.append(rec)
+        if games is not None:
+            _, rec = run_stage("player_performance.add_faced_meta_flag", pp.add_faced_meta_flag, games,
+                               pp.META_CHAMPS, trace_memory=trace_memory)
+            records.append(rec)
+            _, rec = run_stage("sequence_features.add_sequence_features", sequence_features.add_sequence_features,
+                               games, trace_memory=trace_memory)
+            records.append(rec)
+        _, rec = run_stage("duos.build", duos.build, db_path, trace_memory=trace_memory)
+        records.append(rec)
+        _, rec = run_stage("player_performance.build_partitioned", pp.build_player_features,
+                           db_path, False, BENCH_PARTITIONS, trace_memory=trace_memory)
+        records.append(rec)
+        # unpartitioned last: its CSV is the one the later stages read
+        _, rec = run_stage("player_performance.build_player_features", pp.build_player_features, db_path,
+                           trace_memory=trace_memory)
+        records.append(rec)
+
+        _, rec = run_stage("matchups.build", matchups.build, db_path, matchups.MATRIX_PATH, True,
+                           trace_memory=trace_memory)
+        records.append(rec)
+
+        games, rec = run_stage("giveup_label.load_games", giveup_label.load_games, conn, trace_memory=trace_memory)
+        records.append(rec)
+        labels = None
+        if games is not None:
+            out, rec = run_stage("giveup_label.compute_player_labels", giveup_label.compute_player_labels, games,
+                                 trace_memory=trace_memory)
+            records.append(rec)
+            labels = out[1] if out is not None else None
+
+            _, rec = run_stage("player_baselines.init_baselines", player_baselines.init_baselines, conn,
+                               trace_memory=trace_memory)
+            records.append(rec)
+            _, rec = run_stage("giveup_label.compute_player_labels[baselines]", giveup_label.compute_player_labels,
+                               games, conn, trace_memory=trace_memory)
+            records.append(rec)
+        conn.close()
+
+        if pp.OUT_PATH.exists() and labels is not None:
+            features = pd.read_csv(pp.OUT_PATH).merge(labels, on="puuid", how="left")
+            features["gave_up"] = features["gave_up"].fillna(0).astype(int)
+            features["performance_delta"] = features["delta_kda"]
+            _, rec = run_stage("statistical_testing.run_all", statistical_testing.run_all, features,
+                               trace_memory=trace_memory)
+            records.append(rec)
+            _, rec = run_stage("statistical_testing.run_stratified", statistical_testing.run_stratified, features,
+                               BENCH_STRATA, trace_memory=trace_memory)
+            records.append(rec)
+            # fresh fold cache, otherwise later runs only time cache reads
+            with tempfile.TemporaryDirectory() as model_cache:
+                _, rec = run_stage("giveup_model.run_cv", giveup_model.run_cv, features, tuple(giveup_model.GRIDS),
+                                   giveup_model.N_FOLDS, None, Path(model_cache), trace_memory=trace_memory)
+            records.append(rec)
+    finally:
+        os.chdir(cwd)
+    return records
+
+
+def compare(run: dict) -> None:
+    """Print per-stage change vs. the most recent run on another commit at the same scale."""
+    if not RESULTS_PATH.exists():
+        return
+    previous = None
+    for line in RESULTS_PATH.read_text(encoding="utf-8").splitlines():
+        r = json.loads(line)
+        if r["rows"] == run["rows"] and r["commit"] != run["commit"]:
+            previous = r
+    if previous is None:
+        print("No earlier run at this scale to compare against")
+        return
+
+    before = {s["stage"]: s for s in previous["stages"]}
+    print(f"Compared with {previous['commit']} ({previous['timestamp']}):")
+    for s in run["stages"]:
+        b = before.get(s["stage"])
+        if b is None or "error" in s or "error" in b or not b["seconds"]:
+            continue
+        change = (s["seconds"] - b["seconds"]) / b["seconds"]
+        print(f"  {s['stage']:<45} {b['seconds']:>9.3f}s -> {s['seconds']:>9.3f}s ({change:+.1%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analytics pipeline on synthetic data")
+    parser.add_argument("--rows", type=int, default=100_000, help="participant rows (10k .. 10M)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=None, help="reuse an existing database instead of generating one")
+    parser.add_argument("--regenerate", action="store_true")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (it slows Python code)")
+    parser.add_argument("--compare", action="store_true")
+    args = parser.parse_args()
+
+    db_path = Path(args.db).resolve() if args.db else BENCH_DIR / f"synthetic_{args.rows}_{args.seed}.db"
+    if not args.db and (args.regenerate or not db_path.exists()):
+        t0 = time.perf_counter()
+        generate(db_path, args.rows, seed=args.seed)
+        print(f"generated in {time.perf_counter() - t0:.1f}s")
+
+    stages = run_benchmarks(db_path, trace_memory=not args.no_memory)
+    run = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": args.rows,
+        "seed": args.seed,
+        "db": str(db_path),
+        "python": sys.version.split()[0],
+        "stages": stages,
+    }
+
+    if args.compare:
+        compare(run)
+
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with RESULTS_PATH.open("a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+
+    for s in stages:
+        mem = f", peak {s['peak_mb']} MB" if "peak_mb" in s else ""
+        err = f"  [{s['error']}]" if "error" in s else ""
+        print(f"{s['stage']:<45} {s['seconds']:>9.3f}s{mem}{err}")
+    print(f"Appended results to {RESULTS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
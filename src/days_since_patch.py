@@ -15,6 +15,25 @@ def ms_since_post_patch():
     dt = datetime.strptime(PATCH_DATE, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc)
     return int(dt.timestamp() * 1000)
 
+# patch_id() values covering the windows above: [pre_patch, patch) is 15.4 and
+# 15.5, [patch, post_patch) is 15.6, the patch under study
+PRE_PATCH_IDS = (1504, 1505)
+PATCH_ID = 1506
+
+# shared by meta_detection and the ingest-time meta_stream / query_service
+RANKED_SOLO_QUEUE = 420
+META_CHARACTERS = 8
+
+def patch_id(game_version: str | None) -> int | None:
+    """gameVersion "15.5.660.1234" -> 1505 (major * 100 + minor); None if unparseable."""
+    if not game_version:
+        return None
+    parts = game_version.split(".")
+    try:
+        return int(parts[0]) * 100 + int(parts[1])
+    except (IndexError, ValueError):
+        return None
+
 if __name__ == "__main__":
     print(ms_since_pre_patch())
     print(ms_since_patch())
@@ -1,9 +1,39 @@
 import sqlite3
 import json
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
+
+from days_since_patch import patch_id
 
 DEFAULT_DB_PATH = Path("Data") / "Raw" / "riot.db"
 
+# Participant columns added after the original schema: (column, SQL type, match-v5 key).
+# Existing databases get them through migrate_db(); backfill.py fills them from match_cache.
+PARTICIPANT_EXTRA_COLUMNS = [
+    ("team_position", "TEXT", "teamPosition"),
+    ("individual_position", "TEXT", "individualPosition"),
+    ("time_played", "INTEGER", "timePlayed"),
+    ("total_time_spent_dead", "INTEGER", "totalTimeSpentDead"),
+    ("longest_time_spent_living", "INTEGER", "longestTimeSpentLiving"),
+    ("total_damage_taken", "INTEGER", "totalDamageTaken"),
+    ("damage_self_mitigated", "INTEGER", "damageSelfMitigated"),
+    ("total_heal", "INTEGER", "totalHeal"),
+    ("gold_spent", "INTEGER", "goldSpent"),
+    ("wards_placed", "INTEGER", "wardsPlaced"),
+    ("wards_killed", "INTEGER", "wardsKilled"),
+    ("item0", "INTEGER", "item0"),
+    ("item1", "INTEGER", "item1"),
+    ("item2", "INTEGER", "item2"),
+    ("item3", "INTEGER", "item3"),
+    ("item4", "INTEGER", "item4"),
+    ("item5", "INTEGER", "item5"),
+    ("item6", "INTEGER", "item6"),
+    ("game_ended_in_surrender", "INTEGER", "gameEndedInSurrender"),
+    ("game_ended_in_early_surrender", "INTEGER", "gameEndedInEarlySurrender"),
+    ("team_early_surrendered", "INTEGER", "teamEarlySurrendered"),
+]
+
 
 def connect(db_path: str | Path = DEFAULT_DB_PATH) -> sqlite3.Connection:
     db_path = Path(db_path)  
@@ -17,6 +47,82 @@ def connect(db_path: str | Path = DEFAULT_DB_PATH) -> sqlite3.Connection:
     return conn
 
 
+# Writers checkpoint once the WAL passes this size; readers never checkpoint.
+WAL_CHECKPOINT_BYTES = 64 * 2**20
+BUSY_TIMEOUT_MS = 30_000
+
+
+def connect_readonly(db_path: str | Path = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """
+    Analytics connection: opened with mode=ro and query_only, so a stray write
+    fails instead of queueing behind ingest. Each statement runs in its own
+    short read transaction unless the caller opens one (see read_snapshot).
+    Silent, unlike connect(): worker processes and query threads open one each.
+    """
+    db_path = Path(db_path)
+    conn = sqlite3.connect(f"{db_path.resolve().as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON;")
+    return conn
+
+
+def connect_writer(db_path: str | Path = DEFAULT_DB_PATH) -> sqlite3.Connection:
+    """connect() tuned for the single ingest/backfill writer."""
+    conn = connect(db_path)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+
+def wal_size(db_path: str | Path = DEFAULT_DB_PATH) -> int:
+    wal = Path(f"{db_path}-wal")
+    return wal.stat().st_size if wal.exists() else 0
+
+
+def checkpoint(conn: sqlite3.Connection, mode: str = "PASSIVE") -> tuple[int, int, int]:
+    """PRAGMA wal_checkpoint; returns (busy, wal pages, pages checkpointed)."""
+    if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+        raise ValueError(f"Unknown checkpoint mode: {mode}")
+    busy, log, done = conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+    return busy, log, done
+
+
+def maybe_checkpoint(conn: sqlite3.Connection, db_path: str | Path = DEFAULT_DB_PATH,
+                     max_wal_bytes: int = WAL_CHECKPOINT_BYTES) -> bool:
+    """
+    Called by writers between transactions. SQLite's autocheckpoint copies pages
+    back but never shrinks the -wal file; once it has grown past max_wal_bytes a
+    PASSIVE checkpoint (never waits on readers) is tried, and if it got through
+    the whole log nobody is pinning it, so the file is truncated back to zero.
+    Returns True if the WAL was truncated.
+    """
+    if wal_size(db_path) < max_wal_bytes:
+        return False
+    busy, log, done = checkpoint(conn, "PASSIVE")
+    if busy or done < log:
+        print(f"WAL checkpoint partial: {done}/{log} pages (readers still on older snapshots)")
+        return False
+    checkpoint(conn, "TRUNCATE")
+    return True
+
+
+@contextmanager
+def read_snapshot(db_path: str | Path = DEFAULT_DB_PATH) -> Iterator[sqlite3.Connection]:
+    """
+    Read-only connection holding one read transaction, so every query inside the
+    block sees the same point in time. Keep these short: the open transaction
+    stops checkpoints from getting past it.
+    """
+    conn = connect_readonly(db_path)
+    try:
+        conn.execute("BEGIN")
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone()  # start the read txn now
+        yield conn
+    finally:
+        conn.rollback()
+        conn.close()
+
+
 def init_db(conn: sqlite3.Connection, schema_path: Path = Path("src/schema.sql"))-> None:
     if schema_path.exists():
         conn.executescript(schema_path.read_text(encoding="utf-8"))
@@ -39,7 +145,8 @@ def init_db(conn: sqlite3.Connection, schema_path: Path = Path("src/schema.sql")
         -- common useful fields
         game_name TEXT,
         game_start_timestamp INTEGER,
-        ingestion_ts INTEGER DEFAULT (strftime('%s','now'))
+        ingestion_ts INTEGER DEFAULT (strftime('%s','now')),
+        patch_id INTEGER  -- days_since_patch.patch_id(game_version), e.g. 1505
         );
 
         CREATE TABLE IF NOT EXISTS participants (
@@ -105,7 +212,74 @@ def init_db(conn: sqlite3.Connection, schema_path: Path = Path("src/schema.sql")
         match_id TEXT PRIMARY KEY,
         fetched_at INTEGER NOT NULL DEFAULT (strftime('%s','now')),
         json TEXT NOT NULL);
+
+        -- match-v5 timelines, one packed int32 (frames, participants, fields) array per match (timelines.py)
+        CREATE TABLE IF NOT EXISTS match_timelines (
+        match_id TEXT PRIMARY KEY,
+        n_frames INTEGER NOT NULL,
+        n_participants INTEGER NOT NULL,
+        n_fields INTEGER NOT NULL,
+        frame_ms BLOB NOT NULL,
+        frames BLOB NOT NULL);
+
+        -- append-only log of inserted matches; derived tables keep a seq watermark
+        CREATE TABLE IF NOT EXISTS ingest_changelog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_id TEXT NOT NULL,
+        ingested_at INTEGER NOT NULL DEFAULT (strftime('%s','now')));
         """)
+    migrate_db(conn)
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {r[1] for r in conn.execute(f"PRAGMA table_info({table})").fetchall()}
+
+
+def migrate_db(conn: sqlite3.Connection) -> list[str]:
+    """Add any schema columns missing from an older database. Returns the added columns."""
+    existing = table_columns(conn, "participants")
+    added = []
+    for column, sql_type, _ in PARTICIPANT_EXTRA_COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE participants ADD COLUMN {column} {sql_type}")
+            added.append(column)
+    if "patch_id" not in table_columns(conn, "matches"):
+        # derived from game_version, so the backfill is a single UPDATE rather than a backfill.py job
+        conn.execute("ALTER TABLE matches ADD COLUMN patch_id INTEGER")
+        conn.create_function("patch_id", 1, patch_id, deterministic=True)
+        conn.execute("UPDATE matches SET patch_id = patch_id(game_version)")
+        added.append("matches.patch_id")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_matches_patch ON matches(patch_id, queue_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_participants_team_position ON participants(team_position)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ingest_changelog_match ON ingest_changelog(match_id)")
+    conn.commit()
+    if added:
+        print(f"Added columns: {', '.join(added)}")
+    return added
+
+def init_feature_tables(conn: sqlite3.Connection) -> None:
+    """Watermarks of derived tables (player_features changelog seq, duo_pairs build number)."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS feature_watermarks (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    conn.commit()
+
+
+def get_watermark(conn: sqlite3.Connection, name: str) -> int | None:
+    row = conn.execute("SELECT value FROM feature_watermarks WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else None
+
+
+def set_watermark(conn: sqlite3.Connection, name: str, value: int) -> None:
+    conn.execute("""
+        INSERT INTO feature_watermarks (name, value) VALUES (?, ?)
+        ON CONFLICT(name) DO UPDATE SET value = excluded.value, updated_at = CURRENT_TIMESTAMP
+    """, (name, value))
+
 
 def match_exists(conn: sqlite3.Connection, match_id: str) -> bool:
     row = conn.execute("SELECT 1 FROM matches WHERE match_id = ? LIMIT 1", (match_id,)).fetchone()
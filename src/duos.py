@@ -0,0 +1,159 @@
+"""
+Duo detection from same-team co-occurrence.
+
+Every (match, team) is a row of a sparse incidence matrix A over integer
+encoded puuids, so C = A.T @ A counts for each pair of players how many
+games they played on the same team (the diagonal is games per player).
+The product is taken in blocks of player rows and only pairs reaching
+MIN_GAMES_TOGETHER are kept from each block, so memory stays bounded by the
+candidate pairs rather than every pair that ever shared a team once.
+
+A pair is flagged as a likely duo when they were teammates in at least
+MIN_GAMES_TOGETHER games and that is at least MIN_SHARE of the games of the
+less active of the two; solo-queue matchmaking rarely puts the same two
+players together that often by chance. Results go to duo_pairs (puuid_a <
+puuid_b), which player_performance reads for its with_duo feature.
+
+    python src/duos.py
+    python src/duos.py --min-games 3 --min-share 0.2
+"""
+from __future__ import annotations
+
+import argparse
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from db import DEFAULT_DB_PATH, connect, connect_readonly, get_watermark, init_feature_tables, set_watermark
+from instrumentation import span
+from shards import require_unsharded
+
+DUO_TABLE = "duo_pairs"
+MIN_GAMES_TOGETHER = 5
+MIN_SHARE = 0.3
+BLOCK_PLAYERS = 50_000
+
+
+def load_team_rows(conn: sqlite3.Connection) -> pd.DataFrame:
+    require_unsharded(conn, "duos")
+    return pd.read_sql_query("SELECT match_id, team_id, puuid FROM participants", conn)
+
+
+def incidence_matrix(rows: pd.DataFrame) -> tuple[sparse.csr_matrix, np.ndarray]:
+    """(teams x players) 0/1 matrix and the puuid for each column."""
+    team_codes, _ = pd.factorize(pd.MultiIndex.from_arrays([rows["match_id"], rows["team_id"]]))
+    player_codes, puuids = pd.factorize(rows["puuid"])
+    data = np.ones(len(rows), dtype=np.int32)
+    a = sparse.csr_matrix((data, (team_codes, player_codes)), shape=(team_codes.max() + 1, len(puuids)))
+    a.data[:] = 1  # a duplicated participant row must not count twice
+    return a, np.asarray(puuids)
+
+
+def co_occurrence(a: sparse.csr_matrix, min_games: int = MIN_GAMES_TOGETHER,
+                  block: int = BLOCK_PLAYERS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(i, j, games together) for player pairs i < j with at least min_games shared team games."""
+    at = a.T.tocsr()
+    out_i, out_j, out_n = [], [], []
+    for start in range(0, at.shape[0], block):
+        c = (at[start:start + block] @ a).tocoo()
+        i = c.row.astype(np.int64) + start
+        keep = (c.col > i) & (c.data >= min_games)
+        out_i.append(i[keep])
+        out_j.append(c.col[keep].astype(np.int64))
+        out_n.append(c.data[keep].astype(np.int64))
+    if not out_i:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(out_i), np.concatenate(out_j), np.concatenate(out_n)
+
+
+def find_duos(rows: pd.DataFrame, min_games: int = MIN_GAMES_TOGETHER, min_share: float = MIN_SHARE) -> pd.DataFrame:
+    """Likely duo pairs from participant rows (match_id, team_id, puuid)."""
+    columns = ["puuid_a", "puuid_b", "games_together", "games_a", "games_b", "share"]
+    if rows.empty:
+        return pd.DataFrame(columns=columns)
+    with span("duo_incidence") as sp:
+        a, puuids = incidence_matrix(rows)
+        sp.rows = a.nnz
+    with span("duo_cooccurrence") as sp:
+        i, j, together = co_occurrence(a, min_games)
+        sp.rows = len(i)
+
+    games = np.asarray(a.sum(axis=0)).ravel()
+    share = together / np.minimum(games[i], games[j])
+    keep = share >= min_share
+    i, j = i[keep], j[keep]
+    # store each pair once with puuid_a < puuid_b, whatever the column order was
+    pa, pb = puuids[i], puuids[j]
+    swap = pa > pb
+    ga, gb = games[i], games[j]
+    return pd.DataFrame({
+        "puuid_a": np.where(swap, pb, pa),
+        "puuid_b": np.where(swap, pa, pb),
+        "games_together": together[keep],
+        "games_a": np.where(swap, gb, ga),
+        "games_b": np.where(swap, ga, gb),
+        "share": share[keep],
+    }, columns=columns)
+
+
+def save_duos(conn: sqlite3.Connection, duos: pd.DataFrame) -> None:
+    """Replace duo_pairs and bump its build number in feature_watermarks (query_service watches it)."""
+    init_feature_tables(conn)
+    with conn:
+        set_watermark(conn, DUO_TABLE, (get_watermark(conn, DUO_TABLE) or 0) + 1)
+        duos.to_sql(DUO_TABLE, conn, if_exists="replace", index=False)
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{DUO_TABLE}_pair ON {DUO_TABLE}(puuid_a, puuid_b)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{DUO_TABLE}_b ON {DUO_TABLE}(puuid_b)")
+
+
+def load_duos(conn: sqlite3.Connection) -> pd.DataFrame:
+    """Saved duo pairs; empty when duos.py has not been run on this database."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (DUO_TABLE,)).fetchone()
+    if not exists:
+        return pd.DataFrame(columns=["puuid_a", "puuid_b"])
+    return pd.read_sql_query(f"SELECT puuid_a, puuid_b FROM {DUO_TABLE}", conn)
+
+
+def with_duo_flag(df: pd.DataFrame, duos: pd.DataFrame) -> pd.Series:
+    """1 for rows (match_id, team_id, puuid) where a flagged duo partner is on the same team."""
+    if duos.empty or df.empty:
+        return pd.Series(0, index=df.index, dtype="int64")
+    team = df[["match_id", "team_id", "puuid"]].assign(row=np.arange(len(df)))
+    pairs = team.merge(team, on=["match_id", "team_id"], suffixes=("_a", "_b"))
+    pairs = pairs[pairs["puuid_a"] < pairs["puuid_b"]]
+    hit = pairs.merge(duos[["puuid_a", "puuid_b"]], on=["puuid_a", "puuid_b"])
+    flag = np.zeros(len(df), dtype="int64")
+    flag[hit["row_a"].to_numpy()] = 1
+    flag[hit["row_b"].to_numpy()] = 1
+    return pd.Series(flag, index=df.index)
+
+
+@span("build_duos")
+def build(db_path=DEFAULT_DB_PATH, min_games: int = MIN_GAMES_TOGETHER, min_share: float = MIN_SHARE) -> pd.DataFrame:
+    reader = connect_readonly(db_path)
+    with span("duo_load_rows") as sp:
+        rows = load_team_rows(reader)
+        sp.rows = len(rows)
+    reader.close()
+
+    duos = find_duos(rows, min_games, min_share)
+    conn = connect(db_path)
+    save_duos(conn, duos)
+    conn.close()
+    print(f"Duos: {len(duos)} pairs (>= {min_games} games together, share >= {min_share}) "
+          f"from {len(rows)} participant rows -> {DUO_TABLE}")
+    return duos
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detect likely duo partners from same-team co-occurrence")
+    parser.add_argument("--min-games", type=int, default=MIN_GAMES_TOGETHER)
+    parser.add_argument("--min-share", type=float, default=MIN_SHARE)
+    args = parser.parse_args()
+    build(min_games=args.min_games, min_share=args.min_share)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,23 +4,33 @@ from typing import Tuple
 import pandas as pd
 import numpy as np
 
-from db import connect
-from days_since_patch import ms_since_patch, ms_since_post_patch, ms_since_pre_patch
-from riot_api import fetch_json
-
-BASELINE_GAMES = 20
-BASELINE_GPM = float
-BASELINE_DPT = float
+from db import DEFAULT_DB_PATH, connect
+from days_since_patch import PATCH_ID
+from instrumentation import span
+from partitions import N_PARTITIONS, connect_partition_reader, map_partitions, partition_clause
+from player_baselines import BASELINE_N, init_baselines
+from shards import require_unsharded
+
+BASELINE_GAMES = BASELINE_N
+# z-score thresholds: gold/min this far below baseline AND deaths/10 this far above
+BASELINE_GPM = 1.0
+BASELINE_DPT = 1.0
 
 DATABASE = "player_match_stats"
-PLAYER_CSV = "Data/Processed/player_performance.csv"
-
-def load_games(conn) -> pd.DataFrame:
-    patch_start = ms_since_patch
-    patch_end = ms_since_post_patch
-
-    query = f"""SELECT puuid, game_creation, gold_per_min, deaths_per_10 FROM {DATABASE} WHERE game_creation >= ? AND game_creation < ?"""
-    df = pd.read_sql_query(query, conn, params=(patch_start, patch_end))
+PLAYER_CSV = Path("Data/Processed/player_performance.csv")
+
+def load_games(conn, part: int | None = None, k: int | None = None) -> pd.DataFrame:
+    require_unsharded(conn, "giveup_label")
+    # games on the patch under study, by matches.patch_id like meta_detection/player_performance
+    query = f"""SELECT s.puuid, s.game_creation, m.game_start_timestamp, s.gold_per_min, s.deaths_per_10
+    FROM {DATABASE} s JOIN matches m ON m.match_id = s.match_id
+    WHERE m.patch_id = :patch"""
+    params = {"patch": PATCH_ID}
+    if part is not None:
+        # one PUUID-hash partition; conn needs crc32 (partitions.connect_partition_reader)
+        query += " AND " + partition_clause("s.puuid")
+        params.update(part=part, k=k)
+    df = pd.read_sql_query(query, conn, params=params)
     df = df.dropna(subset=["gold_per_min", "deaths_per_10"])
     return df
 
@@ -36,7 +46,7 @@ def label_player_games(group: pd.DataFrame) -> pd.DataFrame:
 
     gpm_mean = baseline["gold_per_min"].mean()
     gpm_std = baseline["gold_per_min"].std(ddof=0)
-    dpt_mean = baseline["deaths_per_10"].mean
+    dpt_mean = baseline["deaths_per_10"].mean()
     dpt_std = baseline["deaths_per_10"].std(ddof=0)
 
     if gpm_std == 0 or np.isnan(gpm_std):
@@ -47,32 +57,84 @@ def label_player_games(group: pd.DataFrame) -> pd.DataFrame:
     rest["z_gpm"] = (rest["gold_per_min"] - gpm_mean) / gpm_std
     rest["z_dpt"] = (rest["deaths_per_10"] - dpt_mean) / dpt_std
 
-    rest["give_up_game"] = (rest["z_gpm"] <= -BASELINE_GPM) & (rest["z_dpt"] >= BASELINE_DPT).astype(int)
+    rest["give_up_game"] = ((rest["z_gpm"] <= -BASELINE_GPM) & (rest["z_dpt"] >= BASELINE_DPT)).astype(int)
 
     baseline["give_up_game"] = 0
 
     labeled = pd.concat([baseline, rest], ignore_index=True)
     return labeled
 
-def compute_player_labels(games: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    labeled_games = (
-        games.groupby("puuid", group_keys=False)
-        .apply(label_player_games)
-        .reset_index(drop=True)
+def label_games_from_baselines(conn, games: pd.DataFrame) -> pd.DataFrame:
+    """Vectorised labels using the player_baselines table instead of a per-player pass.
+
+    The post_first window there is the same first BASELINE_GAMES games after the
+    patch that label_player_games recomputes, so this is one join plus column math.
+    """
+    base = pd.read_sql_query(
+        """SELECT puuid, post_first_count AS n,
+                  post_first_gold_per_min_mean AS gpm_mean, post_first_gold_per_min_m2 AS gpm_m2,
+                  post_first_deaths_per_10_mean AS dpt_mean, post_first_deaths_per_10_m2 AS dpt_m2,
+                  json_extract(post_first_games, '$[#-1][0]') AS baseline_end
+           FROM player_baselines WHERE post_first_count > 0""",
+        conn,
     )
+    df = games.merge(base, on="puuid", how="left")
+
+    gpm_std = np.sqrt(df["gpm_m2"] / df["n"]).replace(0, .000001)
+    dpt_std = np.sqrt(df["dpt_m2"] / df["n"]).replace(0, .000001)
+    z_gpm = (df["gold_per_min"] - df["gpm_mean"]) / gpm_std
+    z_dpt = (df["deaths_per_10"] - df["dpt_mean"]) / dpt_std
+
+    in_baseline = df["game_start_timestamp"] <= df["baseline_end"]
+    give_up = ((z_gpm <= -BASELINE_GPM) & (z_dpt >= BASELINE_DPT) & ~in_baseline).astype(float)
+    too_few = df.groupby("puuid")["puuid"].transform("size") <= BASELINE_GAMES
+    give_up[too_few | df["n"].isna()] = np.nan
+
+    df["give_up_game"] = give_up
+    return df.drop(columns=["n", "gpm_mean", "gpm_m2", "dpt_mean", "dpt_m2", "baseline_end"])
+
+def compute_player_labels(games: pd.DataFrame, conn=None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-game and per-player labels; pass conn to use the online baselines table."""
+    if conn is not None:
+        labeled_games = label_games_from_baselines(conn, games)
+    else:
+        labeled_games = pd.concat(
+            [label_player_games(g) for _, g in games.groupby("puuid")],
+            ignore_index=True,
+        )
     agg = (
-        labeled_games.groupby("puuid")["give_up_games"]
+        labeled_games.groupby("puuid")["give_up_game"]
         .agg(["count", "sum"])
         .reset_index()
         .rename(columns={"count": "total_games", "sum": "give_up_count"})
         )
     
-    agg["give_up"] = (agg["give_up_count"] > 0).astype(int)
+    agg["gave_up"] = (agg["give_up_count"] > 0).astype(int)
     agg["player_give_up_rate"] = agg["give_up_count"] / agg["total_games"]
 
     return labeled_games, agg
 
+def label_partition(db_path, part: int, k: int) -> pd.DataFrame:
+    """Worker: per-player labels for one PUUID-hash partition (labels only depend on the player's own games)."""
+    conn = connect_partition_reader(db_path)
+    try:
+        games = load_games(conn, part, k)
+    finally:
+        conn.close()
+    if games.empty:
+        return pd.DataFrame()
+    return compute_player_labels(games)[1]
+
+def compute_player_labels_partitioned(db_path, k: int = N_PARTITIONS, workers: int | None = None) -> pd.DataFrame:
+    """Per-player labels built partition by partition in a process pool; never holds every game at once."""
+    parts = [p for p in map_partitions(label_partition, db_path, k, workers) if not p.empty]
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=["puuid", "total_games", "give_up_count", "gave_up", "player_give_up_rate"])
+
 def get_summoner_level(puuid: str) -> int | None:
+    # imported here so the labelling functions work offline (riot_api needs RIOT_API_KEY)
+    from riot_api import fetch_json
+
     url = f"https://na1.api.riotgames.com/lol/summoner/v4/summoners/by-puuid/{puuid}"
     data = fetch_json(url)
 
@@ -139,12 +201,32 @@ def update_player_performance(player_labels: pd.DataFrame) -> None:
     merged.to_csv(PLAYER_CSV, index=False)
     print(f"{PLAYER_CSV} Updated")
 
-def main():
+def main(partitions: int | None = None, workers: int | None = None):
+    if partitions:
+        with span("compute_player_labels_partitioned") as sp:
+            player_labels = compute_player_labels_partitioned(DEFAULT_DB_PATH, partitions, workers)
+            sp.rows = len(player_labels)
+        with span("update_player_performance"):
+            update_player_performance(player_labels)
+        return
+
     conn = connect()
-    games = load_games(conn)
+    with span("load_games") as sp:
+        games = load_games(conn)
+        sp.rows = len(games)
 
-    player_labels = compute_player_labels(games)
-    update_player_performance(player_labels)
+    with span("compute_player_labels") as sp:
+        init_baselines(conn)
+        _, player_labels = compute_player_labels(games, conn)
+        sp.rows = len(games)
+    with span("update_player_performance"):
+        update_player_performance(player_labels)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser(description="Label give-up games and merge per-player labels into the features")
+    parser.add_argument("--partitions", type=int, default=None,
+                        help=f"label players in K PUUID-hash partitions (e.g. {N_PARTITIONS}) in a process pool")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    main(args.partitions, args.workers)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""
+Cross-validated give-up risk models on the player feature table.
+
+Predicts gave_up (giveup_label) from the baseline/post/delta columns of
+player_performance, exposure_meta(_lane) and the summoner level bucket with
+a logistic regression and a histogram gradient boosting model, over a small
+hyperparameter grid with stratified K folds.
+
+The post_* window of player_performance is the player's first games on the
+patch, which is also giveup_label's reference window: gave_up compares later
+games against that window's gold/min and deaths/10, and a player with no game
+after it cannot be labelled at all. So post_gold, post_deaths and post_ngames
+(and their delta_* columns) overlap the label and inflate the AUC. --features
+picks the columns:
+
+    baseline      pre-patch baseline_* only
+    pre_outcome   everything except the label-window columns above (default)
+    all           every baseline/post/delta column, overlap included
+
+Every (model, params, fold) fit is one task in a process pool. The feature
+matrix is written once as a C-contiguous float32 .npy keyed by a hash of
+its contents, and workers memory-map it instead of receiving a pickled
+copy per task. Each fold's metrics are cached as JSON under the same key,
+so re-running after adding grid points or models only fits the new tasks.
+
+    python src/giveup_model.py
+    python src/giveup_model.py --models gbm --folds 10 --workers 8
+    python src/giveup_model.py --features all
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import average_precision_score, log_loss, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+
+# player_performance output after giveup_label has merged the labels in
+PLAYER_CSV = Path("Data/Processed/player_performance.csv")
+CACHE_DIR = Path("Data/Processed/model_cache")
+RESULTS_PATH = Path("Data/Processed/giveup_model_cv.csv")
+TARGET = "gave_up"
+LEVEL_BUCKETS = ("new", "intermediate", "veteran", "unknown")
+N_FOLDS = 5
+SEED = 0
+
+FEATURE_SETS = ("baseline", "pre_outcome", "all")
+FEATURE_SET = "pre_outcome"
+# post_/delta_ stats computed over giveup_label's reference window (see above)
+LABEL_WINDOW_STATS = ("gold", "deaths", "ngames")
+
+GRIDS = {
+    "logreg": {"C": [0.01, 0.1, 1.0, 10.0], "class_weight": [None, "balanced"]},
+    "gbm": {"learning_rate": [0.05, 0.1], "max_leaf_nodes": [15, 31], "l2_regularization": [0.0, 1.0]},
+}
+
+
+def overlaps_label(col: str) -> bool:
+    prefix, _, stat = col.partition("_")
+    return prefix in ("post", "delta") and stat in LABEL_WINDOW_STATS
+
+
+def feature_columns(df: pd.DataFrame, feature_set: str = FEATURE_SET) -> list[str]:
+    if feature_set not in FEATURE_SETS:
+        raise ValueError(f"Unknown feature set: {feature_set}")
+    if feature_set == "baseline":
+        return [c for c in df.columns if c.startswith("baseline_")]
+    cols = [c for c in df.columns if c.startswith(("baseline_", "post_", "delta_"))]
+    cols += [c for c in ("exposure_meta", "exposure_meta_lane") if c in df.columns]
+    if feature_set == "pre_outcome":
+        cols = [c for c in cols if not overlaps_label(c)]
+    return cols
+
+
+def feature_matrix(df: pd.DataFrame, feature_set: str = FEATURE_SET) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """(X float32 C-contiguous, y int8, column names); the level bucket is one-hot encoded."""
+    cols = feature_columns(df, feature_set)
+    X = df[cols].astype("float32")
+    if "experiance_from_level" in df.columns:
+        levels = pd.Categorical(df["experiance_from_level"], categories=LEVEL_BUCKETS)
+        dummies = pd.get_dummies(levels, prefix="level", dtype="float32")
+        dummies.index = df.index
+        X = pd.concat([X, dummies], axis=1)
+    y = df[TARGET].fillna(0).astype("int8").to_numpy()
+    return np.ascontiguousarray(X.to_numpy(dtype=np.float32)), y, list(X.columns)
+
+
+def cache_matrix(X: np.ndarray, y: np.ndarray, names: list[str], cache_dir: Path = CACHE_DIR) -> str:
+    """Write X/y once under a content hash and return the key."""
+    h = hashlib.sha1(X.tobytes())
+    h.update(y.tobytes())
+    h.update(json.dumps(names).encode("utf-8"))
+    key = h.hexdigest()[:16]
+    data_dir = cache_dir / key
+    if not (data_dir / "y.npy").exists():
+        data_dir.mkdir(parents=True, exist_ok=True)
+        np.save(data_dir / "X.npy", X)
+        (data_dir / "columns.json").write_text(json.dumps(names))
+        np.save(data_dir / "y.npy", y)  # written last: its presence marks a complete entry
+    return key
+
+
+def make_model(model: str, params: dict, seed: int = SEED):
+    if model == "logreg":
+        return make_pipeline(SimpleImputer(strategy="median"), StandardScaler(),
+                             LogisticRegression(max_iter=1000, **params))
+    if model == "gbm":
+        return HistGradientBoostingClassifier(max_iter=200, early_stopping=False, random_state=seed, **params)
+    raise ValueError(f"Unknown model: {model}")
+
+
+def task_path(cache_dir: Path, key: str, model: str, params: dict, n_folds: int, fold: int, seed: int) -> Path:
+    spec = json.dumps([model, params, n_folds, fold, seed], sort_keys=True)
+    return cache_dir / key / "folds" / (hashlib.sha1(spec.encode("utf-8")).hexdigest()[:16] + ".json")
+
+
+def _worker_init() -> None:
+    # one BLAS/OpenMP thread per process; the pool provides the parallelism
+    threadpool_limits(1)
+
+
+def fit_fold(cache_dir: Path, key: str, model: str, params: dict, n_folds: int, fold: int, seed: int) -> dict:
+    """Worker: fit one fold and cache its metrics."""
+    out_path = task_path(cache_dir, key, model, params, n_folds, fold, seed)
+    X = np.load(cache_dir / key / "X.npy", mmap_mode="r")
+    y = np.load(cache_dir / key / "y.npy")
+    train, test = list(StratifiedKFold(n_folds, shuffle=True, random_state=seed).split(X, y))[fold]
+
+    t0 = time.perf_counter()
+    est = make_model(model, params, seed).fit(X[train], y[train])
+    p = est.predict_proba(X[test])[:, 1]
+    both = len(np.unique(y[test])) == 2
+    result = {
+        "model": model, "params": params, "fold": fold,
+        "n_train": int(len(train)), "n_test": int(len(test)),
+        "roc_auc": float(roc_auc_score(y[test], p)) if both else None,
+        "average_precision": float(average_precision_score(y[test], p)) if both else None,
+        "log_loss": float(log_loss(y[test], p, labels=[0, 1])),
+        "fit_seconds": round(time.perf_counter() - t0, 3),
+    }
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(result))
+    os.replace(tmp, out_path)
+    return result
+
+
+def grid(model: str) -> list[dict]:
+    spec = GRIDS[model]
+    return [dict(zip(spec, values)) for values in itertools.product(*spec.values())]
+
+
+def run_cv(df: pd.DataFrame, models=tuple(GRIDS), n_folds: int = N_FOLDS, workers: int | None = None,
+           cache_dir: Path = CACHE_DIR, seed: int = SEED, feature_set: str = FEATURE_SET) -> pd.DataFrame:
+    """Grid search over `models`; one row per (model, params) with mean/std fold metrics."""
+    X, y, names = feature_matrix(df, feature_set)
+    if len(np.unique(y)) < 2 or np.bincount(y).min() < n_folds:
+        raise ValueError(f"need at least {n_folds} players in each class of {TARGET}")
+    key = cache_matrix(X, y, names, cache_dir)
+    print(f"Feature matrix {X.shape} float32 ({feature_set}), {int(y.sum())} positives, cache key {key}")
+    overlap = [c for c in names if overlaps_label(c)]
+    if overlap:
+        print(f"Caveat: {', '.join(overlap)} summarise {TARGET}'s reference window; the scores are optimistic")
+
+    tasks = [(model, params, fold) for model in models for params in grid(model) for fold in range(n_folds)]
+    results, todo = [], []
+    for model, params, fold in tasks:
+        path = task_path(cache_dir, key, model, params, n_folds, fold, seed)
+        if path.exists():
+            results.append(json.loads(path.read_text()))
+        else:
+            todo.append((model, params, fold))
+    print(f"{len(tasks)} fold fits, {len(results)} cached, {len(todo)} to run")
+
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_worker_init) as pool:
+            futures = [pool.submit(fit_fold, cache_dir, key, m, p, n_folds, f, seed) for m, p, f in todo]
+            for i, fut in enumerate(as_completed(futures), start=1):
+                results.append(fut.result())
+                if i % 10 == 0 or i == len(futures):
+                    print(f"[{i}/{len(futures)}] folds fitted")
+
+    folds = pd.DataFrame(results)
+    folds["params"] = folds["params"].map(lambda p: json.dumps(p, sort_keys=True))
+    summary = (
+        folds.groupby(["model", "params"])
+        .agg(roc_auc=("roc_auc", "mean"), roc_auc_std=("roc_auc", "std"),
+             average_precision=("average_precision", "mean"), log_loss=("log_loss", "mean"),
+             folds=("fold", "size"), fit_seconds=("fit_seconds", "sum"))
+        .reset_index()
+        .sort_values(["model", "roc_auc"], ascending=[True, False], ignore_index=True)
+    )
+    summary.insert(0, "feature_set", feature_set)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validated give-up risk models")
+    parser.add_argument("--models", nargs="+", choices=list(GRIDS), default=list(GRIDS))
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--features", choices=FEATURE_SETS, default=FEATURE_SET,
+                        help="feature columns; 'all' includes ones overlapping the label window")
+    args = parser.parse_args()
+
+    df = pd.read_csv(PLAYER_CSV)
+    if TARGET not in df.columns:
+        raise RuntimeError(f"{PLAYER_CSV} has no {TARGET} column; run giveup_label.py first")
+    t0 = time.perf_counter()
+    summary = run_cv(df, args.models, args.folds, args.workers, seed=args.seed, feature_set=args.features)
+    RESULTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(RESULTS_PATH, index=False)
+    print(summary.groupby("model").head(3).to_string(index=False))
+    print(f"Saved CV results to {RESULTS_PATH} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
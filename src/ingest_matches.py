@@ -1,10 +1,18 @@
 import sqlite3
-import json
 import time
 from typing import Optional
 
-from db import connect, init_db, match_exists
-from riot_api import fetch_match
+from days_since_patch import patch_id
+from db import (DEFAULT_DB_PATH, PARTICIPANT_EXTRA_COLUMNS, connect, connect_writer, init_db, match_exists,
+                maybe_checkpoint)
+from instrumentation import incr, span
+from match_payload import decode_match
+from meta_stream import init_meta_stream, update_match_meta_stream
+from ingest_priority import needs_probe, prioritize, probe_sample
+from player_baselines import init_baselines, update_match_baselines
+from riot_api import fetch_match_raw, fetch_timeline_raw
+from sketches import init_sketches, update_match_sketches
+from timelines import insert_timeline, pack_timeline
 
 def cache_get_db(conn: sqlite3.Connection, match_id: str) -> dict | None:
     row = conn.execute(
@@ -14,26 +22,31 @@ def cache_get_db(conn: sqlite3.Connection, match_id: str) -> dict | None:
     if row is None:
         return None
     # row is sqlite3.Row because db.connect sets row_factory
-    return json.loads(row["json"])
+    return decode_match(row["json"])
 
-def cache_put_db(conn: sqlite3.Connection, match_id: str, match_json: dict) -> None:
+def cache_put_raw(conn: sqlite3.Connection, match_id: str, raw: bytes, schema: str = "main") -> None:
+    """Store the response body as received - no decode/re-encode round trip."""
     conn.execute(
-        "INSERT OR REPLACE INTO match_cache (match_id, json) VALUES (?, ?)",
-        (match_id, json.dumps(match_json))
+        f"INSERT OR REPLACE INTO {schema}.match_cache (match_id, json) VALUES (?, ?)",
+        (match_id, raw.decode("utf-8"))
     )
 
 
-def insert_match(conn: sqlite3.Connection, match_id: str, match_json: dict) -> None:
+def insert_match(conn: sqlite3.Connection, match_id: str, match_json: dict, schema: str = "main") -> None:
+    """
+    matches/participants rows go to `schema` (an attached patch shard in sharded
+    mode); the changelog, baselines, sketches and meta stream always live in the main database.
+    """
     info = match_json.get("info", {})
     meta = match_json.get("metadata", {})  # not used yet, but fine
 
-    conn.execute("""
-      INSERT INTO matches (
+    conn.execute(f"""
+      INSERT INTO {schema}.matches (
         match_id, game_creation, game_duration, game_end_timestamp,
         game_mode, game_type, game_version, platform_id,
-        queue_id, map_id, game_name, game_start_timestamp
+        queue_id, map_id, game_name, game_start_timestamp, patch_id
       )
-      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
       match_id,
       info.get("gameCreation"),
@@ -47,50 +60,81 @@ def insert_match(conn: sqlite3.Connection, match_id: str, match_json: dict) -> N
       info.get("mapId"),
       info.get("gameName"),
       info.get("gameStartTimestamp"),
+      patch_id(info.get("gameVersion")),
     ))
 
     participants = info.get("participants", [])
-    for p in participants:
-        conn.execute("""
-          INSERT INTO participants (
-            match_id, participant_id, puuid, summoner_name,
-            riot_id_game_name, riot_id_tagline,
-            team_id, champion_id, champion_name, champion_transform,
-            win, kills, deaths, assists,
-            total_damage_dealt_to_champions,
-            total_minions_killed, neutral_minions_killed,
-            vision_score, gold_earned, champ_level,
-            role, lane
-          )
-          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-          match_id,
-          p.get("participantId"),
-          p.get("puuid"),
-          p.get("summonerName"),
-          p.get("riotIdGameName"),
-          p.get("riotIdTagline"),
-          p.get("teamId"),
-          p.get("championId"),
-          p.get("championName"),
-          p.get("championTransform"),
-          int(bool(p.get("win"))),
-          p.get("kills"),
-          p.get("deaths"),
-          p.get("assists"),
-          p.get("totalDamageDealtToChampions"),
-          p.get("totalMinionsKilled"),
-          p.get("neutralMinionsKilled"),
-          p.get("visionScore"),
-          p.get("goldEarned"),
-          p.get("champLevel"),
-          p.get("role"),
-          p.get("lane"),
-        ))
-
-def main(limit: Optional[int] = None) -> None:
-    conn = connect()
+    conn.executemany(PARTICIPANT_INSERT_SQL.format(schema=schema),
+                     [participant_row(match_id, p) for p in participants])
+    conn.execute("INSERT INTO ingest_changelog (match_id) VALUES (?)", (match_id,))
+    update_match_baselines(conn, info)
+    update_match_sketches(conn, info)
+    update_match_meta_stream(conn, match_id, info)
+
+
+def extra_values(p: dict) -> list:
+    """Values for db.PARTICIPANT_EXTRA_COLUMNS; booleans stored as 0/1."""
+    out = []
+    for _, _, key in PARTICIPANT_EXTRA_COLUMNS:
+        v = p.get(key)
+        out.append(int(v) if isinstance(v, bool) else v)
+    return out
+
+
+def participant_row(match_id: str, p: dict) -> tuple:
+    return (
+        match_id,
+        p.get("participantId"),
+        p.get("puuid"),
+        p.get("summonerName"),
+        p.get("riotIdGameName"),
+        p.get("riotIdTagline"),
+        p.get("teamId"),
+        p.get("championId"),
+        p.get("championName"),
+        p.get("championTransform"),
+        int(bool(p.get("win"))),
+        p.get("kills"),
+        p.get("deaths"),
+        p.get("assists"),
+        p.get("totalDamageDealtToChampions"),
+        p.get("totalMinionsKilled"),
+        p.get("neutralMinionsKilled"),
+        p.get("visionScore"),
+        p.get("goldEarned"),
+        p.get("champLevel"),
+        p.get("role"),
+        p.get("lane"),
+        *extra_values(p),
+    )
+
+
+_EXTRA_NAMES = [c for c, _, _ in PARTICIPANT_EXTRA_COLUMNS]
+PARTICIPANT_INSERT_SQL = f"""
+  INSERT INTO {{schema}}.participants (
+    match_id, participant_id, puuid, summoner_name,
+    riot_id_game_name, riot_id_tagline,
+    team_id, champion_id, champion_name, champion_transform,
+    win, kills, deaths, assists,
+    total_damage_dealt_to_champions,
+    total_minions_killed, neutral_minions_killed,
+    vision_score, gold_earned, champ_level,
+    role, lane,
+    {", ".join(_EXTRA_NAMES)}
+  )
+  VALUES ({", ".join(["?"] * (22 + len(_EXTRA_NAMES)))})
+"""
+
+def main(limit: Optional[int] = None, db_path=DEFAULT_DB_PATH, order: str = "added", timelines: bool = False) -> None:
+    """
+    order='window' ingests matches estimated inside the analysis window first (see ingest_priority).
+    timelines=True also fetches each match's timeline into match_timelines.
+    """
+    conn = connect_writer(db_path)
     init_db(conn)
+    init_baselines(conn)
+    init_sketches(conn)
+    init_meta_stream(conn)
 
     tables = [r["name"] for r in conn.execute(
         "SELECT name FROM sqlite_master WHERE type='table'"
@@ -101,12 +145,25 @@ def main(limit: Optional[int] = None) -> None:
             "You're connected to the wrong database file."
         )
 
+    sql_limit = limit if order == "added" else None
     rows = conn.execute(
         "SELECT match_id FROM match_ids ORDER BY added_at ASC"
-        + (" LIMIT ?" if limit is not None else ""),
-        (() if limit is None else (limit,))
+        + (" LIMIT ?" if sql_limit is not None else ""),
+        (() if sql_limit is None else (sql_limit,))
     ).fetchall()
     match_ids = [r["match_id"] for r in rows]
+    probe_len = 0
+    if order != "added":
+        match_ids = [m for m in match_ids if not match_exists(conn, m)]
+        if needs_probe(conn, match_ids):
+            # ingest a spread-out sample first; the rest is ordered once those anchor the estimate
+            probe = probe_sample(match_ids)
+            probed = set(probe)
+            match_ids = probe + [m for m in match_ids if m not in probed]
+            probe_len = len(probe)
+            print(f"Probing {probe_len} ids to anchor match id -> start time")
+        else:
+            match_ids = prioritize(conn, match_ids, order)[:limit]
 
     print(f"Loaded {len(match_ids)} match ids from DB")
 
@@ -117,8 +174,16 @@ def main(limit: Optional[int] = None) -> None:
     inserted = 0
     skipped = 0
     failed = 0
+    t_start = time.perf_counter()
 
     for q, match_id in enumerate(match_ids, start=1):
+        if q == probe_len + 1 and probe_len:
+            # the list iterator reads by index, so reordering the unvisited tail is safe
+            rest = prioritize(conn, match_ids[q - 1:], order)
+            match_ids[q - 1:] = rest if limit is None else rest[:max(limit - probe_len, 0)]
+            if len(match_ids) < q:
+                break
+            match_id = match_ids[q - 1]
         try:
             if match_exists(conn, match_id):
                 skipped += 1
@@ -126,26 +191,51 @@ def main(limit: Optional[int] = None) -> None:
 
             match_json = cache_get_db(conn, match_id)
             if match_json is None:
-                match_json = fetch_match(match_id)
-                with conn:
-                    cache_put_db(conn, match_id, match_json)
-
-            with conn:
+                incr("ingest_cache_misses_total")
+                with span("fetch_match", quiet=True):
+                    raw = fetch_match_raw(match_id)
+                with span("sqlite_commit", quiet=True, table="match_cache"), conn:
+                    cache_put_raw(conn, match_id, raw)
+                with span("decode_match", quiet=True):
+                    match_json = decode_match(raw)
+            else:
+                incr("ingest_cache_hits_total")
+
+            timeline = None
+            if timelines:
+                try:
+                    with span("fetch_timeline", quiet=True):
+                        timeline = pack_timeline(fetch_timeline_raw(match_id))
+                except Exception as e:
+                    incr("ingest_timeline_failures_total")
+                    print(f"FAILED timeline match_id={match_id}: {e}")
+
+            with span("sqlite_commit", quiet=True, table="matches"), conn:
                 insert_match(conn, match_id, match_json)
+                if timeline is not None:
+                    insert_timeline(conn, match_id, timeline)
 
             inserted += 1
+            incr("ingest_matches_inserted_total")
 
             if q % 25 == 0:
-                print(f"[{q}/{len(match_ids)}] inserted={inserted}, skipped={skipped}, failed={failed}")
+                elapsed = time.perf_counter() - t_start
+                print(f"[{q}/{len(match_ids)}] inserted={inserted}, skipped={skipped}, failed={failed}, "
+                      f"{inserted / elapsed:.2f} matches/s")
+                maybe_checkpoint(conn, db_path)
 
             if q % 50 == 0:
                 time.sleep(0.25)
 
         except Exception as e:
             failed += 1
+            incr("ingest_matches_failed_total")
             print(f"FAILED match_id={match_id}: {e}")
 
-    print(f"Process Finished: inserted={inserted}, skipped={skipped}, failed={failed}")
+    elapsed = time.perf_counter() - t_start
+    print(f"Process Finished: inserted={inserted}, skipped={skipped}, failed={failed} in {elapsed:.1f}s")
 
 if __name__ == "__main__":
-    main(limit=None)
+    import sys
+    main(limit=None, order="window" if "--window-first" in sys.argv[1:] else "added",
+         timelines="--timelines" in sys.argv[1:])
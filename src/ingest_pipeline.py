@@ -0,0 +1,326 @@
+"""
+Producer/consumer version of ingest_matches.
+
+Fetcher threads pull pending match ids, read match_cache or call the API,
+and decode the payload; results go onto a bounded queue drained by a single
+writer (the main thread) that group-commits cache rows, matches and
+participants in one transaction per batch. The queue bound is the
+backpressure: when the writer falls behind, fetchers block instead of
+piling decoded matches up in memory.
+
+Because only one connection ever writes and each transaction is short,
+match_id_grabber can crawl against the same riot.db at the same time.
+
+With --shards, matches/participants/cache rows go to per-patch shard files
+(see shards.py) while the changelog, baselines and sketches stay in riot.db.
+
+With --timelines, fetchers also download each match's timeline and pack it
+(timelines.py) before queueing, so the writer only inserts one blob row.
+
+    python src/ingest_pipeline.py --fetchers 4 --batch 50
+    python src/ingest_pipeline.py --shards Data/Raw/shards
+    python src/ingest_pipeline.py --order window    # analysis-window matches first
+    python src/ingest_pipeline.py --timelines
+"""
+import argparse
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+from days_since_patch import patch_id
+from db import DEFAULT_DB_PATH, connect_readonly, connect_writer, init_db, maybe_checkpoint
+from ingest_matches import cache_put_raw, insert_match
+from ingest_priority import ORDERS, needs_probe, prioritize, probe_sample
+from instrumentation import incr, observe, span
+from match_id_grabber import init_db as init_crawl_tables
+from match_payload import decode_match
+from meta_stream import init_meta_stream
+from player_baselines import init_baselines
+from sketches import init_sketches
+from riot_api import fetch_match_raw, fetch_timeline_raw
+from shards import MAX_ATTACHED, ShardSet, mark_sharded
+from timelines import insert_timeline, pack_timeline
+
+FETCHERS = 4
+QUEUE_SIZE = 200
+BATCH_SIZE = 50
+BATCH_SECONDS = 2.0
+
+_DONE = object()
+
+
+def pending_match_ids(conn: sqlite3.Connection, limit: Optional[int] = None) -> list[str]:
+    """
+    Queued ids not ingested yet (in matches, or in the changelog for sharded
+    rows) and not rejected (e.g. for a finalised shard), oldest first.
+    """
+    rows = conn.execute(
+        """SELECT q.match_id FROM match_ids q
+           WHERE NOT EXISTS (SELECT 1 FROM matches m WHERE m.match_id = q.match_id)
+             AND NOT EXISTS (SELECT 1 FROM ingest_changelog c WHERE c.match_id = q.match_id)
+             AND NOT EXISTS (SELECT 1 FROM rejected_match_ids r WHERE r.match_id = q.match_id)
+           ORDER BY q.added_at ASC"""
+        + (" LIMIT ?" if limit is not None else ""),
+        (() if limit is None else (limit,))
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
+def fetch_packed_timeline(match_id: str) -> tuple | None:
+    """Fetch and pack a timeline; None on failure, since timelines are optional for a match."""
+    try:
+        with span("fetch_timeline", quiet=True):
+            return pack_timeline(fetch_timeline_raw(match_id))
+    except Exception as e:
+        incr("ingest_timeline_failures_total")
+        print(f"FAILED timeline match_id={match_id}: {e}")
+        return None
+
+
+def fetcher(db_path: Path, ids: "queue.Queue[str | object]", out: queue.Queue, timelines: bool = False) -> None:
+    """
+    Producer: match id -> (match_id, raw bytes or None if cached, decoded match or error,
+    packed timeline or None).
+    """
+    reader = connect_readonly(db_path)
+    try:
+        while True:
+            match_id = ids.get()
+            if match_id is _DONE:
+                return
+            try:
+                row = reader.execute("SELECT json FROM match_cache WHERE match_id = ?", (match_id,)).fetchone()
+                if row is not None:
+                    incr("ingest_cache_hits_total")
+                    raw, match_json = None, decode_match(row[0])
+                else:
+                    incr("ingest_cache_misses_total")
+                    with span("fetch_match", quiet=True):
+                        raw = fetch_match_raw(match_id)
+                    match_json = decode_match(raw)
+            except Exception as e:
+                out.put((match_id, None, e, None))
+                continue
+            out.put((match_id, raw, match_json, fetch_packed_timeline(match_id) if timelines else None))
+    finally:
+        reader.close()
+        out.put(_DONE)
+
+
+def batch_patches(batch: list[tuple], shards: ShardSet | None = None) -> dict[str, int]:
+    """
+    match_id -> patch for the decoded matches of a batch that have a parseable
+    gameVersion; with `shards`, matches whose shard is finalised are left out.
+    """
+    final = set(shards.manifest()) if shards is not None else set()
+    out = {}
+    for match_id, _, match_json, _ in batch:
+        if isinstance(match_json, Exception):
+            continue
+        patch = patch_id(match_json.get("info", {}).get("gameVersion"))
+        if patch is not None and str(patch) not in final:
+            out[match_id] = patch
+    return out
+
+
+def finalised_matches(batch: list[tuple], shards: ShardSet | None) -> dict[str, int]:
+    """match_id -> patch for the matches of a batch whose shard is finalised (read-only)."""
+    if shards is None:
+        return {}
+    final = set(shards.manifest())
+    return {m: p for m, p in batch_patches(batch).items() if str(p) in final}
+
+
+def split_by_patch_count(batch: list[tuple], shards: ShardSet | None = None,
+                         limit: int = MAX_ATTACHED) -> list[list[tuple]]:
+    """Consecutive sub-batches that each span at most `limit` distinct writable patches."""
+    patches = batch_patches(batch, shards)
+    chunks, seen = [[]], set()
+    for item in batch:
+        patch = patches.get(item[0])
+        if patch is not None and patch not in seen and len(seen) >= limit:
+            chunks.append([])
+            seen = set()
+        if patch is not None:
+            seen.add(patch)
+        chunks[-1].append(item)
+    return [c for c in chunks if c]
+
+
+def batch_schemas(conn: sqlite3.Connection, batch: list[tuple], shards: ShardSet | None) -> dict[str, str]:
+    """
+    match_id -> schema to write to. The batch's shards are attached together
+    here, since ATTACH cannot run inside a transaction; the batch must span at
+    most MAX_ATTACHED writable patches (see split_by_patch_count). Matches of
+    finalised shards get no schema (see finalised_matches).
+    """
+    if shards is None:
+        return {}
+    patches = batch_patches(batch, shards)
+    names = shards.attach_many(conn, patches.values())
+    return {match_id: names[patch] for match_id, patch in patches.items()}
+
+
+def write_batch(conn: sqlite3.Connection, batch: list[tuple], shards: ShardSet | None = None) -> tuple[int, int]:
+    """
+    Single writer: one transaction per batch. Returns (inserted, failed).
+    A match from a finalised shard's patch cannot be written anywhere; it counts
+    as failed and goes to rejected_match_ids so later runs do not fetch it again.
+    """
+    if shards is not None and len(set(batch_patches(batch, shards).values())) > MAX_ATTACHED:
+        inserted = failed = 0
+        for chunk in split_by_patch_count(batch, shards):
+            ok, bad = write_batch(conn, chunk, shards)
+            inserted, failed = inserted + ok, failed + bad
+        return inserted, failed
+
+    inserted = failed = 0
+    schemas = batch_schemas(conn, batch, shards)
+    finalised = finalised_matches(batch, shards)
+    with span("sqlite_commit", quiet=True, table="batch") as sp, conn:
+        conn.execute("BEGIN")  # explicit, so the per-match savepoints nest inside it
+        for match_id, raw, match_json, timeline in batch:
+            if isinstance(match_json, Exception):
+                failed += 1
+                print(f"FAILED match_id={match_id}: {match_json}")
+                continue
+            if match_id in finalised:
+                conn.execute("INSERT OR IGNORE INTO rejected_match_ids(match_id, queue_id) VALUES(?, ?)",
+                             (match_id, match_json.get("info", {}).get("queueId")))
+                incr("ingest_finalised_shard_total")
+                failed += 1
+                print(f"FAILED match_id={match_id}: shard {finalised[match_id]} is finalised; rejected")
+                continue
+            schema = schemas.get(match_id, "main")
+            conn.execute("SAVEPOINT one_match")
+            try:
+                if raw is not None:
+                    cache_put_raw(conn, match_id, raw, schema)
+                insert_match(conn, match_id, match_json, schema)
+                if timeline is not None:
+                    insert_timeline(conn, match_id, timeline, schema)
+                conn.execute("RELEASE one_match")
+                inserted += 1
+            except Exception as e:
+                # hooks in insert_match (baselines, sketches, meta_stream) can raise on a malformed payload
+                conn.execute("ROLLBACK TO one_match")
+                conn.execute("RELEASE one_match")
+                failed += 1
+                print(f"FAILED insert match_id={match_id}: {type(e).__name__}: {e}")
+        sp.rows = len(batch)
+    return inserted, failed
+
+
+def ingest_ids(conn: sqlite3.Connection, db_path, match_ids: list[str], fetchers: int = FETCHERS,
+               queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+               shards: ShardSet | None = None, timelines: bool = False) -> tuple[int, int]:
+    """Fetch `match_ids` in order on `fetchers` threads and write them from this thread. Returns (inserted, failed)."""
+    ids: queue.Queue = queue.Queue()
+    for mid in match_ids:
+        ids.put(mid)
+    for _ in range(fetchers):
+        ids.put(_DONE)
+
+    out: queue.Queue = queue.Queue(maxsize=queue_size)
+    threads = [
+        threading.Thread(target=fetcher, args=(Path(db_path), ids, out, timelines), daemon=True, name=f"fetcher-{i}")
+        for i in range(fetchers)
+    ]
+    for t in threads:
+        t.start()
+
+    inserted = failed = 0
+    running = fetchers
+    batch: list[tuple] = []
+    last_flush = time.perf_counter()
+    t_start = last_flush
+
+    while running:
+        try:
+            item = out.get(timeout=BATCH_SECONDS)
+        except queue.Empty:
+            item = None
+        if item is _DONE:
+            running -= 1
+        elif item is not None:
+            batch.append(item)
+
+        due = time.perf_counter() - last_flush >= BATCH_SECONDS
+        if batch and (len(batch) >= batch_size or due or not running):
+            observe("ingest_queue_depth", out.qsize(), emit=False)
+            ok, bad = write_batch(conn, batch, shards)
+            inserted += ok
+            failed += bad
+            incr("ingest_matches_inserted_total", ok)
+            incr("ingest_matches_failed_total", bad)
+            maybe_checkpoint(conn, db_path)
+            batch = []
+            last_flush = time.perf_counter()
+
+            done = inserted + failed
+            elapsed = last_flush - t_start
+            print(f"[{done}/{len(match_ids)}] inserted={inserted}, failed={failed}, "
+                  f"{inserted / elapsed:.2f} matches/s, queue={out.qsize()}")
+
+    for t in threads:
+        t.join()
+    return inserted, failed
+
+
+def main(limit: Optional[int] = None, db_path=DEFAULT_DB_PATH, fetchers: int = FETCHERS,
+         queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE, shard_root=None,
+         order: str = "added", timelines: bool = False) -> None:
+    """order: 'added' (crawl order), 'window' (analysis-window matches first) or 'window-only'."""
+    conn = connect_writer(db_path)
+    init_db(conn)
+    init_crawl_tables(conn)  # match_ids and rejected_match_ids
+    init_baselines(conn)
+    init_sketches(conn)
+    init_meta_stream(conn)
+    shards = ShardSet(shard_root) if shard_root else None
+    if shards is not None:
+        # after the init_* rebuilds, which read riot.db's own matches
+        mark_sharded(conn, shards.root)
+    t_start = time.perf_counter()
+    inserted = failed = 0
+
+    if order == "added":
+        match_ids = pending_match_ids(conn, limit)
+        print(f"Loaded {len(match_ids)} pending match ids from DB")
+    else:
+        match_ids = pending_match_ids(conn)
+        print(f"Loaded {len(match_ids)} pending match ids from DB")
+        if match_ids and needs_probe(conn, match_ids):
+            probe = probe_sample(match_ids)
+            print(f"Probing {len(probe)} ids to anchor match id -> start time")
+            ok, bad = ingest_ids(conn, db_path, probe, fetchers, queue_size, batch_size, shards, timelines)
+            inserted, failed = inserted + ok, failed + bad
+            probed = set(probe)
+            match_ids = [m for m in match_ids if m not in probed]
+        match_ids = prioritize(conn, match_ids, order)
+        if limit is not None:
+            match_ids = match_ids[:max(limit - inserted - failed, 0)]
+
+    if match_ids:
+        ok, bad = ingest_ids(conn, db_path, match_ids, fetchers, queue_size, batch_size, shards, timelines)
+        inserted, failed = inserted + ok, failed + bad
+    conn.close()
+    print(f"Process Finished: inserted={inserted}, failed={failed} in {time.perf_counter() - t_start:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Threaded ingest with a single SQLite writer")
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--fetchers", type=int, default=FETCHERS)
+    parser.add_argument("--queue", type=int, default=QUEUE_SIZE, help="max decoded matches waiting for the writer")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="matches per commit")
+    parser.add_argument("--shards", default=None, help="write matches to per-patch shard files in this directory")
+    parser.add_argument("--order", choices=ORDERS, default="added",
+                        help="'window' fetches matches inside the analysis window first")
+    parser.add_argument("--timelines", action="store_true", help="also fetch and store match timelines")
+    args = parser.parse_args()
+    main(limit=args.limit, fetchers=args.fetchers, queue_size=args.queue, batch_size=args.batch,
+         shard_root=args.shards, order=args.order, timelines=args.timelines)
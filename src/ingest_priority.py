@@ -0,0 +1,117 @@
+"""
+Ingest scheduling by usefulness to the analysis windows.
+
+Match ids carry a per-platform sequence number that grows with game start
+time (NA1_5200000000 is older than NA1_5200100000). Matches already in the
+database pin that mapping down, so every pending id gets an estimated start
+time by interpolating between those anchors (linear fit outside them).
+Pending ids are then ordered:
+
+    1. estimated inside [PRE_PATCH, POST_PATCH)   - what meta_detection and
+       player_performance read; nearest the patch first, since the last
+       pre-patch and first post-patch games fill the baseline/post windows
+    2. everything else, in crawl order
+
+With fewer than two anchors, a small probe spread across the id range is
+ingested first to create them (see probe_sample).
+"""
+from __future__ import annotations
+
+import re
+import sqlite3
+from collections import defaultdict
+
+import numpy as np
+
+from days_since_patch import ms_since_patch, ms_since_post_patch, ms_since_pre_patch
+
+WINDOW_START = ms_since_pre_patch()
+PATCH = ms_since_patch()
+WINDOW_END = ms_since_post_patch()
+PROBE_SAMPLES = 16
+ORDERS = ("added", "window", "window-only")
+
+_ID_RE = re.compile(r"^([A-Z0-9]+)_(\d+)$")
+
+
+def split_match_id(match_id: str) -> tuple[str, int] | None:
+    m = _ID_RE.match(match_id)
+    return (m.group(1), int(m.group(2))) if m else None
+
+
+def load_anchors(conn: sqlite3.Connection) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """platform -> (sorted id sequence numbers, game start ms) from ingested matches."""
+    points = defaultdict(list)
+    # main plus any attached patch shards (ingest_pipeline --shards)
+    for schema in [r[1] for r in conn.execute("PRAGMA database_list").fetchall() if r[1] != "temp"]:
+        for match_id, ts in conn.execute(
+            f"SELECT match_id, game_start_timestamp FROM {schema}.matches WHERE game_start_timestamp IS NOT NULL"
+        ):
+            parsed = split_match_id(match_id)
+            if parsed:
+                points[parsed[0]].append((parsed[1], ts))
+    out = {}
+    for platform, pts in points.items():
+        arr = np.array(sorted(pts), dtype=np.float64)
+        if len(np.unique(arr[:, 0])) >= 2:
+            out[platform] = (arr[:, 0], arr[:, 1])
+    return out
+
+
+def estimate_start(match_ids: list[str], anchors: dict) -> np.ndarray:
+    """Estimated game start (ms) per id; NaN for platforms without anchors or unparseable ids."""
+    est = np.full(len(match_ids), np.nan)
+    by_platform = defaultdict(list)
+    for i, mid in enumerate(match_ids):
+        parsed = split_match_id(mid)
+        if parsed and parsed[0] in anchors:
+            by_platform[parsed[0]].append((i, parsed[1]))
+    for platform, items in by_platform.items():
+        seq_known, ts_known = anchors[platform]
+        idx = np.array([i for i, _ in items])
+        seq = np.array([s for _, s in items], dtype=np.float64)
+        slope, intercept = np.polyfit(seq_known, ts_known, 1)
+        inside = (seq >= seq_known[0]) & (seq <= seq_known[-1])
+        est[idx] = np.where(inside, np.interp(seq, seq_known, ts_known), slope * seq + intercept)
+    return est
+
+
+def prioritize(conn: sqlite3.Connection, match_ids: list[str], order: str = "window") -> list[str]:
+    """Reorder (and for 'window-only', filter) pending ids. Input order is the crawl order."""
+    if order == "added" or not match_ids:
+        return match_ids
+    if order not in ORDERS:
+        raise ValueError(f"Unknown order: {order}")
+    est = estimate_start(match_ids, load_anchors(conn))
+    in_window = (est >= WINDOW_START) & (est < WINDOW_END)
+    crawl_rank = np.arange(len(match_ids))
+    # in-window first by distance to the patch, then the rest in crawl order
+    key_primary = np.where(in_window, 0, 1)
+    key_secondary = np.where(in_window, np.abs(est - PATCH), crawl_rank)
+    ranked = np.lexsort((key_secondary, key_primary))
+    if order == "window-only":
+        ranked = ranked[in_window[ranked]]
+    print(f"Priority: {int(in_window.sum())}/{len(match_ids)} pending ids estimated inside the analysis window"
+          + (f", {int(np.isnan(est).sum())} without an estimate" if np.isnan(est).any() else ""))
+    return [match_ids[i] for i in ranked]
+
+
+def needs_probe(conn: sqlite3.Connection, match_ids: list[str]) -> bool:
+    anchors = load_anchors(conn)
+    platforms = {p[0] for p in map(split_match_id, match_ids) if p}
+    return any(p not in anchors for p in platforms)
+
+
+def probe_sample(match_ids: list[str], n: int = PROBE_SAMPLES) -> list[str]:
+    """Ids evenly spread over each platform's sequence range, ingested first to create anchors."""
+    by_platform = defaultdict(list)
+    for mid in match_ids:
+        parsed = split_match_id(mid)
+        if parsed:
+            by_platform[parsed[0]].append((parsed[1], mid))
+    out = []
+    for items in by_platform.values():
+        items.sort()
+        picks = np.unique(np.linspace(0, len(items) - 1, min(n, len(items))).round().astype(int))
+        out.extend(items[i][1] for i in picks)
+    return out
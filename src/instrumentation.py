@@ -0,0 +1,225 @@
+"""
+Lightweight timing/metrics layer shared by the pipeline stages.
+
+Nothing needs editing to turn it on; everything is driven by environment
+variables:
+
+    PIPELINE_METRICS=Data/Metrics/run.jsonl   one JSON object per span/observation
+    PIPELINE_METRICS=Data/Metrics/run.prom    Prometheus text file written at exit
+    PIPELINE_PROFILE=build_player_features    cProfile these spans ("all" for every span)
+    PIPELINE_TRACEMALLOC=1                    record the memory peak of profiled spans
+    PIPELINE_PRINT_SPANS=0                    silence the "<span>: 1.234 s" console lines
+
+Usage:
+
+    with span("load_player_games") as s:
+        df = load()
+        s.rows = len(df)
+
+    @span("detect_meta_champs")
+    def detect_meta_champs(conn): ...
+
+    observe("riot_api_request_seconds", dt, status=200)
+    incr("riot_api_retries_total", reason="429")
+"""
+from __future__ import annotations
+
+import atexit
+import cProfile
+import json
+import os
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import ContextDecorator
+from pathlib import Path
+
+METRICS_PATH = os.getenv("PIPELINE_METRICS")
+PROFILE_SPANS = {s.strip() for s in os.getenv("PIPELINE_PROFILE", "").split(",") if s.strip()}
+TRACE_MEMORY = os.getenv("PIPELINE_TRACEMALLOC", "0") == "1"
+PRINT_SPANS = os.getenv("PIPELINE_PRINT_SPANS", "1") == "1"
+PROFILE_DIR = Path("Data/Metrics/profiles")
+
+# Seconds; covers a fast SQLite commit up to a slow pandas stage
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, dict] = {}
+_jsonl = None
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def _emit(record: dict) -> None:
+    global _jsonl
+    if not METRICS_PATH or METRICS_PATH.endswith(".prom"):
+        return
+    with _lock:
+        if _jsonl is None:
+            Path(METRICS_PATH).parent.mkdir(parents=True, exist_ok=True)
+            _jsonl = open(METRICS_PATH, "a", encoding="utf-8")
+        _jsonl.write(json.dumps(record) + "\n")
+
+
+def incr(name: str, value: float = 1, **labels) -> None:
+    """Add to a counter."""
+    with _lock:
+        k = _key(name, labels)
+        _counters[k] = _counters.get(k, 0) + value
+
+
+def observe(name: str, value: float, emit: bool = True, **labels) -> None:
+    """Record one sample into a histogram (and as a JSON line when enabled)."""
+    with _lock:
+        k = _key(name, labels)
+        h = _histograms.get(k)
+        if h is None:
+            h = _histograms[k] = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+        for i, upper in enumerate(DEFAULT_BUCKETS):
+            if value <= upper:
+                h["buckets"][i] += 1
+        h["sum"] += value
+        h["count"] += 1
+    if emit:
+        _emit({"type": "observe", "name": name, "value": value, "labels": labels, "ts": time.time()})
+
+
+class span(ContextDecorator):
+    """
+    Time a block or function. Set `.rows` inside the block to also get a
+    rows/sec figure. Durations land in the `<name>_seconds` histogram.
+    """
+
+    def __init__(self, name: str, quiet: bool = False, **labels) -> None:
+        self.name = name
+        self.quiet = quiet
+        self.labels = labels
+        self.rows: int | None = None
+        self.seconds = 0.0
+        self._profiler = None
+        self._started_tracemalloc = False
+
+    def _recreate_cm(self) -> span:
+        # fresh instance per decorated call so recursion/threads don't share timers
+        return span(self.name, self.quiet, **self.labels)
+
+    def __enter__(self) -> span:
+        self.rows = None
+        if self.name in PROFILE_SPANS or "all" in PROFILE_SPANS:
+            self._profiler = cProfile.Profile()
+            if TRACE_MEMORY:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._started_tracemalloc = True
+                tracemalloc.reset_peak()
+            self._profiler.enable()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.seconds = time.perf_counter() - self._t0
+        record = {"type": "span", "name": self.name, "seconds": round(self.seconds, 6),
+                  "labels": self.labels, "ts": time.time()}
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+            # pid + ns: partition workers and repeated spans finish within the same second
+            out = PROFILE_DIR / f"{self.name}-{os.getpid()}-{time.time_ns()}.prof"
+            self._profiler.dump_stats(out)
+            record["profile"] = str(out)
+            self._profiler = None
+            if TRACE_MEMORY:
+                record["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+                    self._started_tracemalloc = False
+
+        if self.rows is not None:
+            record["rows"] = self.rows
+            record["rows_per_sec"] = round(self.rows / self.seconds, 1) if self.seconds else None
+            incr(f"{self.name}_rows_total", self.rows, **self.labels)
+
+        observe(f"{self.name}_seconds", self.seconds, emit=False, **self.labels)
+        _emit(record)
+
+        if PRINT_SPANS and not self.quiet:
+            extra = f" ({record['rows_per_sec']} rows/s)" if record.get("rows_per_sec") else ""
+            print(f"{self.name}: {round(self.seconds, 3)} s{extra}")
+        return False
+
+
+def _prom_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+
+
+def _prom_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{_prom_name(k)}="{str(v).replace(chr(34), chr(39))}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def prometheus_text() -> str:
+    lines: list[str] = []
+    with _lock:
+        typed = set()
+        for (name, labels), value in sorted(_counters.items()):
+            n = _prom_name(name)
+            if n not in typed:
+                lines.append(f"# TYPE {n} counter")
+                typed.add(n)
+            lines.append(f"{n}{_prom_labels(labels)} {value}")
+        for (name, labels), h in sorted(_histograms.items()):
+            n = _prom_name(name)
+            if n not in typed:
+                lines.append(f"# TYPE {n} histogram")
+                typed.add(n)
+            for upper, count in zip(DEFAULT_BUCKETS, h["buckets"]):
+                lines.append(f"{n}_bucket{_prom_labels(labels, (('le', upper),))} {count}")
+            lines.append(f"{n}_bucket{_prom_labels(labels, (('le', '+Inf'),))} {h['count']}")
+            lines.append(f"{n}_sum{_prom_labels(labels)} {h['sum']}")
+            lines.append(f"{n}_count{_prom_labels(labels)} {h['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> dict:
+    """Counters and histogram count/sum/mean, keyed by name + labels."""
+    with _lock:
+        out = {"counters": {}, "histograms": {}}
+        for (name, labels), value in _counters.items():
+            out["counters"][name + _prom_labels(labels)] = value
+        for (name, labels), h in _histograms.items():
+            out["histograms"][name + _prom_labels(labels)] = {
+                "count": h["count"], "sum": round(h["sum"], 6),
+                "mean": round(h["sum"] / h["count"], 6) if h["count"] else None,
+            }
+    return out
+
+
+def flush() -> None:
+    global _jsonl
+    if not METRICS_PATH:
+        return
+    if METRICS_PATH.endswith(".prom"):
+        path = Path(METRICS_PATH)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".prom.tmp")
+        tmp.write_text(prometheus_text(), encoding="utf-8")
+        tmp.replace(path)  # node_exporter textfile collectors expect atomic swaps
+        return
+    _emit({"type": "summary", "ts": time.time(), **summary()})
+    with _lock:
+        if _jsonl is not None:
+            _jsonl.close()
+            _jsonl = None
+
+
+atexit.register(flush)
@@ -0,0 +1,117 @@
+"""
+League-v4 ladder seeding and per-tier quotas for the PUUID crawl.
+
+Instead of snowballing from a handful of hardcoded players, seed the puuids
+table from the ranked ladder of every tier/division and schedule the crawl
+so each tier fills its share of TARGET_TOTAL. Co-players found in a match
+inherit the tier of the player whose history we were crawling (solo queue
+matchmaking keeps lobbies within about a tier), and a tier stops being
+crawled as soon as its quota is met.
+"""
+import sqlite3
+
+from db import table_columns
+
+QUEUE = "RANKED_SOLO_5x5"
+DIVISIONS = ["I", "II", "III", "IV"]
+APEX_TIERS = {"MASTER": "masterleagues", "GRANDMASTER": "grandmasterleagues", "CHALLENGER": "challengerleagues"}
+
+# Approximate NA ranked solo population share per tier (apex tiers pooled)
+TIER_QUOTAS = {
+    "IRON": 0.06,
+    "BRONZE": 0.17,
+    "SILVER": 0.20,
+    "GOLD": 0.19,
+    "PLATINUM": 0.15,
+    "EMERALD": 0.13,
+    "DIAMOND": 0.07,
+    "APEX": 0.03,
+}
+SEEDS_PER_DIVISION = 25
+
+
+def stratum(tier: str) -> str:
+    return "APEX" if tier in APEX_TIERS else tier
+
+
+def migrate_crawl_tables(conn: sqlite3.Connection) -> None:
+    """Tier labels on the crawler tables (NULL for puuids seeded the old way)."""
+    if "tier" not in table_columns(conn, "puuids"):
+        conn.execute("ALTER TABLE puuids ADD COLUMN tier TEXT")
+    if "tier" not in table_columns(conn, "match_ids"):
+        conn.execute("ALTER TABLE match_ids ADD COLUMN tier TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_puuids_tier_fetched ON puuids(tier, fetched)")
+    conn.commit()
+
+
+def fetch_ladder_puuids(tier: str, division: str = "I", page: int = 1) -> list[str]:
+    # imported here so the tier tables can be used offline (riot_api needs RIOT_API_KEY)
+    from riot_api import fetch_platform
+
+    if tier in APEX_TIERS:
+        data = fetch_platform(f"/lol/league/v4/{APEX_TIERS[tier]}/by-queue/{QUEUE}")
+        entries = sorted(data.get("entries", []), key=lambda e: e.get("leaguePoints", 0), reverse=True)
+    else:
+        entries = fetch_platform(f"/lol/league/v4/entries/{QUEUE}/{tier}/{division}?page={page}")
+    return [e["puuid"] for e in entries if e.get("puuid")]
+
+
+def seed_from_ladder(conn: sqlite3.Connection, per_division: int = SEEDS_PER_DIVISION) -> int:
+    """Insert ladder puuids labelled with their tier stratum. Returns rows added."""
+    added = 0
+    for tier in ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND", *APEX_TIERS]:
+        divisions = ["I"] if tier in APEX_TIERS else DIVISIONS
+        for division in divisions:
+            try:
+                puuids = fetch_ladder_puuids(tier, division)[:per_division]
+            except Exception as e:
+                print(f"ladder {tier} {division} failed: {e}")
+                continue
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO puuids(puuid, tier) VALUES(?, ?)",
+                [(p, stratum(tier)) for p in puuids]
+            )
+            added += conn.total_changes - before
+        conn.commit()
+        print(f"seeded {tier}: {added} ladder puuids so far")
+    return added
+
+
+def tier_counts(conn: sqlite3.Connection) -> dict[str, int]:
+    rows = conn.execute("SELECT tier, COUNT(*) FROM match_ids WHERE tier IS NOT NULL GROUP BY tier").fetchall()
+    return {t: n for t, n in rows}
+
+
+def tier_targets(target_total: int) -> dict[str, int]:
+    return {t: int(round(share * target_total)) for t, share in TIER_QUOTAS.items()}
+
+
+def tier_full(conn: sqlite3.Connection, tier: str | None, target_total: int) -> bool:
+    if tier is None:
+        return False
+    return tier_counts(conn).get(tier, 0) >= tier_targets(target_total).get(tier, 0)
+
+
+def get_next_puuid_stratified(conn: sqlite3.Connection, target_total: int) -> tuple[str, str] | None:
+    """Unfetched puuid from the tier furthest below its quota, or None when every open tier is exhausted."""
+    counts = tier_counts(conn)
+    targets = tier_targets(target_total)
+    deficits = sorted(
+        ((targets[t] - counts.get(t, 0)) / max(targets[t], 1), t) for t in targets
+    )
+    for deficit, tier in reversed(deficits):
+        if deficit <= 0:
+            break
+        row = conn.execute(
+            "SELECT puuid FROM puuids WHERE fetched=0 AND tier=? ORDER BY updated_at ASC LIMIT 1",
+            (tier,)
+        ).fetchone()
+        if row:
+            return row[0], tier
+    return None
+
+
+def quota_report(conn: sqlite3.Connection, target_total: int) -> str:
+    counts = tier_counts(conn)
+    return ", ".join(f"{t} {counts.get(t, 0)}/{n}" for t, n in tier_targets(target_total).items())
@@ -0,0 +1,219 @@
+"""
+Drive match_id_grabber and ingest_matches against mock_riot_server and report
+throughput, tail latency and wasted retries.
+
+    python src/load_test.py --target 300 --error-rate 0.05 --latency-ms 40
+
+Runs against a scratch database under Data/LoadTest so the real riot.db is
+never touched.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from pathlib import Path
+
+os.environ.setdefault("RIOT_API_KEY", "offline-load-test")
+
+import ingest_matches
+import ingest_pipeline
+import match_id_grabber
+import riot_api
+from ingest_priority import ORDERS, WINDOW_END, WINDOW_START
+from mock_riot_server import MockRiotServer, load_replay, parse_rate_limits, synth_store
+
+OUT_DIR = Path("Data/LoadTest")
+
+
+class LatencyRecorder:
+    """Wraps a fetch function and records wall time per call, retries included."""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.samples: list[float] = []
+        self.failures = 0
+
+    def __call__(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return self.fn(*args, **kwargs)
+        except Exception:
+            self.failures += 1
+            raise
+        finally:
+            self.samples.append(time.perf_counter() - t0)
+
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def latency_summary(rec: LatencyRecorder) -> dict:
+    s = rec.samples
+    return {
+        "calls": len(s),
+        "failures": rec.failures,
+        "mean_ms": round(statistics.fmean(s) * 1000, 2) if s else 0.0,
+        "p50_ms": round(percentile(s, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(s, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(s, 0.99) * 1000, 2),
+        "max_ms": round(max(s) * 1000, 2) if s else 0.0,
+    }
+
+
+def snapshot(srv: MockRiotServer) -> dict:
+    with srv.lock:
+        return dict(srv.stats)
+
+
+def diff_stats(after: dict, before: dict, retries_5xx: bool = False) -> dict:
+    """
+    Server counters for one stage. Every 429 makes the client sleep and ask
+    again; a 5xx is only retried by riot_api (the ingesters), match_id_grabber
+    raises on it, so for the crawler those count as failed_5xx instead.
+    """
+    d = {k: after[k] - before.get(k, 0) for k in after}
+    d["failed_5xx"] = 0 if retries_5xx else d["server_errors"]
+    d["wasted_retries"] = d["rate_limited"] + (d["server_errors"] if retries_5xx else 0)
+    d["waste_ratio"] = round(d["wasted_retries"] / d["requests"], 4) if d["requests"] else 0.0
+    return d
+
+
+def run_crawler(srv: MockRiotServer, db_path: Path, target: int, seed_mode: str = "static") -> dict:
+    match_id_grabber.API_BASE = srv.base_url
+    riot_api.PLATFORM = srv.base_url  # league-v4 ladder seeding
+    ids_rec = LatencyRecorder(match_id_grabber.getMatchIds)
+    detail_rec = LatencyRecorder(match_id_grabber.fetch_match)
+    match_id_grabber.getMatchIds = ids_rec
+    match_id_grabber.fetch_match = detail_rec
+
+    before = snapshot(srv)
+    t0 = time.perf_counter()
+    try:
+        match_id_grabber.main(db_path=str(db_path), seed_puuids=srv.store.seed_puuids, target_total=target,
+                              seed_mode=seed_mode)
+    finally:
+        match_id_grabber.getMatchIds = ids_rec.fn
+        match_id_grabber.fetch_match = detail_rec.fn
+    elapsed = time.perf_counter() - t0
+
+    conn = match_id_grabber.connect_db(str(db_path))
+    queued = match_id_grabber.count_match_ids(conn)
+    conn.close()
+
+    return {
+        "stage": f"crawler ({seed_mode})",
+        "seconds": round(elapsed, 3),
+        "match_ids_queued": queued,
+        "ids_per_sec": round(queued / elapsed, 2) if elapsed else 0.0,
+        "ids_latency": latency_summary(ids_rec),
+        "detail_latency": latency_summary(detail_rec),
+        "server": diff_stats(snapshot(srv), before),
+    }
+
+
+def run_ingester(srv: MockRiotServer, db_path: Path, limit: int | None, fetchers: int = 0,
+                 shard_root: Path | None = None, order: str = "added", timelines: bool = False) -> dict:
+    """fetchers=0 runs the sequential ingest_matches, otherwise ingest_pipeline (optionally sharded)."""
+    riot_api.AMERICAS = srv.base_url
+    module = ingest_pipeline if fetchers else ingest_matches
+    rec = LatencyRecorder(module.fetch_match_raw)
+    module.fetch_match_raw = rec
+
+    before = snapshot(srv)
+    t0 = time.perf_counter()
+    try:
+        if fetchers:
+            ingest_pipeline.main(limit=limit, db_path=db_path, fetchers=fetchers, shard_root=shard_root,
+                                 order=order, timelines=timelines)
+        else:
+            ingest_matches.main(limit=limit, db_path=db_path, order=order, timelines=timelines)
+    finally:
+        module.fetch_match_raw = rec.fn
+    elapsed = time.perf_counter() - t0
+
+    conn = ingest_matches.connect(db_path)
+    # sharded rows are not in riot.db's matches table; the changelog sees every insert
+    inserted = conn.execute(f"SELECT COUNT(*) FROM {'ingest_changelog' if shard_root else 'matches'}").fetchone()[0]
+    in_window = None if shard_root else conn.execute(
+        "SELECT COUNT(*) FROM matches WHERE game_start_timestamp >= ? AND game_start_timestamp < ?",
+        (WINDOW_START, WINDOW_END)
+    ).fetchone()[0]
+    n_timelines = None if shard_root else conn.execute("SELECT COUNT(*) FROM match_timelines").fetchone()[0]
+    conn.close()
+
+    return {
+        "stage": "ingest_pipeline" if fetchers else "ingester",
+        "seconds": round(elapsed, 3),
+        "matches_in_db": inserted,
+        "matches_per_sec": round(inserted / elapsed, 2) if elapsed else 0.0,
+        "matches_in_window": in_window,
+        "timelines_in_db": n_timelines,
+        "fetch_latency": latency_summary(rec),
+        "server": diff_stats(snapshot(srv), before, retries_5xx=True),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the crawler and ingester offline")
+    parser.add_argument("--replay", help="riot.db whose match_cache should be served")
+    parser.add_argument("--matches", type=int, default=2000)
+    parser.add_argument("--players", type=int, default=1500)
+    parser.add_argument("--target", type=int, default=300, help="TARGET_TOTAL for the crawler")
+    parser.add_argument("--limit", type=int, default=None, help="max ids for the ingester")
+    parser.add_argument("--rate-limits", default="20:1,100:120")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-burst", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--skip-crawler", action="store_true")
+    parser.add_argument("--seed-mode", choices=["static", "ladder"], default="static")
+    parser.add_argument("--fetchers", type=int, default=0, help="use ingest_pipeline with N fetcher threads")
+    parser.add_argument("--shards", action="store_true", help="ingest_pipeline writes per-patch shard files")
+    parser.add_argument("--order", choices=ORDERS, default="added", help="ingest scheduling (see ingest_priority)")
+    parser.add_argument("--timelines", action="store_true", help="ingester also fetches match timelines")
+    args = parser.parse_args()
+
+    store = load_replay(args.replay) if args.replay else synth_store(args.matches, args.players)
+    srv = MockRiotServer(
+        ("127.0.0.1", 0), store,
+        rate_limits=parse_rate_limits(args.rate_limits),
+        error_rate=args.error_rate, error_burst=args.error_burst,
+        latency_median_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+    )
+    srv.serve_in_thread()
+
+    OUT_DIR.mkdir(parents=True, exist_ok=True)
+    run_id = time.strftime("%Y%m%d-%H%M%S")
+    db_path = OUT_DIR / f"loadtest-{run_id}.db"
+
+    results = {"run_id": run_id, "config": vars(args), "stages": []}
+    try:
+        if not args.skip_crawler:
+            results["stages"].append(run_crawler(srv, db_path, args.target, args.seed_mode))
+        else:
+            conn = match_id_grabber.connect_db(str(db_path))
+            match_id_grabber.init_db(conn)
+            match_id_grabber.insert_match_ids(conn, list(store.matches)[:args.target])
+            conn.close()
+        shard_root = OUT_DIR / f"loadtest-{run_id}-shards" if args.shards else None
+        results["stages"].append(run_ingester(srv, db_path, args.limit, args.fetchers, shard_root, args.order,
+                                                args.timelines))
+    finally:
+        srv.shutdown()
+
+    out = OUT_DIR / f"loadtest-{run_id}.json"
+    out.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    for stage in results["stages"]:
+        print(json.dumps(stage, indent=2))
+    print(f"Saved load test results to {out}")
+
+
+if __name__ == "__main__":
+    main()
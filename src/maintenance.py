@@ -0,0 +1,192 @@
+"""
+Retention and compaction for riot.db.
+
+match_cache keeps every raw payload forever, long after the match has been
+parsed into matches/participants, and is most of the file. Policies here:
+
+    archive    move cached payloads of matches older than the newest N patches
+               into gzip JSONL side files (Data/Raw/archive/match_cache_p1504.jsonl.gz),
+               or just delete them with --prune
+    vacuum     incremental vacuum (switches the file to auto_vacuum=INCREMENTAL
+               once), returning freed pages to the filesystem
+    snapshot   VACUUM INTO a compact copy
+    checkpoint wal_checkpoint(TRUNCATE)
+    report     per table/index sizes (dbstat), freelist and WAL size
+
+    python src/maintenance.py report
+    python src/maintenance.py archive --keep-patches 2
+    python src/maintenance.py vacuum --pages 10000
+    python src/maintenance.py snapshot Data/Backup/riot-compact.db
+"""
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+from db import DEFAULT_DB_PATH, checkpoint, connect_writer, init_db, wal_size
+from shards import require_unsharded
+
+ARCHIVE_DIR = DEFAULT_DB_PATH.parent / "archive"
+KEEP_PATCHES = 2
+ARCHIVE_CHUNK = 1000
+
+
+def archive_path(archive_dir: Path, patch: int | None) -> Path:
+    return archive_dir / f"match_cache_p{patch if patch is not None else 'unknown'}.jsonl.gz"
+
+
+def patches_in_db(conn: sqlite3.Connection) -> list[int]:
+    rows = conn.execute("SELECT DISTINCT patch_id FROM matches WHERE patch_id IS NOT NULL").fetchall()
+    return sorted(r[0] for r in rows)
+
+
+def archive_cache(conn: sqlite3.Connection, keep_patches: int = KEEP_PATCHES,
+                  archive_dir: Path = ARCHIVE_DIR, prune: bool = False) -> int:
+    """
+    Archive (or with prune=True delete) match_cache rows whose match is parsed
+    and older than the newest `keep_patches` patches. Each chunk is written and
+    fsynced to its archive file before the rows are deleted, so a crash leaves
+    at worst a payload in both places. Returns rows removed from match_cache.
+    """
+    require_unsharded(conn, "maintenance archive")
+    patches = patches_in_db(conn)
+    if len(patches) <= keep_patches:
+        print(f"Only {len(patches)} patches in DB; nothing older than the newest {keep_patches}")
+        return 0
+    cutoff = patches[-keep_patches]
+    print(f"Archiving cached payloads for patches < {cutoff} ({'prune' if prune else archive_dir})")
+
+    archive_dir.mkdir(parents=True, exist_ok=True)
+    removed = 0
+    last_rowid = 0
+    while True:
+        rows = conn.execute("""
+            SELECT c.rowid, c.match_id, c.fetched_at, c.json, m.patch_id
+            FROM match_cache c JOIN matches m ON m.match_id = c.match_id
+            WHERE c.rowid > ? AND m.patch_id < ?
+            ORDER BY c.rowid LIMIT ?
+        """, (last_rowid, cutoff, ARCHIVE_CHUNK)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+
+        if not prune:
+            by_patch: dict[int, list] = {}
+            for _, match_id, fetched_at, raw, patch in rows:
+                by_patch.setdefault(patch, []).append(
+                    json.dumps({"match_id": match_id, "fetched_at": fetched_at, "json": raw})
+                )
+            for patch, lines in by_patch.items():
+                # appending makes a multi-member gzip file, which gzip.open reads straight through
+                with open(archive_path(archive_dir, patch), "ab") as raw_f:
+                    with gzip.GzipFile(fileobj=raw_f, mode="ab") as f:
+                        f.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    raw_f.flush()
+                    os.fsync(raw_f.fileno())
+
+        with conn:
+            conn.executemany("DELETE FROM match_cache WHERE rowid = ?", [(r[0],) for r in rows])
+        removed += len(rows)
+        print(f"{removed} payloads {'pruned' if prune else 'archived'}")
+    return removed
+
+
+def iter_archive(path: Path):
+    """(match_id, raw json) pairs from an archive file, e.g. to re-run backfill on old patches."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            yield row["match_id"], row["json"]
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """auto_vacuum only takes effect after one full VACUUM; do that once. Returns True if it ran."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    print("Switching to auto_vacuum=INCREMENTAL (one-time full VACUUM)")
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def incremental_vacuum(conn: sqlite3.Connection, pages: int | None = None) -> int:
+    """Release up to `pages` free pages (all when None). Returns pages freed."""
+    enable_incremental_vacuum(conn)
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # drain the statement: a single step only releases one page
+    conn.execute("PRAGMA incremental_vacuum" + (f"({int(pages)})" if pages else "")).fetchall()
+    freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    checkpoint(conn, "TRUNCATE")  # the rewritten pages went through the WAL; fold them back in
+    print(f"Incremental vacuum freed {freed} pages")
+    return freed
+
+
+def vacuum_into(conn: sqlite3.Connection, dest: Path) -> Path:
+    """Compact point-in-time copy of the database (no WAL, no free pages)."""
+    dest = Path(dest)
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    if dest.exists():
+        raise FileExistsError(dest)
+    t0 = time.perf_counter()
+    conn.execute("VACUUM INTO ?", (str(dest),))
+    print(f"VACUUM INTO {dest}: {dest.stat().st_size / 2**20:.1f} MB in {time.perf_counter() - t0:.1f}s")
+    return dest
+
+
+def size_report(conn: sqlite3.Connection, db_path: Path = DEFAULT_DB_PATH) -> list[tuple[str, int]]:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    pages = conn.execute("PRAGMA page_count").fetchone()[0]
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    try:
+        sizes = conn.execute(
+            "SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY 2 DESC"
+        ).fetchall()
+    except sqlite3.OperationalError:  # SQLite built without SQLITE_ENABLE_DBSTAT_VTAB
+        sizes = []
+
+    print(f"{db_path}: {pages * page_size / 2**20:.1f} MB "
+          f"({free * page_size / 2**20:.1f} MB free pages), WAL {wal_size(db_path) / 2**20:.1f} MB")
+    for name, size in sizes:
+        print(f"  {name:<40} {size / 2**20:10.2f} MB")
+    return [(n, s) for n, s in sizes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="riot.db retention and compaction")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("report")
+    p = sub.add_parser("archive")
+    p.add_argument("--keep-patches", type=int, default=KEEP_PATCHES)
+    p.add_argument("--archive-dir", default=str(ARCHIVE_DIR))
+    p.add_argument("--prune", action="store_true", help="delete instead of archiving")
+    p = sub.add_parser("vacuum")
+    p.add_argument("--pages", type=int, default=None)
+    p = sub.add_parser("snapshot")
+    p.add_argument("dest")
+    sub.add_parser("checkpoint")
+    args = parser.parse_args()
+
+    db_path = Path(args.db)
+    conn = connect_writer(db_path)
+    init_db(conn)
+    if args.cmd == "archive":
+        archive_cache(conn, args.keep_patches, Path(args.archive_dir), args.prune)
+    elif args.cmd == "vacuum":
+        incremental_vacuum(conn, args.pages)
+    elif args.cmd == "snapshot":
+        vacuum_into(conn, Path(args.dest))
+    elif args.cmd == "checkpoint":
+        busy, log, done = checkpoint(conn, "TRUNCATE")
+        print(f"Checkpoint: {done}/{log} pages" + (" (busy)" if busy else ""))
+    size_report(conn, db_path)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,24 +3,34 @@ import os
 import time
 import requests
 from Config import api_key
+from instrumentation import incr, observe, span
+from ladder_seeding import (get_next_puuid_stratified, migrate_crawl_tables, quota_report,
+                            seed_from_ladder, tier_full)
+from match_payload import decode_match
 
 DB_PATH = "Data/Raw/riot.db"
 HEADERS = {"X-Riot-Token": api_key}
 REGION = "americas"
+API_BASE = f"https://{REGION}.api.riotgames.com"
 
 PAGE_SIZE = 100
 MAX_PAGES_PER_PUUID = 50
 TARGET_TOTAL = 25000
 SAMPLE_MATCHES = 20
 RANKED_SOLO_QUEUE = 420
+# "static": snowball from SEED_PUUIDS; "ladder": league-v4 seeds with per-tier quotas
+SEED_MODE = "static"
 
 
 def getMatchIds(puuid: str, start: int = 0, count: int = 100) -> list[str]:
-    api_url = f"https://{REGION}.api.riotgames.com/lol/match/v5/matches/by-puuid/{puuid}/ids"
+    api_url = f"{API_BASE}/lol/match/v5/matches/by-puuid/{puuid}/ids"
+    t0 = time.perf_counter()
     r = requests.get(api_url, headers=HEADERS, params={"start": start, "count": count}, timeout=20)
+    observe("riot_api_request_seconds", time.perf_counter() - t0, endpoint="ids", status=r.status_code)
 
     if r.status_code == 429:
         retry_after = int(r.headers.get("Retry-After", "2"))
+        incr("riot_api_retries_total", reason="429")
         time.sleep(retry_after)
         return getMatchIds(puuid, start, count)
 
@@ -29,24 +39,28 @@ def getMatchIds(puuid: str, start: int = 0, count: int = 100) -> list[str]:
 
 
 def fetch_match(match_id: str) -> dict:
-    """Fetch full match detail JSON for a given match ID."""
-    url = f"https://{REGION}.api.riotgames.com/lol/match/v5/matches/{match_id}"
+    """Fetch match detail for a given match ID, projected to the fields we use."""
+    url = f"{API_BASE}/lol/match/v5/matches/{match_id}"
     while True:
+        t0 = time.perf_counter()
         r = requests.get(url, headers=HEADERS, timeout=20)
+        observe("riot_api_request_seconds", time.perf_counter() - t0, endpoint="match", status=r.status_code)
 
         if r.status_code == 429:
             retry_after = int(r.headers.get("Retry-After", "2"))
+            incr("riot_api_retries_total", reason="429")
             print(f"[429] match detail {match_id} rate limit. Sleeping {retry_after}s")
             time.sleep(retry_after)
             continue
 
         r.raise_for_status()
-        return r.json()
+        return decode_match(r.content)
 
 
 def connect_db(db_path: str) -> sqlite3.Connection:
     os.makedirs(os.path.dirname(db_path), exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    # wait on the ingest writer's short group commits instead of failing with "database is locked"
+    conn = sqlite3.connect(db_path, timeout=30)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
     return conn
@@ -67,7 +81,15 @@ def init_db(conn: sqlite3.Connection) -> None:
         updated_at TEXT DEFAULT CURRENT_TIMESTAMP
     );
     """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS rejected_match_ids (
+        match_id TEXT PRIMARY KEY,
+        queue_id INTEGER,
+        added_at TEXT DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
     conn.commit()
+    migrate_crawl_tables(conn)
 
 
 def add_seed_puuids(conn: sqlite3.Connection, puuids: list[str]) -> None:
@@ -101,47 +123,93 @@ def mark_puuid_error(conn: sqlite3.Connection, puuid: str, err: str) -> None:
     conn.commit()
 
 
-def insert_match_ids(conn: sqlite3.Connection, match_ids: list[str]) -> int:
+def insert_match_ids(conn: sqlite3.Connection, match_ids: list[str], tier: str | None = None) -> int:
+    before = conn.total_changes
     conn.executemany(
-        "INSERT OR IGNORE INTO match_ids(match_id) VALUES(?)",
-        [(m,) for m in match_ids]
+        "INSERT OR IGNORE INTO match_ids(match_id, tier) VALUES(?, ?)",
+        [(m, tier) for m in match_ids]
     )
     conn.commit()
-    return conn.execute("SELECT changes()").fetchone()[0]
+    # changes() only reports the last statement of an executemany
+    return conn.total_changes - before
 
 
 def count_match_ids(conn: sqlite3.Connection) -> int:
     return conn.execute("SELECT COUNT(*) FROM match_ids").fetchone()[0]
 
 
-def add_puuids(conn: sqlite3.Connection, puuids: list[str]) -> int:
+def add_puuids(conn: sqlite3.Connection, puuids: list[str], tier: str | None = None) -> int:
+    before = conn.total_changes
     conn.executemany(
-        "INSERT OR IGNORE INTO puuids(puuid) VALUES(?)",
-        [(p,) for p in puuids]
+        "INSERT OR IGNORE INTO puuids(puuid, tier) VALUES(?, ?)",
+        [(p, tier) for p in puuids]
+    )
+    conn.commit()
+    # changes() only reports the last statement of an executemany
+    return conn.total_changes - before
+
+
+def load_seen(conn: sqlite3.Connection) -> set[str]:
+    """Every match id already inspected: queued ranked ids plus rejected non-ranked ones."""
+    seen = {r[0] for r in conn.execute("SELECT match_id FROM match_ids")}
+    seen.update(r[0] for r in conn.execute("SELECT match_id FROM rejected_match_ids"))
+    return seen
+
+
+def insert_rejected(conn: sqlite3.Connection, match_id: str, queue_id: int | None) -> None:
+    conn.execute(
+        "INSERT OR IGNORE INTO rejected_match_ids(match_id, queue_id) VALUES(?, ?)",
+        (match_id, queue_id)
     )
     conn.commit()
-    return conn.execute("SELECT changes()").fetchone()[0]
 
 
-def puuid_puller(conn: sqlite3.Connection, match_ids: list[str]) -> tuple[list[str], int]:
+def seen_hit_rate(stats: dict) -> str:
+    lookups = stats["lookups"]
+    rate = stats["hits"] / lookups if lookups else 0.0
+    return f"seen-set hits {stats['hits']}/{lookups} ({rate:.1%})"
+
+
+def puuid_puller(conn: sqlite3.Connection, match_ids: list[str], seen: set[str] | None = None,
+                 stats: dict | None = None, tier: str | None = None) -> tuple[list[str], int]:
+    """
+    Expand from up to SAMPLE_MATCHES not-yet-seen matches on this page.
+    Ids in `seen` (queued or rejected before) are skipped without a detail call.
+    New co-players inherit `tier` from the player being crawled.
+    """
+    if seen is None:
+        seen = load_seen(conn)
+    if stats is None:
+        stats = {"lookups": 0, "hits": 0}
 
     ranked_ids: list[str] = []
     pulled = 0
-    sample_ids = match_ids[:SAMPLE_MATCHES]
+    sample_ids: list[str] = []
+    for mid in match_ids:
+        if len(sample_ids) >= SAMPLE_MATCHES:
+            break
+        stats["lookups"] += 1
+        if mid in seen:
+            stats["hits"] += 1
+            incr("crawl_seen_hits_total")
+            continue
+        sample_ids.append(mid)
 
     for mid in sample_ids:
         try:
             match_json = fetch_match(mid)
             info = match_json.get("info", {})
+            seen.add(mid)
 
             if info.get("queueId") != RANKED_SOLO_QUEUE:
+                insert_rejected(conn, mid, info.get("queueId"))
                 continue
 
             ranked_ids.append(mid)
 
             participants = info.get("participants", [])
             puuids = [p.get("puuid") for p in participants if p.get("puuid")]
-            added = add_puuids(conn, puuids)
+            added = add_puuids(conn, puuids, tier)
             pulled += added
 
             time.sleep(0.05)
@@ -151,52 +219,74 @@ def puuid_puller(conn: sqlite3.Connection, match_ids: list[str]) -> tuple[list[s
     return ranked_ids, pulled
 
 
-def main():
+SEED_PUUIDS = [
+    "ZDeF5_l5PcdFrBAGZJc3FXH_rMVej7iZ_snsQl6yIZPuBZOPy2JTELg9fTtspAHE7tJzS5wy7460rQ",
+    "MQXYnF9l3o09tQMyvCjN0v_PrKbFcu7uihOCC6_QaGF1njmoXqG4FxvxSn4ezDTgVS2BnWNUmQspdw",
+    "hYfvdISfgd1KIwX6EZXM4h6vvKEG-gOb7p8a4GNn5dnR6UhrG1KcVcnYVfNKIcF9tZiZ-iepgiTldg",
+    "86L4pE0sAUM7g_9siCXOL4utfK_Y2HKpHnl8Q2k0TkDlAAs3fiC-sB-NuMwSo5OxI7uU4DLla8URCQ",
+    "APpfP4las_yrmU8DAy1Gp878ITIk1VUzTqgORnHgtYRe9q12dLqXw1kbRgn8bwlAMwqg5hGycfNs1Q",
+    "s18-zSEvvrFuXzkvSptrjjpeQV7y5BPtq2vpt7b---jl8O67lPMiVjCEpUZwiILK15m6lI7YAENBiw",
+    "MQuzRDeGH3UpCdiCgG9HDq2hFSvP3S9H_0pn48sxBYZrQm2ntVTVpXM6lOLtqIoUTOa7YQMmGXlwpQ",
+    "CC6srW-i03Q2CMlRkZ2P1e3T-GJV3oglXJAxnSRB438lQb9q26ipWjaCSnblAbp4uDPV7-KPQU8Egw",
+    "J6KXeXfpdDQJE5KWZXp8W1VdS1fqybMJyUp15XmUma1N-BxDhy-3LCdgsgdTCbX2gqPmj4fCxDpKfg",
+    "d9el1JZDXpI47SfRzwvJ_TSghao8ToiVkCkhrhOGK-6I43T3FbqjhJyuuBWzFKX62gohMBgXEPdsew",
+]
+
+
+def main(db_path: str = DB_PATH, seed_puuids: list[str] | None = None, target_total: int = TARGET_TOTAL,
+         seed_mode: str = SEED_MODE):
     if not api_key:
         raise RuntimeError("Missing api key")
+    if seed_mode not in ("static", "ladder"):
+        raise ValueError("seed_mode must be static or ladder")
 
-    seed_puuids = [
-        "ZDeF5_l5PcdFrBAGZJc3FXH_rMVej7iZ_snsQl6yIZPuBZOPy2JTELg9fTtspAHE7tJzS5wy7460rQ",
-        "MQXYnF9l3o09tQMyvCjN0v_PrKbFcu7uihOCC6_QaGF1njmoXqG4FxvxSn4ezDTgVS2BnWNUmQspdw",
-        "hYfvdISfgd1KIwX6EZXM4h6vvKEG-gOb7p8a4GNn5dnR6UhrG1KcVcnYVfNKIcF9tZiZ-iepgiTldg",
-        "86L4pE0sAUM7g_9siCXOL4utfK_Y2HKpHnl8Q2k0TkDlAAs3fiC-sB-NuMwSo5OxI7uU4DLla8URCQ",
-        "APpfP4las_yrmU8DAy1Gp878ITIk1VUzTqgORnHgtYRe9q12dLqXw1kbRgn8bwlAMwqg5hGycfNs1Q",
-        "s18-zSEvvrFuXzkvSptrjjpeQV7y5BPtq2vpt7b---jl8O67lPMiVjCEpUZwiILK15m6lI7YAENBiw",
-        "MQuzRDeGH3UpCdiCgG9HDq2hFSvP3S9H_0pn48sxBYZrQm2ntVTVpXM6lOLtqIoUTOa7YQMmGXlwpQ",
-        "CC6srW-i03Q2CMlRkZ2P1e3T-GJV3oglXJAxnSRB438lQb9q26ipWjaCSnblAbp4uDPV7-KPQU8Egw",
-        "J6KXeXfpdDQJE5KWZXp8W1VdS1fqybMJyUp15XmUma1N-BxDhy-3LCdgsgdTCbX2gqPmj4fCxDpKfg",
-        "d9el1JZDXpI47SfRzwvJ_TSghao8ToiVkCkhrhOGK-6I43T3FbqjhJyuuBWzFKX62gohMBgXEPdsew",
-    ]
-
-    conn = connect_db(DB_PATH)
+    conn = connect_db(db_path)
     init_db(conn)
-    add_seed_puuids(conn, seed_puuids)
+    if seed_mode == "ladder":
+        if conn.execute("SELECT 1 FROM puuids WHERE tier IS NOT NULL LIMIT 1").fetchone() is None:
+            seed_from_ladder(conn)
+    else:
+        add_seed_puuids(conn, seed_puuids or SEED_PUUIDS)
 
     print("Current queued match IDs:", count_match_ids(conn))
-
-    while count_match_ids(conn) < TARGET_TOTAL:
-        puuid = get_next_puuid(conn)
+    seen = load_seen(conn)
+    seen_stats = {"lookups": 0, "hits": 0}
+    print(f"Seen-set loaded with {len(seen)} match ids")
+
+    while count_match_ids(conn) < target_total:
+        if seed_mode == "ladder":
+            nxt = get_next_puuid_stratified(conn, target_total)
+            puuid, tier = nxt if nxt else (None, None)
+        else:
+            puuid, tier = get_next_puuid(conn), None
         if not puuid:
-            print("No more unfetched PUUIDs.")
+            print("No more unfetched PUUIDs." if seed_mode == "static" else "Every open tier is out of PUUIDs.")
             break
 
         try:
             start = 0
             pages = 0
-            while count_match_ids(conn) < TARGET_TOTAL:
+            while count_match_ids(conn) < target_total:
+                if tier_full(conn, tier, target_total):
+                    print(f"Tier {tier} quota reached")
+                    break
                 ids = getMatchIds(puuid, start=start, count=PAGE_SIZE)
                 if not ids:
                     print("End of match history")
                     break
 
-                ranked_ids, new_puuids = puuid_puller(conn, ids)
+                with span("crawl_page", quiet=True) as sp:
+                    ranked_ids, new_puuids = puuid_puller(conn, ids, seen, seen_stats, tier)
+                    sp.rows = len(ids)
+                incr("crawl_pages_total")
 
                 if not ranked_ids:
                     print("No solo queue matches on this page")
                 else:
-                    added = insert_match_ids(conn, ranked_ids)
+                    added = insert_match_ids(conn, ranked_ids, tier)
                     total = count_match_ids(conn)
-                    print(f"total ranked matches = {total}/{TARGET_TOTAL}")
+                    print(f"total ranked matches = {total}/{target_total} (page {sp.seconds:.2f}s, "
+                          f"{seen_hit_rate(seen_stats)})")
 
                     if new_puuids:
                         unfetched = conn.execute(
@@ -221,6 +311,9 @@ def main():
         time.sleep(0.1)
 
     print("Done. Total queued match IDs:", count_match_ids(conn))
+    if seed_mode == "ladder":
+        print("Per-tier quotas:", quota_report(conn, target_total))
+    print(seen_hit_rate(seen_stats))
 
     total_puuids = conn.execute("SELECT COUNT(*) FROM puuids").fetchone()[0]
     unfetched_puuids = conn.execute("SELECT COUNT(*) FROM puuids WHERE fetched=0").fetchone()[0]
@@ -0,0 +1,107 @@
+"""
+Fast decoding of match-v5 payloads down to the fields we actually persist.
+
+A ranked match payload is ~100-200 KB, most of it per-participant
+`challenges`, `perks` and missions blocks that insert_match never reads.
+decode_match() turns the raw response bytes into a small dict with the same
+shape as the API response ({"metadata": ..., "info": {..., "participants": [...]}})
+but only the projected keys, using the fastest decoder installed:
+
+    orjson  - full decode in C, then projection (fastest)
+    ijson   - streaming parse, only projected values are ever materialised
+    json    - stdlib fallback
+
+The raw bytes are left untouched so they can go straight into match_cache.
+"""
+from __future__ import annotations
+
+import json
+
+from db import PARTICIPANT_EXTRA_COLUMNS
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # optional streaming fallback
+    ijson = None
+
+METADATA_FIELDS = ("matchId",)
+
+MATCH_FIELDS = (
+    "gameCreation", "gameDuration", "gameEndTimestamp", "gameMode", "gameType",
+    "gameVersion", "platformId", "queueId", "mapId", "gameName", "gameStartTimestamp",
+)
+
+PARTICIPANT_FIELDS = (
+    "participantId", "puuid", "summonerName", "riotIdGameName", "riotIdTagline",
+    "teamId", "championId", "championName", "championTransform",
+    "win", "kills", "deaths", "assists",
+    "totalDamageDealtToChampions", "totalMinionsKilled", "neutralMinionsKilled",
+    "visionScore", "goldEarned", "champLevel", "role", "lane",
+) + tuple(key for _, _, key in PARTICIPANT_EXTRA_COLUMNS)
+
+
+def loads(raw: bytes | str):
+    """Decode a JSON document with orjson when available."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def project_match(obj: dict) -> dict:
+    """Keep only the fields ingest reads from an already decoded payload."""
+    meta = obj.get("metadata", {})
+    info = obj.get("info", {})
+    out_info = {k: info[k] for k in MATCH_FIELDS if k in info}
+    out_info["participants"] = [
+        {k: p[k] for k in PARTICIPANT_FIELDS if k in p}
+        for p in info.get("participants", [])
+    ]
+    return {
+        "metadata": {k: meta[k] for k in METADATA_FIELDS if k in meta},
+        "info": out_info,
+    }
+
+
+_SCALAR_EVENTS = {"string", "number", "boolean", "null"}
+
+
+def _stream_project(raw: bytes | str) -> dict:
+    """ijson path: walk parse events and keep projected scalars only."""
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+    meta_keys = {f"metadata.{k}": k for k in METADATA_FIELDS}
+    info_keys = {f"info.{k}": k for k in MATCH_FIELDS}
+    part_keys = {f"info.participants.item.{k}": k for k in PARTICIPANT_FIELDS}
+
+    meta: dict = {}
+    info: dict = {"participants": []}
+    current: dict | None = None
+    for prefix, event, value in ijson.parse(raw, use_float=True):
+        if prefix == "info.participants.item":
+            if event == "start_map":
+                current = {}
+            elif event == "end_map":
+                info["participants"].append(current)
+                current = None
+            continue
+        if event not in _SCALAR_EVENTS:
+            continue
+        if current is not None and prefix in part_keys:
+            current[part_keys[prefix]] = value
+        elif prefix in info_keys:
+            info[info_keys[prefix]] = value
+        elif prefix in meta_keys:
+            meta[meta_keys[prefix]] = value
+    return {"metadata": meta, "info": info}
+
+
+def decode_match(raw: bytes | str) -> dict:
+    """Raw match-v5 response body -> projected match dict."""
+    if orjson is None and ijson is not None:
+        return _stream_project(raw)
+    return project_match(loads(raw))
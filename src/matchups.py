@@ -0,0 +1,236 @@
+"""
+Champion x champion matchup matrices.
+
+games[l, a, b] counts matches where champion a faced champion b and
+wins[l, a, b] how many of those a won. Layer 0 is the whole enemy team
+(every 5x5 cross-team pair), layers 1..5 are direct lane opponents by
+teamPosition. Matrices are dense over a compact champion index, built from
+participants in one vectorised pass and saved to MATRIX_PATH together with
+the ingest_changelog seq they cover, so update() only folds in new matches.
+
+    python src/matchups.py                         # incremental update (full build if none saved)
+    python src/matchups.py --full
+    python src/matchups.py --champ 157 --lane MIDDLE   # best/worst lane opponents
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from db import DEFAULT_DB_PATH, connect
+from instrumentation import span
+from shards import require_unsharded
+
+MATRIX_PATH = Path("Data/Processed/matchups.npz")
+LANES = ("TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY")
+LAYERS = ("ALL",) + LANES
+
+
+@dataclass
+class MatchupMatrix:
+    champion_ids: np.ndarray  # sorted int64, row/column order of the matrices
+    games: np.ndarray         # int32 (len(LAYERS), K, K)
+    wins: np.ndarray          # int32 (len(LAYERS), K, K)
+    seq: int = 0              # ingest_changelog seq folded in so far
+
+    @classmethod
+    def empty(cls) -> "MatchupMatrix":
+        shape = (len(LAYERS), 0, 0)
+        return cls(np.zeros(0, dtype=np.int64), np.zeros(shape, np.int32), np.zeros(shape, np.int32))
+
+    @classmethod
+    def load(cls, path: Path = MATRIX_PATH) -> "MatchupMatrix":
+        with np.load(path) as z:
+            return cls(z["champion_ids"], z["games"], z["wins"], int(z["seq"]))
+
+    def save(self, path: Path = MATRIX_PATH) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez_compressed(tmp, champion_ids=self.champion_ids, games=self.games, wins=self.wins,
+                            seq=np.int64(self.seq))
+        os.replace(tmp, path)
+
+    def index_of(self, champion_ids) -> np.ndarray:
+        """Matrix index per champion id (-1 if never seen)."""
+        ids = np.asarray(champion_ids, dtype=np.int64)
+        if len(self.champion_ids) == 0:
+            return np.full(ids.shape, -1)
+        pos = np.searchsorted(self.champion_ids, ids).clip(max=len(self.champion_ids) - 1)
+        return np.where(self.champion_ids[pos] == ids, pos, -1)
+
+    def _grow(self, champion_ids: np.ndarray) -> None:
+        new_ids = np.union1d(self.champion_ids, champion_ids)
+        if len(new_ids) == len(self.champion_ids):
+            return
+        k = len(new_ids)
+        remap = np.searchsorted(new_ids, self.champion_ids)
+        games = np.zeros((len(LAYERS), k, k), np.int32)
+        wins = np.zeros((len(LAYERS), k, k), np.int32)
+        games[:, remap[:, None], remap[None, :]] = self.games
+        wins[:, remap[:, None], remap[None, :]] = self.wins
+        self.champion_ids, self.games, self.wins = new_ids, games, wins
+
+    def add(self, rows: pd.DataFrame) -> int:
+        """Fold participant rows (match_id, team_id, champion_id, team_position, win) in. Returns matches used."""
+        if rows.empty:
+            return 0
+        self._grow(rows["champion_id"].unique())
+        champ, pos, blue_win = team_arrays(rows, self.champion_ids)
+        k = len(self.champion_ids)
+        size = len(LAYERS) * k * k
+
+        # layer 0: every blue champ against every red champ, both directions
+        a = np.broadcast_to(champ[:, 0, :, None], (len(champ), 5, 5)).ravel()
+        b = np.broadcast_to(champ[:, 1, None, :], (len(champ), 5, 5)).ravel()
+        w = np.broadcast_to(blue_win[:, None, None], (len(champ), 5, 5)).ravel()
+        flat = [a * k + b, b * k + a]
+        won = [w, 1 - w]
+
+        # lane layers: only matches where both teams have each position once
+        lane_ok = (pos == np.arange(5)).all(axis=(1, 2))
+        if lane_ok.any():
+            lc, lw = champ[lane_ok], blue_win[lane_ok]
+            layer = np.broadcast_to(np.arange(1, 6), lc[:, 0, :].shape)
+            a, b = lc[:, 0, :].ravel(), lc[:, 1, :].ravel()
+            w = np.broadcast_to(lw[:, None], lc[:, 0, :].shape).ravel()
+            base = layer.ravel() * k * k
+            flat += [base + a * k + b, base + b * k + a]
+            won += [w, 1 - w]
+
+        idx = np.concatenate(flat)
+        self.games += np.bincount(idx, minlength=size).reshape(self.games.shape).astype(np.int32)
+        self.wins += np.bincount(idx, weights=np.concatenate(won), minlength=size) \
+            .reshape(self.wins.shape).astype(np.int32)
+        return len(champ)
+
+    def winrate(self, champ: int, opponent: int, lane: str | None = None) -> tuple[float, int]:
+        """(win rate of champ vs opponent, games). NaN win rate when they never met."""
+        ia, ib = self.index_of([champ, opponent])
+        if ia < 0 or ib < 0:
+            return float("nan"), 0
+        layer = LAYERS.index(lane or "ALL")
+        n = int(self.games[layer, ia, ib])
+        return (self.wins[layer, ia, ib] / n if n else float("nan")), n
+
+    def winrates(self, champs, opponents, lane_layers) -> np.ndarray:
+        """Vectorised winrate lookups; lane_layers are indexes into LAYERS. NaN where unseen."""
+        ia, ib = self.index_of(champs), self.index_of(opponents)
+        layers = np.asarray(lane_layers)
+        ok = (ia >= 0) & (ib >= 0) & (layers >= 0)
+        out = np.full(len(ia), np.nan)
+        g = self.games[layers[ok], ia[ok], ib[ok]]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[ok] = np.where(g > 0, self.wins[layers[ok], ia[ok], ib[ok]] / g, np.nan)
+        return out
+
+    def opponents(self, champ: int, lane: str | None = None, min_games: int = 1) -> pd.DataFrame:
+        """Every opponent of champ in a layer, sorted by champ's win rate."""
+        i = self.index_of([champ])[0]
+        if i < 0:
+            return pd.DataFrame(columns=["opponent_id", "games", "winrate"])
+        layer = LAYERS.index(lane or "ALL")
+        games = self.games[layer, i]
+        keep = games >= min_games
+        df = pd.DataFrame({
+            "opponent_id": self.champion_ids[keep],
+            "games": games[keep],
+            "winrate": self.wins[layer, i][keep] / games[keep],
+        })
+        return df.sort_values("winrate", ascending=False, ignore_index=True)
+
+
+def team_arrays(rows: pd.DataFrame, champion_ids: np.ndarray):
+    """
+    Participant rows -> (champ idx (M,2,5), position idx (M,2,5), blue win (M,)) for
+    complete 5v5 matches, blue side first and each team ordered by position.
+    """
+    df = rows[["match_id", "team_id", "champion_id", "team_position", "win"]]
+    per_team = df.groupby(["match_id", "team_id"])["champion_id"].transform("size")
+    teams = df.groupby("match_id")["team_id"].transform("nunique")
+    df = df[(per_team == 5) & (teams == 2)]
+    pos = pd.Categorical(df["team_position"], categories=LANES).codes.astype(np.int64)
+    pos = np.where(pos < 0, len(LANES), pos)  # unknown positions sort last and fail the lane check
+    order = np.lexsort((pos, df["team_id"].to_numpy(), df["match_id"].to_numpy()))
+
+    m = len(df) // 10
+    champ = np.searchsorted(champion_ids, df["champion_id"].to_numpy()[order]).reshape(m, 2, 5)
+    pos = pos[order].reshape(m, 2, 5)
+    blue_win = df["win"].to_numpy()[order].reshape(m, 2, 5)[:, 0, 0].astype(np.int64)
+    return champ, pos, blue_win
+
+
+def load_rows(conn: sqlite3.Connection, since_seq: int | None = None, until_seq: int | None = None) -> pd.DataFrame:
+    """Participants of every match, or only matches ingested in (since_seq, until_seq]."""
+    require_unsharded(conn, "matchups")
+    query = """
+        SELECT p.match_id, p.team_id, p.champion_id, p.team_position, p.win
+        FROM participants p
+    """
+    params: tuple = ()
+    if since_seq is not None:
+        query += " JOIN ingest_changelog c ON c.match_id = p.match_id WHERE c.seq > ? AND c.seq <= ?"
+        params = (since_seq, until_seq)
+    return pd.read_sql_query(query, conn, params=params)
+
+
+def build(db_path=DEFAULT_DB_PATH, path: Path = MATRIX_PATH, full: bool = False) -> MatchupMatrix:
+    """Incremental update from the saved matrices, or a full rebuild."""
+    conn = connect(db_path)
+    last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ingest_changelog").fetchone()[0]
+    if full or not path.exists():
+        matrix, since = MatchupMatrix.empty(), None
+    else:
+        matrix = MatchupMatrix.load(path)
+        since = matrix.seq
+        if since >= last_seq:
+            conn.close()
+            print(f"Matchups up to date at changelog seq {since}")
+            return matrix
+
+    with span("matchup_load_rows") as sp:
+        rows = load_rows(conn, since, last_seq)
+        sp.rows = len(rows)
+    conn.close()
+    with span("matchup_accumulate") as sp:
+        sp.rows = matrix.add(rows)
+    matrix.seq = last_seq
+    matrix.save(path)
+    print(f"Matchups: {sp.rows} matches added, {len(matrix.champion_ids)} champions, "
+          f"{int(matrix.games[0].sum()) // 2} enemy pairs total -> {path}")
+    return matrix
+
+
+def lane_opponent_champion(df: pd.DataFrame) -> pd.Series:
+    """Champion id of each row's direct lane opponent (NaN without a unique one)."""
+    right = (
+        df[["match_id", "team_id", "team_position", "champion_id"]]
+        .dropna(subset=["team_position"])
+        .drop_duplicates(["match_id", "team_id", "team_position"], keep=False)
+        .rename(columns={"team_id": "opp_team", "champion_id": "lane_opponent_id"})
+    )
+    left = df[["match_id", "team_id", "team_position"]].assign(opp_team=300 - df["team_id"].to_numpy())
+    merged = left.merge(right, on=["match_id", "opp_team", "team_position"], how="left")
+    return pd.Series(merged["lane_opponent_id"].to_numpy(), index=df.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query champion matchup matrices")
+    parser.add_argument("--full", action="store_true", help="rebuild instead of folding in new matches")
+    parser.add_argument("--champ", type=int, default=None, help="print this champion's opponents")
+    parser.add_argument("--lane", choices=LANES, default=None)
+    parser.add_argument("--min-games", type=int, default=10)
+    args = parser.parse_args()
+
+    matrix = build(full=args.full)
+    if args.champ is not None:
+        print(matrix.opponents(args.champ, args.lane, args.min_games).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,25 @@
 import os
 import csv
 import sqlite3
-from days_since_patch import ms_since_patch, ms_since_pre_patch, ms_since_post_patch
+from days_since_patch import (META_CHARACTERS, PATCH_ID, PRE_PATCH_IDS, RANKED_SOLO_QUEUE, ms_since_patch,
+                              ms_since_pre_patch, ms_since_post_patch)
 from pathlib import Path
 from typing import Dict, Tuple
-from db import connect
+from db import read_snapshot
+from instrumentation import span
+from shards import SHARD_DIR, ShardSet
+import sketches
+from strata import STRATA, attach_tiers, stratum_sql
 
 PRE_PATCH = ms_since_pre_patch()
 PATCH = ms_since_patch()
 PATCH_END = ms_since_post_patch()
 
-print(f"Patch window:{PRE_PATCH} to {PATCH_END}")
+print(f"Patch window:{PRE_PATCH} to {PATCH_END} (patches {PRE_PATCH_IDS} -> {PATCH_ID})")
 
 MIN_GAMES = 5
-META_CHARACTERS = 8
 CSV_PATH = Path("Data/Processed/meta_champs.csv")
-RANKED_SOLO_QUEUE = 420
+STRATA_CSV_PATH = Path("Data/Processed/meta_champs_by_stratum.csv")
 
 MIN_PRE_GAMES = 10   
 MIN_POST_GAMES = 10    
@@ -55,33 +59,56 @@ def compute_rates(stats: Dict[str, Dict[str, float]], total_picks: int,)->Dict[s
             "pick_rate": pick_rate,
             "win_rate": win_rate
         }
+        if "players" in s:
+            # sketch estimates; many games per player points at one-tricks
+            result[champ]["players"] = s["players"]
+            result[champ]["games_per_player"] = games / s["players"] if s["players"] else 0.0
     return result
 
-def get_window_stats_range(
+def get_window_stats_patches(
     conn: sqlite3.Connection,
-    start_ts: int,
-    end_ts: int,
+    patch_ids: Tuple[int, ...],
 ) -> Tuple[Dict[str, Dict[str, float]], int]:
     """
-    Stats for a specific patch window [start_ts, end_ts) in ranked solo.
+    Stats for the games on `patch_ids` (matches.patch_id) in ranked solo.
     """
-    where = """
-        m.game_start_timestamp >= ?
-        AND m.game_start_timestamp < ?
+    where = f"""
+        m.patch_id IN ({", ".join("?" * len(patch_ids))})
         AND m.queue_id = ?
     """
-    params = (start_ts, end_ts, RANKED_SOLO_QUEUE)
+    params = (*patch_ids, RANKED_SOLO_QUEUE)
     return get_window_stats(conn, where, params)
+
+def get_sketch_stats_patches(
+    conn: sqlite3.Connection,
+    patch_ids: Tuple[int, ...],
+) -> Tuple[Dict[str, Dict[str, float]], int]:
+    """
+    Approximate get_window_stats_patches merged from the per-bucket sketches
+    (see sketches.py), with distinct-player estimates and error bounds.
+    """
+    return sketches.window_stats(conn, patch_ids=patch_ids, queue_id=RANKED_SOLO_QUEUE)
  
-def detect_meta_champs(conn: sqlite3.Connection):
+@span("detect_meta_champs")
+def detect_meta_champs(conn: sqlite3.Connection, window_stats=None):
+    """window_stats defaults to the exact get_window_stats_patches; pass get_sketch_stats_patches to approximate."""
+    window_stats = window_stats or get_window_stats_patches
     # --- Stage 1: previous patch stats ---
-    prev_raw, prev_total_picks = get_window_stats_range(conn, PRE_PATCH, PATCH)
+    with span("window_stats", window="pre") as sp:
+        prev_raw, prev_total_picks = window_stats(conn, PRE_PATCH_IDS)
+        sp.rows = prev_total_picks
     prev_stats = compute_rates(prev_raw, prev_total_picks)
 
     # --- Stage 2: current patch stats ---
-    curr_raw, curr_total_picks = get_window_stats_range(conn, PATCH, PATCH_END)
+    with span("window_stats", window="post") as sp:
+        curr_raw, curr_total_picks = window_stats(conn, (PATCH_ID,))
+        sp.rows = curr_total_picks
     curr_stats = compute_rates(curr_raw, curr_total_picks)
 
+    return compare_windows(prev_stats, curr_stats, curr_raw)
+
+def compare_windows(prev_stats, curr_stats, curr_raw):
+    """Top META_CHARACTERS champions by pick rate increase between two compute_rates results."""
     champs = set(prev_stats.keys()) | set(curr_stats.keys())
 
     rows = []
@@ -119,6 +146,10 @@ def detect_meta_champs(conn: sqlite3.Connection):
             "pick_rate_delta": pick_delta,
             "win_rate_delta": win_delta,
         })
+        if "players" in curr:
+            rows[-1]["post_players"] = curr["players"]
+            rows[-1]["post_games_per_player"] = curr["games_per_player"]
+            rows[-1]["post_games_error"] = curr_raw[champ]["games_error"]
 
     # Sort by biggest increase in pick rate this patch
     rows.sort(key=lambda r: r["pick_rate_delta"], reverse=True)
@@ -126,39 +157,112 @@ def detect_meta_champs(conn: sqlite3.Connection):
     # Top N meta champs
     return rows[:META_CHARACTERS]
 
-def save_meta_champs_csv(rows):
-    CSV_PATH.parent.mkdir(parents=True, exist_ok=True)
+@span("detect_meta_champs_by")
+def detect_meta_champs_by(conn: sqlite3.Connection, by: Tuple[str, ...] = ("position",)):
+    """
+    detect_meta_champs within every stratum of `by` (see strata.py) from one
+    grouped query over both windows. Returns rows with the stratum columns
+    prepended. With "queue" in `by` every queue is kept, otherwise ranked solo only.
+    """
+    exprs, join = stratum_sql(conn, by)
+    patches = PRE_PATCH_IDS + (PATCH_ID,)
+    where = f"m.patch_id IN ({', '.join('?' * len(patches))})"
+    params = list(patches)
+    if "queue" not in by:
+        where += " AND m.queue_id = ?"
+        params.append(RANKED_SOLO_QUEUE)
+    names = [e.rsplit(" AS ", 1)[1] for e in exprs]
+    with span("window_stats", window="strata") as sp:
+        cur = conn.execute(f"""
+            SELECT {", ".join(exprs)}, m.patch_id = ? AS post, p.champion_name, COUNT(*) AS games, SUM(p.win) AS wins
+            FROM participants p JOIN matches m ON m.match_id = p.match_id {join}
+            WHERE {where}
+            GROUP BY {", ".join(names)}, post, p.champion_name
+        """, [PATCH_ID, *params])
+        grouped: Dict[tuple, Dict[int, Dict[str, Dict[str, float]]]] = {}
+        for r in cur.fetchall():
+            key = tuple(r[:len(names)])
+            post, champ, games, wins = r[len(names):]
+            grouped.setdefault(key, {0: {}, 1: {}})[post][champ] = {"games": games, "wins": wins}
+        sp.rows = len(grouped)
+
+    rows = []
+    for key in sorted(grouped, key=lambda k: tuple(map(str, k))):
+        windows = grouped[key]
+        prev_stats = compute_rates(windows[0], sum(s["games"] for s in windows[0].values()))
+        curr_stats = compute_rates(windows[1], sum(s["games"] for s in windows[1].values()))
+        for r in compare_windows(prev_stats, curr_stats, windows[1]):
+            rows.append({**dict(zip(names, key)), **r})
+    return rows
+
+def save_meta_champs_csv(rows, path: Path = CSV_PATH):
+    path.parent.mkdir(parents=True, exist_ok=True)
 
-    field_names = [
+    # stratified runs lead with the stratum columns
+    field_names = [k for k in (rows[0] if rows else {}) if k in STRATA] + [
         "champion_name",
         "pre_games",
         "post_games",
         "pre_pick_rate", "post_pick_rate", "pick_rate_delta",
         "pre_win_rate", "post_win_rate", "win_rate_delta"
     ]
+    # approximate runs add the sketch columns
+    field_names += [k for k in (rows[0] if rows else {}) if k not in field_names]
 
-    with CSV_PATH.open("w", newline = "", encoding = "utf-8") as f:
+    with path.open("w", newline = "", encoding = "utf-8") as f:
         writer = csv.DictWriter(f, fieldnames=field_names)
         writer.writeheader()
         for r in rows:
             writer.writerow(r)
-    print(f"Saved meta champs to {CSV_PATH}")
+    print(f"Saved meta champs to {path}")
 
-def main():
-    conn = connect()
-    rows = detect_meta_champs(conn)
-    save_meta_champs_csv(rows)
+def main(shard_root=None, approx=False, by=None):
+    if by:
+        # stratified: exact counts, one grouped query; the global meta_champs.csv is left alone
+        if shard_root:
+            conn = ShardSet(shard_root).open_patches(PRE_PATCH_IDS + (PATCH_ID,))
+            if "tier" in by:
+                attach_tiers(conn)  # the crawl tables stay in riot.db
+            rows = detect_meta_champs_by(conn, by)
+            conn.close()
+        else:
+            with read_snapshot() as conn:
+                rows = detect_meta_champs_by(conn, by)
+        save_meta_champs_csv(rows, STRATA_CSV_PATH)
+    elif approx:
+        # sketches live in riot.db even when matches are sharded
+        with read_snapshot() as conn:
+            rows = detect_meta_champs(conn, get_sketch_stats_patches)
+    elif shard_root:
+        # only the shards of the compared patches are attached
+        conn = ShardSet(shard_root).open_patches(PRE_PATCH_IDS + (PATCH_ID,))
+        rows = detect_meta_champs(conn)
+        conn.close()
+    else:
+        # one read transaction so the pre and post windows come from the same state
+        with read_snapshot() as conn:
+            rows = detect_meta_champs(conn)
+    if not by:
+        save_meta_champs_csv(rows)
 
     print("Meta Champions:")
     for r in rows:
+        stratum = "/".join(str(r[s]) for s in (by or ()))
         print(
+            (f"[{stratum}] " if stratum else "") +
             f"{r['champion_name']}: "
             f"pick {r['pre_pick_rate']:.3%} -> {r['post_pick_rate']:.3%}"
             f"(delta {r['pick_rate_delta']:.3%}), "
             f"win {r['pre_win_rate']:.1%} -> {r['post_win_rate']:.1%}"
             f"(delta {r['win_rate_delta']:.1%})"
         )
-    conn.close()
+        if "post_players" in r:
+            print(f"    ~{r['post_players']:.0f} players, {r['post_games_per_player']:.2f} games/player, "
+                  f"games over-counted by <= {r['post_games_error']}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    import sys
+    args = sys.argv[1:]
+    # --by=position,tier runs the detection per stratum (see strata.py)
+    by = next((tuple(a.split("=", 1)[1].split(",")) for a in args if a.startswith("--by=")), None)
+    main(shard_root=SHARD_DIR if "--shards" in args else None, approx="--approx" in args, by=by)
\ No newline at end of file
@@ -0,0 +1,338 @@
+"""
+Streaming meta-shift detection while matches are ingested.
+
+meta_detection compares two fixed patch windows after the fact. Here every
+ranked solo match updates a few online estimators per champion it contains,
+inside insert_match's transaction, and a champion whose pick or win rate
+shifts upward raises an alert in meta_alerts right away.
+
+The clock is the number of ranked matches seen, in arrival order, so the
+estimators only describe a time series when matches arrive in game-start
+order. A live ingest mostly appends new games, but crawl and window-priority
+orders backfill older ones, so a match that started more than MAX_LATENESS_MS
+before the newest one seen is skipped (meta_stream_late_total) instead of
+being counted as "now"; run --replay after a backfill to fold those in, in
+start-time order. Per champion:
+
+    pick_fast / pick_slow  EWMAs of its share of the 10 pick slots (half-lives
+                           FAST_HALF_LIFE / SLOW_HALF_LIFE matches)
+    pick_cusum             Page's CUSUM of the log-likelihood ratio "pick rate is
+                           (1 + PICK_SHIFT) x pick_slow" vs "is pick_slow"
+    win_slow / win_cusum   the same for win rate, per game played, shift WIN_SHIFT
+
+A champion absent from a match contributes a fixed amount (a decay factor,
+a constant negative LLR step), so the gap since its last update is applied
+in closed form when it next appears; matches only touch their own champions
+and the cost per match is constant. EWMAs start at zero on clock 0 and are
+bias-corrected on read. A CUSUM crossing THRESHOLD records an alert and
+resets; current_meta() lists recently alerted champions still above baseline.
+Alerts are counted in meta_alerts_total and printed only with
+PIPELINE_LOG_ALERTS=1, since they are raised inside the ingest transaction.
+
+    python src/meta_stream.py              # current meta list and recent alerts
+    python src/meta_stream.py --replay     # rebuild state by replaying stored matches
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import sqlite3
+
+from days_since_patch import META_CHARACTERS, RANKED_SOLO_QUEUE
+from db import connect, init_db, table_columns
+from instrumentation import incr
+from shards import require_unsharded
+
+SLOTS = 10
+FAST_HALF_LIFE = 500        # matches
+SLOW_HALF_LIFE = 20_000     # matches
+WIN_HALF_LIFE = 500         # games of the champion
+PICK_SHIFT = 0.5            # relative pick rate increase the CUSUM is tuned for
+WIN_SHIFT = 0.05            # absolute win rate increase
+THRESHOLD = 10.0            # log-likelihood ratio that raises an alert
+WARMUP_MATCHES = 2_000
+MIN_GAMES = 30
+META_HOLD = 4 * FAST_HALF_LIFE  # matches an alert keeps a champion eligible for the meta list
+P_FLOOR = 1e-3
+CLOCK = 0  # meta_stream_state champion_id holding the global match count and newest start time
+MAX_LATENESS_MS = 60 * 60 * 1000  # how far behind the newest game start a match is still counted
+LOG_ALERTS = os.getenv("PIPELINE_LOG_ALERTS", "0") == "1"
+
+
+def _alpha(half_life: float) -> float:
+    return 1 - 0.5 ** (1 / half_life)
+
+
+ALPHA_FAST = _alpha(FAST_HALF_LIFE)
+ALPHA_SLOW = _alpha(SLOW_HALF_LIFE)
+ALPHA_WIN = _alpha(WIN_HALF_LIFE)
+
+STATE_COLUMNS = ("champion_id", "champion_name", "last_match", "games", "wins",
+                 "pick_fast", "pick_slow", "pick_cusum", "win_slow", "win_cusum", "alerted_at")
+
+
+def create_meta_stream_tables(conn: sqlite3.Connection) -> None:
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS meta_stream_state (
+        champion_id INTEGER PRIMARY KEY,
+        champion_name TEXT,
+        last_match INTEGER NOT NULL DEFAULT 0,
+        games INTEGER NOT NULL DEFAULT 0,
+        wins INTEGER NOT NULL DEFAULT 0,
+        pick_fast REAL NOT NULL DEFAULT 0,
+        pick_slow REAL NOT NULL DEFAULT 0,
+        pick_cusum REAL NOT NULL DEFAULT 0,
+        win_slow REAL NOT NULL DEFAULT 0,
+        win_cusum REAL NOT NULL DEFAULT 0,
+        alerted_at INTEGER,
+        last_start INTEGER);         -- CLOCK row only: newest game_start_timestamp folded in
+    CREATE TABLE IF NOT EXISTS meta_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_index INTEGER NOT NULL,
+        match_id TEXT,
+        game_start_timestamp INTEGER,
+        champion_id INTEGER NOT NULL,
+        champion_name TEXT,
+        kind TEXT NOT NULL,          -- 'pick' or 'win'
+        baseline REAL NOT NULL,
+        current REAL NOT NULL,
+        statistic REAL NOT NULL,
+        created_at INTEGER NOT NULL DEFAULT (strftime('%s','now')));
+    """)
+    if "last_start" not in table_columns(conn, "meta_stream_state"):
+        conn.execute("ALTER TABLE meta_stream_state ADD COLUMN last_start INTEGER")
+    conn.commit()
+
+
+def init_meta_stream(conn: sqlite3.Connection) -> bool:
+    """Create the tables; fresh tables on a populated DB are replayed once. Returns True if replayed."""
+    new = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='meta_stream_state'"
+    ).fetchone() is None
+    create_meta_stream_tables(conn)
+    if new and conn.execute("SELECT 1 FROM participants LIMIT 1").fetchone():
+        print(f"Replayed {replay(conn)} matches into the meta stream")
+        return True
+    return False
+
+
+def _llr(k: float, n: float, p0: float, p1: float) -> float:
+    """log-likelihood ratio of k successes in n Bernoulli trials, p1 vs p0."""
+    return k * math.log(p1 / p0) + (n - k) * math.log((1 - p1) / (1 - p0))
+
+
+def pick_rates(p0: float) -> tuple[float, float]:
+    p0 = min(max(p0, P_FLOOR), 0.5)
+    return p0, min(p0 * (1 + PICK_SHIFT), 0.99)
+
+
+def win_rates(win_hat: float) -> tuple[float, float]:
+    q0 = min(max(win_hat, 0.3), 0.7)
+    return q0, q0 + WIN_SHIFT
+
+
+def corrected(value: float, alpha: float, steps: int) -> float:
+    """Bias-corrected EWMA that started at zero `steps` updates ago."""
+    norm = 1 - (1 - alpha) ** steps
+    return value / norm if norm > 0 else 0.0
+
+
+class ChampionState:
+    def __init__(self, row: sqlite3.Row | tuple | None, champion_id: int, name: str | None) -> None:
+        values = tuple(row) if row is not None else (champion_id, name, 0, 0, 0, 0.0, 0.0, 0.0, 0.0, 0.0, None)
+        for col, v in zip(STATE_COLUMNS, values):
+            setattr(self, col, v)
+        self.champion_name = self.champion_name or name
+
+    def advance(self, t: int) -> None:
+        """Apply the matches since last_match (none of which had this champion) up to t - 1."""
+        gap = t - 1 - self.last_match
+        if gap <= 0:
+            return
+        p0, p1 = pick_rates(corrected(self.pick_slow, ALPHA_SLOW, self.last_match))
+        self.pick_cusum = max(0.0, self.pick_cusum + gap * _llr(0, SLOTS, p0, p1))
+        self.pick_fast *= (1 - ALPHA_FAST) ** gap
+        self.pick_slow *= (1 - ALPHA_SLOW) ** gap
+        self.last_match = t - 1
+
+    def observe(self, t: int, picks: int, wins: int) -> list[tuple[str, float, float, float]]:
+        """Fold in match t with `picks` slots of this champion; returns alerts as (kind, baseline, current, stat)."""
+        self.advance(t)
+        baseline = corrected(self.pick_slow, ALPHA_SLOW, t - 1)
+        p0, p1 = pick_rates(baseline)
+        self.pick_cusum = max(0.0, self.pick_cusum + _llr(picks, SLOTS, p0, p1))
+        x = picks / SLOTS
+        self.pick_fast = (1 - ALPHA_FAST) * self.pick_fast + ALPHA_FAST * x
+        self.pick_slow = (1 - ALPHA_SLOW) * self.pick_slow + ALPHA_SLOW * x
+        self.last_match = t
+
+        win_baseline = corrected(self.win_slow, ALPHA_WIN, self.games)
+        q0, q1 = win_rates(win_baseline if self.games else 0.5)
+        self.win_cusum = max(0.0, self.win_cusum + _llr(wins, picks, q0, q1))
+        for i in range(picks):
+            self.win_slow = (1 - ALPHA_WIN) * self.win_slow + ALPHA_WIN * (1.0 if i < wins else 0.0)
+        self.games += picks
+        self.wins += wins
+
+        alerts = []
+        if t < WARMUP_MATCHES or self.games < MIN_GAMES:
+            return alerts
+        if self.pick_cusum >= THRESHOLD:
+            alerts.append(("pick", baseline, corrected(self.pick_fast, ALPHA_FAST, t), self.pick_cusum))
+            self.pick_cusum = 0.0
+        if self.win_cusum >= THRESHOLD:
+            alerts.append(("win", win_baseline, corrected(self.win_slow, ALPHA_WIN, self.games), self.win_cusum))
+            self.win_cusum = 0.0
+        if alerts:
+            self.alerted_at = t
+        return alerts
+
+    def values(self) -> tuple:
+        return tuple(getattr(self, c) for c in STATE_COLUMNS)
+
+
+def update_match_meta_stream(conn: sqlite3.Connection, match_id: str, info: dict) -> int:
+    """
+    Called by insert_match inside its transaction. Matches more than
+    MAX_LATENESS_MS older than the newest one seen are skipped. Returns the
+    number of alerts raised.
+    """
+    if info.get("queueId") != RANKED_SOLO_QUEUE:
+        return 0
+    picks: dict[int, list] = {}
+    for p in info.get("participants", []):
+        if p.get("championId") is None:
+            continue
+        entry = picks.setdefault(int(p["championId"]), [p.get("championName"), 0, 0])
+        entry[1] += 1
+        entry[2] += int(bool(p.get("win")))
+    if not picks:
+        return 0
+
+    start = info.get("gameStartTimestamp")
+    row = conn.execute("SELECT games, last_start FROM meta_stream_state WHERE champion_id = ?", (CLOCK,)).fetchone()
+    if row and row[1] is not None and start is not None and start < row[1] - MAX_LATENESS_MS:
+        incr("meta_stream_late_total")
+        return 0
+    t = (row[0] if row else 0) + 1
+    conn.execute("""
+        INSERT INTO meta_stream_state (champion_id, champion_name, games, last_match, last_start)
+        VALUES (?, NULL, 1, 1, ?)
+        ON CONFLICT(champion_id) DO UPDATE SET games = games + 1, last_match = games + 1,
+            last_start = MAX(COALESCE(last_start, excluded.last_start), COALESCE(excluded.last_start, last_start))
+    """, (CLOCK, start))
+
+    ids = list(picks)
+    rows = {r[0]: r for r in conn.execute(
+        f"SELECT {', '.join(STATE_COLUMNS)} FROM meta_stream_state "
+        f"WHERE champion_id IN ({', '.join('?' * len(ids))})", ids)}
+    states, alerts = [], []
+    for cid, (name, n, w) in picks.items():
+        state = ChampionState(rows.get(cid), cid, name)
+        for kind, baseline, current, stat in state.observe(t, n, w):
+            alerts.append((t, match_id, start, cid, state.champion_name,
+                           kind, baseline, current, stat))
+        states.append(state.values())
+
+    conn.executemany(f"INSERT OR REPLACE INTO meta_stream_state ({', '.join(STATE_COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * len(STATE_COLUMNS))})", states)
+    if alerts:
+        conn.executemany("""
+            INSERT INTO meta_alerts (match_index, match_id, game_start_timestamp, champion_id, champion_name,
+                                     kind, baseline, current, statistic)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, alerts)
+        for a in alerts:
+            incr("meta_alerts_total", kind=a[5])
+            if LOG_ALERTS:
+                print(f"Meta alert: {a[4]} {a[5]} rate {a[6]:.2%} -> {a[7]:.2%} (match {match_id})")
+    return len(alerts)
+
+
+def replay(conn: sqlite3.Connection) -> int:
+    """Reset the state and feed every stored ranked match through the detector in start-time order."""
+    require_unsharded(conn, "meta_stream replay")
+    rows = conn.execute("""
+        SELECT m.match_id, m.game_start_timestamp, p.champion_id, p.champion_name, p.win
+        FROM matches m JOIN participants p ON p.match_id = m.match_id
+        WHERE m.queue_id = ?
+        ORDER BY m.game_start_timestamp, m.match_id
+    """, (RANKED_SOLO_QUEUE,))
+    n = 0
+    current, info = None, None
+    with conn:
+        conn.execute("DELETE FROM meta_stream_state")
+        conn.execute("DELETE FROM meta_alerts")
+        for r in rows:
+            if r[0] != current:
+                if current is not None:
+                    update_match_meta_stream(conn, current, info)
+                    n += 1
+                current = r[0]
+                info = {"queueId": RANKED_SOLO_QUEUE, "gameStartTimestamp": r[1], "participants": []}
+            info["participants"].append({"championId": r[2], "championName": r[3], "win": r[4]})
+        if current is not None:
+            update_match_meta_stream(conn, current, info)
+            n += 1
+    return n
+
+
+def current_meta(conn: sqlite3.Connection, n: int = META_CHARACTERS) -> list[dict]:
+    """Champions alerted within META_HOLD matches whose fast pick rate is still above baseline, by lift."""
+    row = conn.execute("SELECT games FROM meta_stream_state WHERE champion_id = ?", (CLOCK,)).fetchone()
+    t = row[0] if row else 0
+    rows = conn.execute(f"""
+        SELECT {', '.join(STATE_COLUMNS)} FROM meta_stream_state
+        WHERE champion_id != ? AND alerted_at IS NOT NULL AND alerted_at >= ?
+    """, (CLOCK, t - META_HOLD)).fetchall()
+    out = []
+    for r in rows:
+        state = ChampionState(r, r[0], r[1])
+        state.advance(t + 1)
+        pick_rate = corrected(state.pick_fast, ALPHA_FAST, t)
+        baseline = corrected(state.pick_slow, ALPHA_SLOW, t)
+        if pick_rate <= baseline:
+            continue
+        out.append({
+            "champion_name": state.champion_name,
+            "champion_id": state.champion_id,
+            "pick_rate": pick_rate,
+            "baseline_pick_rate": baseline,
+            "lift": pick_rate / baseline if baseline else math.inf,
+            "win_rate": corrected(state.win_slow, ALPHA_WIN, state.games),
+            "alerted_at": state.alerted_at,
+        })
+    out.sort(key=lambda d: d["pick_rate"] - d["baseline_pick_rate"], reverse=True)
+    return out[:n]
+
+
+def recent_alerts(conn: sqlite3.Connection, limit: int = 20) -> list[sqlite3.Row]:
+    return conn.execute("SELECT * FROM meta_alerts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming meta-shift detector state")
+    parser.add_argument("--replay", action="store_true",
+                        help="rebuild the state from stored matches in start-time order (after a backfill)")
+    parser.add_argument("--alerts", type=int, default=20, help="recent alerts to show")
+    args = parser.parse_args()
+
+    conn = connect()
+    init_db(conn)
+    if not init_meta_stream(conn) and args.replay:
+        print(f"Replayed {replay(conn)} matches into the meta stream")
+
+    print("Current meta:")
+    for r in current_meta(conn):
+        print(f"  {r['champion_name']}: pick {r['baseline_pick_rate']:.3%} -> {r['pick_rate']:.3%} "
+              f"(x{r['lift']:.2f}), win {r['win_rate']:.1%}, alerted at match {r['alerted_at']}")
+    print("Recent alerts:")
+    for a in recent_alerts(conn, args.alerts):
+        print(f"  #{a['match_index']} {a['champion_name']} {a['kind']}: "
+              f"{a['baseline']:.3%} -> {a['current']:.3%} (LLR {a['statistic']:.1f})")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+"""
+Offline stand-in for the Riot match-v5 endpoints used by the crawler and ingester.
+
+Serves match ids and match detail payloads either replayed from an existing
+riot.db (match_cache) or synthesised on startup, and models the things we care
+about when load testing: rate limits with Retry-After, 5xx bursts and latency.
+
+    python src/mock_riot_server.py --replay Data/Raw/riot.db --port 8089
+"""
+import argparse
+import bisect
+import json
+import math
+import random
+import sqlite3
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from days_since_patch import ms_since_post_patch, ms_since_pre_patch
+from synthetic_matches import PATCH_VERSIONS
+
+# Riot development keys: 20 requests / 1s and 100 requests / 2min
+DEFAULT_RATE_LIMITS = [(20, 1.0), (100, 120.0)]
+ERROR_CODES = (500, 502, 503, 504)
+
+RANKED_SOLO_QUEUE = 420
+OTHER_QUEUES = (400, 430, 440, 450)
+CHAMPION_IDS = list(range(1, 171))
+POSITIONS = ["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"]
+LADDER_TIERS = ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND",
+                "MASTER", "GRANDMASTER", "CHALLENGER"]
+LADDER_PAGE_SIZE = 205
+
+
+class PayloadStore:
+    """
+    match_id -> raw JSON text, plus puuid -> match ids (newest first).
+    Timelines are synthesised from the match payload on first request.
+    """
+
+    def __init__(self) -> None:
+        self.matches: dict[str, str] = {}
+        self.timelines: dict[str, str] = {}
+        self._timeline_lock = threading.Lock()
+        self.by_puuid: dict[str, list] = {}
+        self.seed_puuids: list[str] = []
+
+    def add(self, match_id: str, raw: str, puuids: list[str], start_ts: int) -> None:
+        self.matches[match_id] = raw
+        for puuid in puuids:
+            self.by_puuid.setdefault(puuid, []).append((start_ts, match_id))
+
+    def timeline(self, match_id: str) -> str | None:
+        raw = self.timelines.get(match_id)
+        if raw is None and match_id in self.matches:
+            raw = json.dumps(synth_timeline(match_id, json.loads(self.matches[match_id])))
+            with self._timeline_lock:
+                self.timelines[match_id] = raw
+        return raw
+
+    def finalise(self) -> None:
+        for puuid, items in self.by_puuid.items():
+            items.sort(reverse=True)
+            self.by_puuid[puuid] = [mid for _, mid in items]
+        ranked = sorted(self.by_puuid, key=lambda p: len(self.by_puuid[p]), reverse=True)
+        self.seed_puuids = ranked[:10]
+
+        # league-v4 ladder: spread players over tier/division by a stable hash
+        self.ladder: dict[tuple[str, str], list[str]] = {}
+        for puuid in sorted(self.by_puuid):
+            h = zlib.crc32(puuid.encode("utf-8"))
+            tier = LADDER_TIERS[h % len(LADDER_TIERS)]
+            division = "I" if tier in ("MASTER", "GRANDMASTER", "CHALLENGER") else ["I", "II", "III", "IV"][(h >> 8) % 4]
+            self.ladder.setdefault((tier, division), []).append(puuid)
+
+    def ladder_entries(self, tier: str, division: str) -> list[dict]:
+        return [
+            {"puuid": p, "queueType": "RANKED_SOLO_5x5", "tier": tier, "rank": division,
+             "leaguePoints": (zlib.crc32(p.encode("utf-8")) % 100)}
+            for p in self.ladder.get((tier, division), [])
+        ]
+
+
+def load_replay(db_path: str | Path) -> PayloadStore:
+    """Replay every cached payload in an existing riot.db."""
+    store = PayloadStore()
+    conn = sqlite3.connect(f"file:{Path(db_path)}?mode=ro", uri=True)
+    for match_id, raw in conn.execute("SELECT match_id, json FROM match_cache"):
+        info = json.loads(raw).get("info", {})
+        puuids = [p.get("puuid") for p in info.get("participants", []) if p.get("puuid")]
+        store.add(match_id, raw, puuids, info.get("gameStartTimestamp") or 0)
+    conn.close()
+    store.finalise()
+    print(f"Replaying {len(store.matches)} cached matches for {len(store.by_puuid)} puuids")
+    return store
+
+
+def synth_participant(rng: random.Random, pid: int, puuid: str, champ: int, win: bool, duration: int) -> dict:
+    minutes = duration / 60.0
+    deaths = rng.randint(0, 12)
+    return {
+        "participantId": pid,
+        "puuid": puuid,
+        "summonerName": "",
+        "riotIdGameName": f"player{puuid[-6:]}",
+        "riotIdTagline": "NA1",
+        "teamId": 100 if pid <= 5 else 200,
+        "teamPosition": POSITIONS[(pid - 1) % 5],
+        "championId": champ,
+        "championName": f"Champ{champ}",
+        "championTransform": 0,
+        "win": win,
+        "kills": rng.randint(0, 15),
+        "deaths": deaths,
+        "assists": rng.randint(0, 20),
+        "totalDamageDealtToChampions": int(rng.gauss(18000, 6000)) if minutes else 0,
+        "totalMinionsKilled": int(rng.gauss(6.5, 1.5) * minutes),
+        "neutralMinionsKilled": rng.randint(0, 20),
+        "visionScore": rng.randint(5, 60),
+        "goldEarned": int(rng.gauss(390, 60) * minutes),
+        "champLevel": rng.randint(11, 18),
+        "role": "SOLO",
+        "lane": POSITIONS[(pid - 1) % 5],
+        "individualPosition": POSITIONS[(pid - 1) % 5],
+        "timePlayed": duration,
+        "totalTimeSpentDead": deaths * rng.randint(10, 40),
+        "totalDamageTaken": int(rng.gauss(22000, 7000)),
+        "gameEndedInSurrender": duration < 25 * 60,
+        "gameEndedInEarlySurrender": duration < 16 * 60,
+        "teamEarlySurrendered": duration < 16 * 60 and not win,
+        **{f"item{i}": rng.randint(1000, 7000) for i in range(7)},
+        # The real payload carries ~120 challenge stats per participant; keep
+        # the size in the same ballpark so decode cost is realistic.
+        "challenges": {f"challenge{i}": rng.random() * 100 for i in range(120)},
+        "perks": {"styles": [{"selections": [{"perk": rng.randint(8000, 9000)} for _ in range(4)]}]},
+    }
+
+
+def game_version(ts: int) -> str:
+    """Client version live at `ts`, so patch_id agrees with the game's start time."""
+    starts = [s for s, _ in PATCH_VERSIONS]
+    return PATCH_VERSIONS[max(bisect.bisect_right(starts, ts) - 1, 0)][1]
+
+
+def synth_timeline(match_id: str, match: dict) -> dict:
+    """
+    Per-minute participant frames consistent with the match payload: gold, cs
+    and damage ramp towards the participant's end-of-game totals.
+    """
+    rng = random.Random(zlib.crc32(match_id.encode("utf-8")))
+    info = match.get("info", {})
+    duration = int(info.get("gameDuration") or 0)
+    participants = info.get("participants", [])
+    n_frames = duration // 60 + 2  # frame 0 plus a final partial-minute frame
+    frames = []
+    for f in range(n_frames):
+        t = min(f * 60, duration)
+        share = t / duration if duration else 0.0
+        pframes = {}
+        for p in participants:
+            gold = 500 + int((p.get("goldEarned", 0) - 500) * share)
+            pframes[str(p["participantId"])] = {
+                "participantId": p["participantId"],
+                "totalGold": gold,
+                "currentGold": rng.randint(0, min(gold, 1500)),
+                "xp": int(share * rng.gauss(16000, 1500)) if f else 0,
+                "level": max(1, round(share * p.get("champLevel", 1))),
+                "minionsKilled": int(p.get("totalMinionsKilled", 0) * share),
+                "jungleMinionsKilled": int(p.get("neutralMinionsKilled", 0) * share),
+                "position": {"x": rng.randint(0, 14800), "y": rng.randint(0, 14800)},
+                "damageStats": {"totalDamageDoneToChampions": int(p.get("totalDamageDealtToChampions", 0) * share)},
+            }
+        events = [{"type": "CHAMPION_KILL", "timestamp": t * 1000 - rng.randint(0, 59999),
+                   "killerId": rng.randint(1, 10), "victimId": rng.randint(1, 10)}
+                  for _ in range(rng.randint(0, 3))] if f else []
+        frames.append({"timestamp": t * 1000, "participantFrames": pframes, "events": events})
+    return {
+        "metadata": {"matchId": match_id, "participants": [p.get("puuid") for p in participants]},
+        "info": {"frameInterval": 60000, "frames": frames},
+    }
+
+
+def synth_store(n_matches: int = 2000, n_players: int = 1500, ranked_share: float = 0.8,
+                seed: int = 7) -> PayloadStore:
+    """
+    Synthesise a self-consistent population: every match id listed for a
+    puuid resolves to a payload containing that puuid.
+    """
+    rng = random.Random(seed)
+    store = PayloadStore()
+    players = [f"synthpuuid-{i:06d}-" + "x" * 60 for i in range(n_players)]
+    # Zipf-ish champion popularity
+    weights = [1.0 / (rank + 1) for rank in range(len(CHAMPION_IDS))]
+    # two weeks either side of the analysis window, like a real crawl
+    start, end = ms_since_pre_patch() - 14 * 86_400_000, ms_since_post_patch() + 14 * 86_400_000
+
+    for i in range(n_matches):
+        match_id = f"NA1_{5200000000 + i}"
+        game_start = start + int((end - start) * i / max(n_matches, 1))
+        duration = rng.randint(15 * 60, 40 * 60)
+        queue = RANKED_SOLO_QUEUE if rng.random() < ranked_share else rng.choice(OTHER_QUEUES)
+        lobby = rng.sample(players, 10)
+        champs: list[int] = []
+        while len(champs) < 10:
+            c = rng.choices(CHAMPION_IDS, weights=weights)[0]
+            if c not in champs:
+                champs.append(c)
+        blue_win = rng.random() < 0.5
+        participants = [
+            synth_participant(rng, pid, puuid, champ, blue_win == (pid <= 5), duration)
+            for pid, (puuid, champ) in enumerate(zip(lobby, champs), start=1)
+        ]
+        payload = {
+            "metadata": {"matchId": match_id, "participants": lobby},
+            "info": {
+                "gameCreation": game_start - 60_000,
+                "gameDuration": duration,
+                "gameEndTimestamp": game_start + duration * 1000,
+                "gameMode": "CLASSIC",
+                "gameType": "MATCHED_GAME",
+                "gameVersion": game_version(game_start),
+                "platformId": "NA1",
+                "queueId": queue,
+                "mapId": 11,
+                "gameName": "",
+                "gameStartTimestamp": game_start,
+                "participants": participants,
+            },
+        }
+        store.add(match_id, json.dumps(payload), lobby, game_start)
+
+    store.finalise()
+    print(f"Synthesised {n_matches} matches for {n_players} puuids")
+    return store
+
+
+class RateLimiter:
+    """
+    Sliding-window limiter over several (count, seconds) windows, like the
+    X-App-Rate-Limit header describes.
+    """
+
+    def __init__(self, limits: list[tuple[int, float]]) -> None:
+        self.limits = limits
+        self.hits = [deque() for _ in limits]
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Return 0 if the request is allowed, else seconds until it would be."""
+        now = time.monotonic()
+        with self.lock:
+            wait = 0.0
+            for (count, window), hits in zip(self.limits, self.hits):
+                while hits and now - hits[0] >= window:
+                    hits.popleft()
+                if len(hits) >= count:
+                    wait = max(wait, window - (now - hits[0]))
+            if wait > 0:
+                return wait
+            for hits in self.hits:
+                hits.append(now)
+            return 0.0
+
+    def header(self) -> str:
+        return ",".join(f"{count}:{int(window)}" for count, window in self.limits)
+
+
+class MockRiotServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], store: PayloadStore,
+                 rate_limits: list[tuple[int, float]] | None = DEFAULT_RATE_LIMITS,
+                 error_rate: float = 0.0, error_burst: int = 1,
+                 latency_median_ms: float = 0.0, latency_sigma: float = 0.5,
+                 seed: int = 11) -> None:
+        super().__init__(address, MockRiotHandler)
+        self.store = store
+        self.limiter = RateLimiter(rate_limits) if rate_limits else None
+        self.error_rate = error_rate
+        self.error_burst = max(1, error_burst)
+        self.latency_median_ms = latency_median_ms
+        self.latency_sigma = latency_sigma
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.burst_left = 0
+        self.stats = {"requests": 0, "ok": 0, "not_found": 0, "rate_limited": 0, "server_errors": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def latency(self) -> float:
+        if self.latency_median_ms <= 0:
+            return 0.0
+        with self.lock:
+            ms = self.rng.lognormvariate(math.log(self.latency_median_ms), self.latency_sigma)
+        return ms / 1000.0
+
+    def inject_error(self) -> int | None:
+        """5xx responses arrive in bursts of error_burst consecutive requests."""
+        with self.lock:
+            if self.burst_left > 0:
+                self.burst_left -= 1
+                return self.rng.choice(ERROR_CODES)
+            if self.error_rate > 0 and self.rng.random() < self.error_rate / self.error_burst:
+                self.burst_left = self.error_burst - 1
+                return self.rng.choice(ERROR_CODES)
+        return None
+
+    def serve_in_thread(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class MockRiotHandler(BaseHTTPRequestHandler):
+    server: MockRiotServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_body(self, status: int, body: bytes, headers: dict | None = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        srv = self.server
+        srv.count("requests")
+
+        if srv.limiter is not None:
+            wait = srv.limiter.acquire()
+            if wait > 0:
+                srv.count("rate_limited")
+                self.send_body(429, b'{"status":{"message":"Rate limit exceeded","status_code":429}}', {
+                    "Retry-After": str(max(1, math.ceil(wait))),
+                    "X-Rate-Limit-Type": "application",
+                    "X-App-Rate-Limit": srv.limiter.header(),
+                })
+                return
+
+        time.sleep(srv.latency())
+
+        code = srv.inject_error()
+        if code is not None:
+            srv.count("server_errors")
+            self.send_body(code, b'{"status":{"message":"Internal server error"}}')
+            return
+
+        url = urlparse(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        store = srv.store
+
+        # /lol/match/v5/matches/by-puuid/{puuid}/ids
+        if parts[:5] == ["lol", "match", "v5", "matches", "by-puuid"] and len(parts) == 7 and parts[6] == "ids":
+            qs = parse_qs(url.query)
+            start = int(qs.get("start", ["0"])[0])
+            count = int(qs.get("count", ["20"])[0])
+            ids = store.by_puuid.get(parts[5], [])[start:start + count]
+            srv.count("ok")
+            self.send_body(200, json.dumps(ids).encode("utf-8"))
+            return
+
+        # /lol/league/v4/entries/RANKED_SOLO_5x5/{tier}/{division}?page=N
+        if parts[:4] == ["lol", "league", "v4", "entries"] and len(parts) == 7:
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+            entries = store.ladder_entries(parts[5], parts[6])
+            entries = entries[(page - 1) * LADDER_PAGE_SIZE:page * LADDER_PAGE_SIZE]
+            srv.count("ok")
+            self.send_body(200, json.dumps(entries).encode("utf-8"))
+            return
+
+        # /lol/league/v4/{challenger,grandmaster,master}leagues/by-queue/RANKED_SOLO_5x5
+        if parts[:3] == ["lol", "league", "v4"] and len(parts) == 6 and parts[3].endswith("leagues"):
+            tier = parts[3][:-len("leagues")].upper()
+            srv.count("ok")
+            body = {"tier": tier, "queue": parts[5], "entries": store.ladder_entries(tier, "I")}
+            self.send_body(200, json.dumps(body).encode("utf-8"))
+            return
+
+        # /lol/match/v5/matches/{match_id}/timeline
+        if parts[:4] == ["lol", "match", "v5", "matches"] and len(parts) == 6 and parts[5] == "timeline":
+            raw = store.timeline(parts[4])
+            if raw is not None:
+                srv.count("ok")
+                self.send_body(200, raw.encode("utf-8"))
+                return
+
+        # /lol/match/v5/matches/{match_id}
+        if parts[:4] == ["lol", "match", "v5", "matches"] and len(parts) == 5:
+            raw = store.matches.get(parts[4])
+            if raw is not None:
+                srv.count("ok")
+                self.send_body(200, raw.encode("utf-8"))
+                return
+
+        srv.count("not_found")
+        self.send_body(404, b'{"status":{"message":"Data not found","status_code":404}}')
+
+
+def parse_rate_limits(spec: str) -> list[tuple[int, float]]:
+    """'20:1,100:120' -> [(20, 1.0), (100, 120.0)]; '' disables limiting."""
+    limits = []
+    for part in spec.split(","):
+        if part.strip():
+            count, window = part.split(":")
+            limits.append((int(count), float(window)))
+    return limits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Riot API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--replay", help="riot.db whose match_cache should be served")
+    parser.add_argument("--matches", type=int, default=2000, help="synthetic matches when not replaying")
+    parser.add_argument("--players", type=int, default=1500)
+    parser.add_argument("--rate-limits", default="20:1,100:120")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-burst", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="median response latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal sigma")
+    args = parser.parse_args()
+
+    store = load_replay(args.replay) if args.replay else synth_store(args.matches, args.players)
+    srv = MockRiotServer(
+        (args.host, args.port), store,
+        rate_limits=parse_rate_limits(args.rate_limits),
+        error_rate=args.error_rate, error_burst=args.error_burst,
+        latency_median_ms=args.latency_ms, latency_sigma=args.latency_sigma,
+    )
+    print(f"Mock Riot API on {srv.base_url}, seed puuids: {store.seed_puuids[:3]}...")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Server stats:", srv.stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+PUUID-hash partitioned execution for the per-player stages.
+
+player_performance and giveup_label only ever combine rows of one player,
+so the player-game table splits cleanly by crc32(puuid) % K. Each worker
+process opens its own read-only connection, selects its partition straight
+from SQLite with the crc32 UDF and returns only per-player results, so peak
+memory is one partition per worker instead of the whole table and the work
+spreads over every core. Anything that needs the other players of a match
+(faced_meta, with_duo) is computed in SQL by the partition query.
+
+    python src/player_performance.py --partitions 16 --workers 8
+    python src/giveup_label.py --partitions 16
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+
+from db import connect_readonly
+
+N_PARTITIONS = 16
+
+
+def crc32(text: str | None) -> int | None:
+    return None if text is None else zlib.crc32(text.encode("utf-8"))
+
+
+def puuid_partition(puuid: str, k: int) -> int:
+    return crc32(puuid) % k
+
+
+def connect_partition_reader(db_path) -> sqlite3.Connection:
+    """Read-only connection with crc32() registered for partition filters."""
+    conn = connect_readonly(db_path)
+    conn.create_function("crc32", 1, crc32, deterministic=True)
+    return conn
+
+
+def partition_clause(column: str = "p.puuid") -> str:
+    """SQL predicate selecting partition :part of :k (named parameters)."""
+    return f"crc32({column}) % :k = :part"
+
+
+def map_partitions(fn: Callable, db_path, k: int = N_PARTITIONS, workers: int | None = None, *args) -> list:
+    """
+    Run fn(db_path, part, k, *args) for every partition in a process pool and
+    return the results in partition order.
+    """
+    workers = min(workers or os.cpu_count() or 1, k)
+    t0 = time.perf_counter()
+    results: list = [None] * k
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, db_path, part, k, *args): part for part in range(k)}
+        for i, fut in enumerate(as_completed(futures), start=1):
+            results[futures[fut]] = fut.result()
+            print(f"[{i}/{k}] partitions done ({time.perf_counter() - t0:.1f}s)")
+    return results
@@ -0,0 +1,234 @@
+"""
+Per-player rolling baseline statistics maintained at ingest time.
+
+For every player two fixed-size windows are kept, anchored on the patch
+(matches.patch_id, see days_since_patch.PATCH_ID):
+
+    pre_last    the last BASELINE_N games before PATCH_ID   (player_performance baseline)
+    post_first  the first BASELINE_N games on PATCH_ID      (giveup_label baseline)
+
+Each window stores its (timestamp, metrics...) samples plus a Welford
+count/mean/M2 per metric. insert_match calls update_match_baselines(), which
+adds a game to a window (evicting the sample that falls out) with O(N) work
+for N=BASELINE_N - constant per game, no history scan. Because windows are
+defined by patch and timestamp rather than arrival order, ingesting matches
+out of order gives the same result.
+
+    python src/player_baselines.py    # rebuild the table from existing rows
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import math
+import sqlite3
+
+from days_since_patch import PATCH_ID, patch_id
+from db import connect, init_db
+from shards import require_unsharded
+
+BASELINE_N = 20
+
+METRICS = ("gold_per_min", "deaths_per_10")
+WINDOWS = ("pre_last", "post_first")
+
+
+def _columns() -> list[str]:
+    cols = []
+    for w in WINDOWS:
+        cols += [f"{w}_games", f"{w}_count"]
+        for m in METRICS:
+            cols += [f"{w}_{m}_mean", f"{w}_{m}_m2"]
+    return cols
+
+
+COLUMNS = _columns()
+
+
+def init_baselines(conn: sqlite3.Connection) -> bool:
+    """Create the table; a fresh table on a populated DB is rebuilt once. Returns True if rebuilt."""
+    new = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='player_baselines'"
+    ).fetchone() is None
+    col_sql = []
+    for c in COLUMNS:
+        col_sql.append(f"{c} TEXT" if c.endswith("_games") else f"{c} REAL")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS player_baselines (
+        puuid TEXT PRIMARY KEY,
+        {", ".join(col_sql)}
+    );
+    """)
+    conn.commit()
+    if new and conn.execute("SELECT 1 FROM participants LIMIT 1").fetchone():
+        print(f"Built baselines for {rebuild_baselines(conn)} players")
+        return True
+    return False
+
+
+def game_metrics(p: dict, duration_s: int | None) -> tuple[float, float] | None:
+    """Same definitions as the player_match_stats view."""
+    if not duration_s:
+        return None
+    minutes = duration_s / 60.0
+    return (p.get("goldEarned") or 0) / minutes, (p.get("deaths") or 0) / (duration_s / 600.0)
+
+
+def welford_add(n: float, mean: float, m2: float, x: float) -> tuple[float, float, float]:
+    n += 1
+    d = x - mean
+    mean += d / n
+    m2 += d * (x - mean)
+    return n, mean, m2
+
+
+def welford_remove(n: float, mean: float, m2: float, x: float) -> tuple[float, float, float]:
+    if n <= 1:
+        return 0, 0.0, 0.0
+    new_mean = (n * mean - x) / (n - 1)
+    m2 -= (x - new_mean) * (x - mean)
+    return n - 1, new_mean, max(m2, 0.0)
+
+
+class Window:
+    """Sorted samples plus running stats for one player/window."""
+
+    def __init__(self, name: str, row: sqlite3.Row | dict | None) -> None:
+        self.name = name
+        if row is None or row[f"{name}_games"] is None:
+            self.games: list[list[float]] = []
+            self.count = 0
+            self.stats = {m: [0.0, 0.0] for m in METRICS}
+        else:
+            self.games = json.loads(row[f"{name}_games"])
+            self.count = int(row[f"{name}_count"])
+            self.stats = {m: [row[f"{name}_{m}_mean"], row[f"{name}_{m}_m2"]] for m in METRICS}
+
+    def _apply(self, values: list[float], add: bool) -> None:
+        n = self.count
+        for m, x in zip(METRICS, values):
+            mean, m2 = self.stats[m]
+            _, mean, m2 = (welford_add if add else welford_remove)(n, mean, m2, x)
+            self.stats[m] = [mean, m2]
+        self.count = n + 1 if add else max(n - 1, 0)
+
+    def offer(self, sample: list[float], keep_earliest: bool) -> bool:
+        """Insert sample [ts, *metrics] if it belongs in the window; evict the overflow."""
+        ts = sample[0]
+        if any(g[0] == ts for g in self.games):
+            return False  # same game seen twice
+        if len(self.games) >= BASELINE_N:
+            if keep_earliest and ts >= self.games[-1][0]:
+                return False
+            if not keep_earliest and ts <= self.games[0][0]:
+                return False
+        bisect.insort(self.games, sample)
+        self._apply(sample[1:], add=True)
+        if len(self.games) > BASELINE_N:
+            evicted = self.games.pop() if keep_earliest else self.games.pop(0)
+            self._apply(evicted[1:], add=False)
+        return True
+
+    def values(self) -> list:
+        out = [json.dumps(self.games), self.count]
+        for m in METRICS:
+            out += self.stats[m]
+        return out
+
+
+def _upsert(conn: sqlite3.Connection, puuid: str, windows: list[Window]) -> None:
+    values = [v for w in windows for v in w.values()]
+    conn.execute(
+        f"INSERT OR REPLACE INTO player_baselines (puuid, {', '.join(COLUMNS)}) "
+        f"VALUES (?, {', '.join(['?'] * len(COLUMNS))})",
+        (puuid, *values),
+    )
+
+
+def _fetch_row(conn: sqlite3.Connection, puuid: str) -> sqlite3.Row | None:
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    return cur.execute("SELECT * FROM player_baselines WHERE puuid = ?", (puuid,)).fetchone()
+
+
+def update_player(conn: sqlite3.Connection, puuid: str, ts: int, patch: int, metrics: tuple[float, ...]) -> None:
+    if patch < PATCH_ID:
+        name, keep_earliest = "pre_last", False
+    elif patch == PATCH_ID:
+        name, keep_earliest = "post_first", True
+    else:
+        return
+    row = _fetch_row(conn, puuid)
+    windows = [Window(w, row) for w in WINDOWS]
+    target = windows[WINDOWS.index(name)]
+    if target.offer([ts, *metrics], keep_earliest):
+        _upsert(conn, puuid, windows)
+
+
+def update_match_baselines(conn: sqlite3.Connection, info: dict) -> None:
+    """Called by insert_match inside its transaction."""
+    ts = info.get("gameStartTimestamp")
+    patch = patch_id(info.get("gameVersion"))
+    if ts is None or patch is None:
+        return
+    for p in info.get("participants", []):
+        metrics = game_metrics(p, info.get("gameDuration"))
+        if metrics is not None and p.get("puuid"):
+            update_player(conn, p["puuid"], ts, patch, metrics)
+
+
+def get_baseline(conn: sqlite3.Connection, puuid: str, window: str = "post_first") -> dict | None:
+    """count/mean/std (ddof=0) per metric for one player's window - a single row lookup."""
+    row = _fetch_row(conn, puuid)
+    if row is None or not row[f"{window}_count"]:
+        return None
+    n = row[f"{window}_count"]
+    out = {"count": int(n), "max_ts": json.loads(row[f"{window}_games"])[-1][0]}
+    for m in METRICS:
+        out[f"{m}_mean"] = row[f"{window}_{m}_mean"]
+        out[f"{m}_std"] = math.sqrt(row[f"{window}_{m}_m2"] / n)
+    return out
+
+
+def rebuild_baselines(conn: sqlite3.Connection) -> int:
+    """Recompute every player's windows from participants/matches (one ordered scan)."""
+    require_unsharded(conn, "rebuild_baselines")
+    with conn:
+        conn.execute("DELETE FROM player_baselines")
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    rows = cur.execute("""
+        SELECT p.puuid, m.game_start_timestamp AS ts, m.patch_id, m.game_duration, p.gold_earned, p.deaths
+        FROM participants p JOIN matches m ON m.match_id = p.match_id
+        WHERE m.patch_id <= ? AND m.game_start_timestamp IS NOT NULL AND m.game_duration > 0
+        ORDER BY p.puuid, m.game_start_timestamp
+    """, (PATCH_ID,))
+
+    players = 0
+    current, windows = None, None
+    with conn:
+        for r in rows:
+            if r["puuid"] != current:
+                if current is not None:
+                    _upsert(conn, current, windows)
+                    players += 1
+                current, windows = r["puuid"], [Window(w, None) for w in WINDOWS]
+            metrics = game_metrics({"goldEarned": r["gold_earned"], "deaths": r["deaths"]}, r["game_duration"])
+            pre = r["patch_id"] < PATCH_ID
+            windows[0 if pre else 1].offer([r["ts"], *metrics], keep_earliest=not pre)
+        if current is not None:
+            _upsert(conn, current, windows)
+            players += 1
+    return players
+
+
+def main():
+    conn = connect()
+    init_db(conn)
+    if not init_baselines(conn):
+        print(f"Rebuilt baselines for {rebuild_baselines(conn)} players")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
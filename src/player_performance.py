@@ -1,17 +1,27 @@
 from __future__ import annotations
 
+import json
 import sqlite3
-import time
 from pathlib import Path
 
 import pandas as pd
 
-from days_since_patch import ms_since_patch
-from db import connect  
+from days_since_patch import PATCH_ID, ms_since_patch
+from db import DEFAULT_DB_PATH, connect, connect_readonly, get_watermark, init_feature_tables, set_watermark
+from duos import DUO_TABLE, load_duos, with_duo_flag
+from instrumentation import span
+from matchups import lane_opponent_champion
 from meta_character_ids import meta_ids 
+from partitions import N_PARTITIONS, connect_partition_reader, map_partitions, partition_clause
+from sequence_features import window_stats as sequence_window_stats
+from shards import require_unsharded
+from strata import load_tiers, player_strata
 
 # Output
 OUT_PATH = Path("Data/Processed/player_performance.csv")
+FEATURE_TABLE = "player_features"
+WATERMARK_NAME = "player_features"
+BUILD_COUNTER = "player_features_builds"  # bumped by every save, watched by query_service
 
 # Windows
 BASELINE_N = 20
@@ -24,24 +34,38 @@ META_PATCH_TS = ms_since_patch()
 
 # Meta champ IDs (set[int])
 META_CHAMPS = set(meta_ids())
-print("META_PATCH_TS =", META_PATCH_TS)
+print("META_PATCH_TS =", META_PATCH_TS, "PATCH_ID =", PATCH_ID)
 print("META_CHAMPS size:", len(META_CHAMPS), "sample:", list(sorted(META_CHAMPS))[:10])
 
 
-def load_player_games() -> pd.DataFrame:
+def load_player_games(db_path=DEFAULT_DB_PATH, puuids: set[str] | None = None) -> pd.DataFrame:
     """
     One row = one player in one match, with match timestamp attached.
+    With `puuids`, only matches involving those players are loaded (all ten
+    participants, so faced_meta still sees the opposing team).
     """
-    conn: sqlite3.Connection = connect()
-    print("Connected to DB via db.connect()")
-
-    query = """
+    # read-only: this is the longest read in the pipeline and must not hold up ingest
+    conn: sqlite3.Connection = connect_readonly(db_path)
+    require_unsharded(conn, "player_performance")
+
+    where, params = "", ()
+    if puuids is not None:
+        where = """WHERE p.match_id IN (
+            SELECT p2.match_id FROM participants p2 WHERE p2.puuid IN (SELECT value FROM json_each(?))
+        )"""
+        params = (json.dumps(sorted(puuids)),)
+
+    query = f"""
         SELECT
             p.match_id,
             p.team_id,
             p.puuid,
             m.game_start_timestamp AS game_start_time,
+            m.patch_id,
+            m.queue_id,
+            COALESCE(m.game_end_timestamp, m.game_start_timestamp + m.game_duration * 1000) AS game_end_time,
             p.champion_id,
+            p.team_position,
             p.win,
             p.kills,
             p.deaths,
@@ -54,9 +78,10 @@ def load_player_games() -> pd.DataFrame:
           ON p.match_id = m.match_id
         -- Optional: restrict to ranked solo
         -- WHERE m.queue_id = 420
+        {where}
         ORDER BY p.puuid, m.game_start_timestamp
     """
-    df = pd.read_sql(query, conn)
+    df = pd.read_sql(query, conn, params=params)
     conn.close()
 
     print(f"Loaded {len(df)} player-game rows")
@@ -72,29 +97,92 @@ def load_player_games() -> pd.DataFrame:
     return df
 
 
+def load_partition_games(conn: sqlite3.Connection, part: int, k: int, meta_ids_set: set[int],
+                         puuids: set[str] | None = None) -> pd.DataFrame:
+    """
+    load_player_games for one PUUID-hash partition, with faced_meta,
+    faced_meta_lane and with_duo already computed in SQL - the opponents and
+    teammates they need usually live in other partitions.
+    """
+    require_unsharded(conn, "player_performance")
+    has_duos = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (DUO_TABLE,)).fetchone()
+    with_duo = f"""(
+            EXISTS (SELECT 1 FROM participants t JOIN {DUO_TABLE} d ON d.puuid_a = p.puuid AND d.puuid_b = t.puuid
+                    WHERE t.match_id = p.match_id AND t.team_id = p.team_id)
+            OR EXISTS (SELECT 1 FROM participants t JOIN {DUO_TABLE} d ON d.puuid_a = t.puuid AND d.puuid_b = p.puuid
+                       WHERE t.match_id = p.match_id AND t.team_id = p.team_id))""" if has_duos else "0"
+    where = partition_clause("p.puuid")
+    params = {"k": k, "part": part, "meta": json.dumps(sorted(meta_ids_set))}
+    if puuids is not None:
+        where += " AND p.puuid IN (SELECT value FROM json_each(:puuids))"
+        params["puuids"] = json.dumps(sorted(puuids))
+
+    query = f"""
+        SELECT
+            p.match_id,
+            p.team_id,
+            p.puuid,
+            m.game_start_timestamp AS game_start_time,
+            COALESCE(m.game_end_timestamp, m.game_start_timestamp + m.game_duration * 1000) AS game_end_time,
+            m.patch_id,
+            m.queue_id,
+            p.champion_id,
+            p.team_position,
+            p.win,
+            p.kills,
+            p.deaths,
+            p.assists,
+            (p.total_minions_killed + p.neutral_minions_killed) AS cs,
+            p.gold_earned AS gold,
+            p.total_damage_dealt_to_champions AS damage,
+            EXISTS (SELECT 1 FROM participants o
+                    WHERE o.match_id = p.match_id AND o.team_id <> p.team_id
+                      AND o.champion_id IN (SELECT value FROM json_each(:meta))) AS faced_meta,
+            (SELECT CASE WHEN COUNT(*) = 1 THEN MAX(o.champion_id IN (SELECT value FROM json_each(:meta))) END
+             FROM participants o
+             WHERE o.match_id = p.match_id AND o.team_id <> p.team_id
+               AND o.team_position = p.team_position) AS faced_meta_lane,
+            {with_duo} AS with_duo
+        FROM participants AS p
+        JOIN matches AS m
+          ON p.match_id = m.match_id
+        WHERE {where}
+        ORDER BY p.puuid, m.game_start_timestamp
+    """
+    df = pd.read_sql(query, conn, params=params)
+    if df.empty:
+        return df
+    df["game_start_time"] = df["game_start_time"].astype("int64")
+    df["champion_id"] = df["champion_id"].astype("int64")
+    df["team_id"] = df["team_id"].astype("int64")
+    df["faced_meta_lane"] = df["faced_meta_lane"].astype("float64")
+    return df
+
+
 def add_faced_meta_flag(df: pd.DataFrame, meta_ids_set: set[int]) -> pd.DataFrame:
     """
     faced_meta = 1 if the opponent team has ANY meta champ in that match.
-    Fast: no merges, just groupby + lookup.
+    faced_meta_lane = 1 if the direct lane opponent is on a meta champ
+    (NaN when the lane opponent is unknown).
+    Vectorised: meta picks per match minus meta picks on the player's own team.
     """
     df = df.copy()
 
     if not meta_ids_set:
         df["faced_meta"] = 0
+        df["faced_meta_lane"] = 0.0
         return df
 
-    df["is_meta"] = df["champion_id"].isin(meta_ids_set).astype("int64")
-
-    # For each (match, team), did that team pick a meta champ?
-    team_has_meta = df.groupby(["match_id", "team_id"], sort=False)["is_meta"].max()
-
-    opp_team = 300 - df["team_id"].values
-    mids = df["match_id"].values
+    is_meta = df["champion_id"].isin(meta_ids_set).astype("int64")
+    match_meta = is_meta.groupby(df["match_id"], sort=False).transform("sum")
+    team_meta = is_meta.groupby([df["match_id"], df["team_id"]], sort=False).transform("sum")
+    df["faced_meta"] = (match_meta > team_meta).astype("int64")
 
-    faced = [team_has_meta.get((mid, ot), 0) for mid, ot in zip(mids, opp_team)]
-    df["faced_meta"] = pd.Series(faced, index=df.index).astype("int64")
-
-    df.drop(columns=["is_meta"], inplace=True)
+    if "team_position" in df.columns:
+        opp = lane_opponent_champion(df)
+        df["faced_meta_lane"] = opp.isin(meta_ids_set).astype("float64").where(opp.notna())
+    else:
+        df["faced_meta_lane"] = float("nan")
     return df
 
 
@@ -120,76 +208,218 @@ def compute_window_stats(df: pd.DataFrame, prefix: str) -> dict:
         f"{prefix}_gold": df["gold"].mean(),
         f"{prefix}_damage": df["damage"].mean(),
         f"{prefix}_faced_meta": df["faced_meta"].mean(),  # fraction in this window
+        f"{prefix}_faced_meta_lane": df["faced_meta_lane"].mean(),
+        f"{prefix}_with_duo": df["with_duo"].mean(),  # fraction played next to a flagged duo partner
     }
     return out
 
 
-def build_player_features() -> None:
-    t0 = time.time()
-    df = load_player_games()
-    print("load_player_games:", round(time.time() - t0, 3), "s")
-    if df.empty:
-        print("No rows loaded from DB; nothing to write.")
-        return
-
-    t1 = time.time()
-    df = add_faced_meta_flag(df, META_CHAMPS)
-    print("add_faced_meta_flag:", round(time.time() - t1, 3), "s")
-    print("faced_meta counts:", df["faced_meta"].value_counts().to_dict())
-
+def compute_player_features(df: pd.DataFrame) -> pd.DataFrame:
+    """Baseline/post/delta features for every player in `df` (needs faced_meta and with_duo)."""
     # Split pre/post
-    pre = df[df["game_start_time"] < META_PATCH_TS]
-    post = df[df["game_start_time"] >= META_PATCH_TS]
+    pre = df[df["patch_id"] < PATCH_ID]
+    post = df[df["patch_id"] >= PATCH_ID]
     print(f"Pre-patch rows: {len(pre)}, post-patch rows: {len(post)}")
 
     # Group once (FAST)
     post_groups = post.groupby("puuid", sort=False)
 
     features_rows: list[dict] = []
-    t2 = time.time()
 
-    for puuid, g_pre in pre.groupby("puuid", sort=False):
-        if puuid not in post_groups.groups:
-            continue
-        g_post = post_groups.get_group(puuid)
+    with span("build_loop") as sp:
+        for puuid, g_pre in pre.groupby("puuid", sort=False):
+            if puuid not in post_groups.groups:
+                continue
+            g_post = post_groups.get_group(puuid)
 
-        baseline_window = g_pre.tail(BASELINE_N)
-        post_window = g_post.head(POST_N_MAX)
+            baseline_window = g_pre.tail(BASELINE_N)
+            post_window = g_post.head(POST_N_MAX)
 
-        if len(baseline_window) < MIN_BASELINE or len(post_window) < POST_N_MIN:
-            continue
+            if len(baseline_window) < MIN_BASELINE or len(post_window) < POST_N_MIN:
+                continue
 
-        baseline_stats = compute_window_stats(baseline_window, "baseline")
-        post_stats = compute_window_stats(post_window, "post")
+            baseline_stats = compute_window_stats(baseline_window, "baseline")
+            post_stats = compute_window_stats(post_window, "post")
 
-        # exposure_meta = fraction of post games where they faced meta
-        exposure = post_stats["post_faced_meta"]
+            # exposure_meta = fraction of post games where they faced meta
+            exposure = post_stats["post_faced_meta"]
 
-        row = {"puuid": puuid, "exposure_meta": exposure}
-        row.update(baseline_stats)
-        row.update(post_stats)
+            row = {"puuid": puuid, "exposure_meta": exposure,
+                   "exposure_meta_lane": post_stats["post_faced_meta_lane"]}
+            row.update(baseline_stats)
+            row.update(post_stats)
 
-        # deltas: post - baseline
-        for key, val in post_stats.items():
-            if key.endswith("_ngames"):
-                continue
-            base_key = "baseline" + key[len("post"):]  # post_x -> baseline_x
-            if base_key in baseline_stats:
-                row["delta" + key[len("post"):]] = val - baseline_stats[base_key]
+            # deltas: post - baseline
+            for key, val in post_stats.items():
+                if key.endswith("_ngames"):
+                    continue
+                base_key = "baseline" + key[len("post"):]  # post_x -> baseline_x
+                if base_key in baseline_stats:
+                    row["delta" + key[len("post"):]] = val - baseline_stats[base_key]
 
-        features_rows.append(row)
+            features_rows.append(row)
+        sp.rows = len(features_rows)
 
-    print("build loop:", round(time.time() - t2, 3), "s")
     print(f"Built features for {len(features_rows)} players")
+    return pd.DataFrame(features_rows)
+
+
+def add_sequence_columns(df: pd.DataFrame, features_df: pd.DataFrame) -> pd.DataFrame:
+    if features_df.empty:
+        return features_df
+    with span("sequence_features") as sp:
+        seq = sequence_window_stats(df, PATCH_ID, BASELINE_N, POST_N_MAX)
+        sp.rows = len(seq)
+    return features_df.merge(seq, on="puuid", how="left")
+
+
+def add_strata_columns(df: pd.DataFrame, features_df: pd.DataFrame, tiers: pd.DataFrame) -> pd.DataFrame:
+    """main_position / main_queue / tier per player, the grouping keys of statistical_testing --by."""
+    if features_df.empty:
+        return features_df
+    return features_df.merge(player_strata(df, tiers), on="puuid", how="left")
+
+
+def feature_partition(db_path, part: int, k: int, meta_ids_set: set[int],
+                      puuids: set[str] | None = None) -> pd.DataFrame:
+    """Worker: feature rows for one PUUID-hash partition."""
+    conn = connect_partition_reader(db_path)
+    try:
+        df = load_partition_games(conn, part, k, meta_ids_set, puuids)
+        tiers = load_tiers(conn)
+    finally:
+        conn.close()
+    if df.empty:
+        return pd.DataFrame()
+    return add_strata_columns(df, add_sequence_columns(df, compute_player_features(df)), tiers)
+
+
+def changed_puuids(conn: sqlite3.Connection, since_seq: int) -> tuple[set[str], int]:
+    """Players in matches ingested after changelog seq `since_seq`, and the newest seq."""
+    require_unsharded(conn, "player_performance")
+    last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ingest_changelog").fetchone()[0]
+    rows = conn.execute("""
+        SELECT DISTINCT p.puuid FROM ingest_changelog c
+        JOIN participants p ON p.match_id = c.match_id
+        WHERE c.seq > ? AND c.seq <= ?
+    """, (since_seq, last)).fetchall()
+    return {r[0] for r in rows}, last
+
+
+def feature_table_matches(conn: sqlite3.Connection, features_df: pd.DataFrame) -> bool:
+    existing = [r[1] for r in conn.execute(f"PRAGMA table_info({FEATURE_TABLE})").fetchall()]
+    return existing == list(features_df.columns)
 
-    features_df = pd.DataFrame(features_rows)
+
+def save_features(conn: sqlite3.Connection, features_df: pd.DataFrame, puuids: set[str] | None) -> None:
+    """
+    Full replace (puuids=None) or upsert of the given players into FEATURE_TABLE.
+    Bumps BUILD_COUNTER either way; the changelog watermark does not move on a
+    rebuild without new matches.
+    """
+    set_watermark(conn, BUILD_COUNTER, (get_watermark(conn, BUILD_COUNTER) or 0) + 1)
+    if puuids is None:
+        features_df.to_sql(FEATURE_TABLE, conn, if_exists="replace", index=False)
+        conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{FEATURE_TABLE}_puuid ON {FEATURE_TABLE}(puuid)")
+        return
+    if not features_df.empty and not feature_table_matches(conn, features_df):
+        raise RuntimeError(f"{FEATURE_TABLE} columns changed; run a full rebuild")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS affected_puuids (puuid TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM affected_puuids")
+    conn.executemany("INSERT OR IGNORE INTO affected_puuids VALUES (?)", [(p,) for p in puuids])
+    # players that no longer qualify drop out, the rest are re-inserted
+    conn.execute(f"DELETE FROM {FEATURE_TABLE} WHERE puuid IN (SELECT puuid FROM affected_puuids)")
+    if not features_df.empty:
+        features_df.to_sql(FEATURE_TABLE, conn, if_exists="append", index=False)
+
+
+def build_in_memory(conn: sqlite3.Connection, db_path, puuids: set[str] | None) -> pd.DataFrame | None:
+    """Single-process build over the whole player-game frame; None when there are no rows."""
+    with span("load_player_games") as sp:
+        df = load_player_games(db_path, puuids)
+        sp.rows = len(df)
+    if df.empty:
+        print("No rows loaded from DB; nothing to write.")
+        return None
+
+    with span("add_faced_meta_flag") as sp:
+        df = add_faced_meta_flag(df, META_CHAMPS)
+        sp.rows = len(df)
+    print("faced_meta counts:", df["faced_meta"].value_counts().to_dict())
+
+    with span("add_duo_flag") as sp:
+        # duo_pairs comes from duos.py; without it every game counts as solo
+        df["with_duo"] = with_duo_flag(df, load_duos(conn))
+        sp.rows = int(df["with_duo"].sum())
+    if puuids is not None:
+        # opponents were only loaded for faced_meta
+        df = df[df["puuid"].isin(puuids)]
+
+    return add_strata_columns(df, add_sequence_columns(df, compute_player_features(df)), load_tiers(conn))
+
+
+@span("build_player_features")
+def build_player_features(db_path=DEFAULT_DB_PATH, incremental: bool = False,
+                          partitions: int | None = None, workers: int | None = None) -> None:
+    """
+    Full build, or with incremental=True only players in matches ingested since
+    the last run (ingest_changelog watermark). Features persist in FEATURE_TABLE
+    and the CSV is re-exported from it. With `partitions`, players are split by
+    PUUID hash and built in a process pool (see partitions.py).
+    """
+    conn = connect(db_path)
+    init_feature_tables(conn)
+    since = get_watermark(conn, WATERMARK_NAME) if incremental else None
+
+    puuids = None
+    if since is not None:
+        puuids, last_seq = changed_puuids(conn, since)
+        print(f"Incremental: {len(puuids)} players with new games since changelog seq {since}")
+        if not puuids:
+            conn.close()
+            return
+    else:
+        if incremental:
+            print("No watermark yet; doing a full build")
+        last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ingest_changelog").fetchone()[0]
+
+    if partitions:
+        with span("build_partitions") as sp:
+            parts = [p for p in map_partitions(feature_partition, db_path, partitions, workers, META_CHAMPS, puuids)
+                     if not p.empty]
+            if not parts:
+                print("No rows loaded from DB; nothing to write.")
+                conn.close()
+                return
+            features_df = pd.concat(parts, ignore_index=True)
+            sp.rows = len(features_df)
+        print(f"Built features for {len(features_df)} players in {partitions} partitions")
+    else:
+        features_df = build_in_memory(conn, db_path, puuids)
+        if features_df is None:
+            conn.close()
+            return
+
+    with span("save_features"), conn:
+        save_features(conn, features_df, puuids)
+        set_watermark(conn, WATERMARK_NAME, last_seq)
+
+    if puuids is not None:
+        features_df = pd.read_sql(f"SELECT * FROM {FEATURE_TABLE}", conn)
+    conn.close()
 
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
     features_df.to_csv(OUT_PATH, index=False)
 
     print("Saved player features to:", OUT_PATH.resolve())
-    print("Total time:", round(time.time() - t0, 3), "s")
 
 
 if __name__ == "__main__":
-    build_player_features()
+    import argparse
+    parser = argparse.ArgumentParser(description="Build per-player baseline/post features")
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--partitions", type=int, default=None,
+                        help=f"split players into K PUUID-hash partitions (e.g. {N_PARTITIONS}) built in a process pool")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    build_player_features(incremental=args.incremental, partitions=args.partitions, workers=args.workers)
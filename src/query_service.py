@@ -0,0 +1,455 @@
+"""
+Local read-only query service over riot.db and the derived tables.
+
+Answers per-player and per-champion questions from a Python API
+(QueryService) or over HTTP:
+
+    GET /player/{puuid}                        games per patch, player_features row,
+                                               baselines, give-up label, duo partners
+    GET /champion/{id or name}?patch=&lane=    pick/win rate on a patch vs the patch
+                                               before, best/worst matchups
+    GET /stats                                 cache counters
+
+    python src/query_service.py --db Data/Raw/riot.db --port 8090
+
+Each of the --workers HTTP threads keeps its own read-only WAL connection,
+so queries never block ingest or each other. Results are kept in an LRU cache and
+hot indexes (champion name -> id, per-patch champion pick/win counts, the
+matchup matrix) are held in memory. Cache entries carry tags; when
+ingest_matches/ingest_pipeline append to ingest_changelog, only the entries
+for the patches and players in the new matches are dropped, and a new
+matchups.npz, player_features or duo_pairs rebuild drops the entries built
+from them. A value computed while an eviction happens is returned but not
+cached, so it cannot outlive the invalidation.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Hashable
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from days_since_patch import PATCH_ID, RANKED_SOLO_QUEUE
+from db import DEFAULT_DB_PATH, connect_readonly, get_watermark
+from duos import DUO_TABLE
+from giveup_label import label_player_games
+from matchups import LAYERS, MATRIX_PATH, MatchupMatrix
+from player_baselines import get_baseline
+from shards import require_unsharded
+
+# player_performance resolves meta champions at import time, so its names are repeated here
+FEATURE_TABLE = "player_features"
+FEATURE_BUILDS = "player_features_builds"
+CACHE_SIZE = 10_000
+REFRESH_SECONDS = 1.0   # how often the changelog is polled, at most
+MATCHUP_MIN_GAMES = 20
+TOP_MATCHUPS = 5
+READER_CACHE_KB = 64 * 1024
+WORKERS = 8
+
+
+class LRUCache:
+    """Thread-safe LRU of tagged entries; evict(tags) drops every entry sharing one of them."""
+
+    def __init__(self, max_size: int = CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[Hashable, tuple[frozenset, object]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0, "stale_puts": 0}
+        # bumped by every evict(); a value computed across an eviction may predate it
+        self.generation = 0
+
+    def get(self, key: Hashable):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value, tags=(), generation: int | None = None) -> None:
+        """Store `value`, unless `generation` is given and an eviction has happened since."""
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                self.stats["stale_puts"] += 1
+                return
+            self.entries[key] = (frozenset(tags), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def evict(self, tags) -> int:
+        tags = set(tags)
+        if not tags:
+            return 0
+        with self.lock:
+            stale = [k for k, (t, _) in self.entries.items() if not t.isdisjoint(tags)]
+            for k in stale:
+                del self.entries[k]
+            self.generation += 1
+            self.stats["evicted"] += len(stale)
+        return len(stale)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def clean(value):
+    """JSON-safe copy: NaN -> None, numpy scalars -> Python."""
+    if isinstance(value, dict):
+        return {k: clean(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [clean(v) for v in value]
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class QueryService:
+    def __init__(self, db_path=DEFAULT_DB_PATH, matrix_path: Path = MATRIX_PATH,
+                 cache_size: int = CACHE_SIZE, refresh_seconds: float = REFRESH_SECONDS) -> None:
+        self.db_path = Path(db_path)
+        self.matrix_path = Path(matrix_path)
+        self.cache = LRUCache(cache_size)
+        self.refresh_seconds = refresh_seconds
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.checked_at = 0.0
+        self.matrix: MatchupMatrix | None = None
+        self.matrix_mtime: float | None = None
+
+        conn = self.conn()
+        require_unsharded(conn, "query_service")
+        self.seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ingest_changelog").fetchone()[0]
+        self.features_mark = self._features_mark(conn, FEATURE_BUILDS)
+        self.duos_mark = self._features_mark(conn, DUO_TABLE)
+        self._load_matrix()
+
+    def conn(self):
+        """This thread's read-only connection."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = connect_readonly(self.db_path)
+            conn.execute(f"PRAGMA cache_size = -{READER_CACHE_KB};")
+            self.local.conn = conn
+        return conn
+
+    def has_table(self, name: str) -> bool:
+        row = self.conn().execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                  (name,)).fetchone()
+        return row is not None
+
+    def _features_mark(self, conn, name: str) -> int | None:
+        if not self.has_table("feature_watermarks"):
+            return None
+        return get_watermark(conn, name)
+
+    def _load_matrix(self) -> None:
+        mtime = self.matrix_path.stat().st_mtime if self.matrix_path.exists() else None
+        if mtime == self.matrix_mtime:
+            return
+        self.matrix = MatchupMatrix.load(self.matrix_path) if mtime is not None else None
+        self.matrix_mtime = mtime
+        self.cache.evict(["matchups"])
+
+    def refresh(self, force: bool = False) -> dict | None:
+        """
+        Poll ingest_changelog (at most every refresh_seconds) and drop what new
+        matches made stale. Returns what was invalidated, or None if nothing changed.
+        """
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.refresh_seconds:
+            return None
+        with self.lock:
+            if not force and now - self.checked_at < self.refresh_seconds:
+                return None
+            self.checked_at = now
+            conn = self.conn()
+            tags: set = set()
+
+            last = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM ingest_changelog").fetchone()[0]
+            patches, puuids = set(), set()
+            if last > self.seq:
+                require_unsharded(conn, "query_service")
+                rows = conn.execute("""
+                    SELECT DISTINCT m.patch_id, p.puuid FROM ingest_changelog c
+                    JOIN matches m ON m.match_id = c.match_id
+                    JOIN participants p ON p.match_id = c.match_id
+                    WHERE c.seq > ? AND c.seq <= ?
+                """, (self.seq, last)).fetchall()
+                patches = {r[0] for r in rows}
+                puuids = {r[1] for r in rows}
+                tags |= {("patch", p) for p in patches} | {("puuid", p) for p in puuids}
+                # new champions or patches change the name/patch indexes
+                tags.add("index")
+                self.seq = last
+
+            mark = self._features_mark(conn, FEATURE_BUILDS)
+            if mark != self.features_mark:
+                tags.add("features")
+                self.features_mark = mark
+            mark = self._features_mark(conn, DUO_TABLE)
+            if mark != self.duos_mark:
+                tags.add("duos")
+                self.duos_mark = mark
+            self._load_matrix()
+
+            if not tags:
+                return None
+            evicted = self.cache.evict(tags)
+            return {"seq": self.seq, "patches": sorted(p for p in patches if p is not None),
+                    "players": len(puuids), "evicted": evicted}
+
+    def cached(self, key: Hashable, tags, compute: Callable):
+        self.refresh()
+        value = self.cache.get(key)
+        if value is None:
+            # if refresh() evicts while compute() runs, the value may be from before the
+            # new matches; return it but do not cache it
+            generation = self.cache.generation
+            value = compute()
+            if value is not None:
+                self.cache.put(key, value, tags, generation)
+        return value
+
+    # --- hot indexes
+
+    def champion_names(self) -> dict[str, int]:
+        def compute():
+            rows = self.conn().execute(
+                "SELECT DISTINCT champion_id, champion_name FROM participants WHERE champion_name IS NOT NULL"
+            ).fetchall()
+            return {name.lower(): cid for cid, name in rows}
+        return self.cached(("champion_names",), ["index"], compute)
+
+    def patch_stats(self, patch: int) -> dict:
+        """{'total_picks', 'champions': {id: (name, games, wins)}} for ranked solo on one patch."""
+        def compute():
+            rows = self.conn().execute("""
+                SELECT p.champion_id, MAX(p.champion_name), COUNT(*), SUM(p.win)
+                FROM participants p JOIN matches m ON m.match_id = p.match_id
+                WHERE m.patch_id = ? AND m.queue_id = ?
+                GROUP BY p.champion_id
+            """, (patch, RANKED_SOLO_QUEUE)).fetchall()
+            champions = {cid: (name, games, wins or 0) for cid, name, games, wins in rows}
+            return {"total_picks": sum(g for _, g, _ in champions.values()), "champions": champions}
+        return self.cached(("patch_stats", patch), [("patch", patch)], compute)
+
+    def previous_patch(self, patch: int) -> int | None:
+        def compute():
+            row = self.conn().execute("SELECT MAX(patch_id) FROM matches WHERE patch_id < ? AND queue_id = ?",
+                                      (patch, RANKED_SOLO_QUEUE)).fetchone()
+            return {"patch": row[0]}
+        return self.cached(("previous_patch", patch), ["index"], compute)["patch"]
+
+    # --- queries
+
+    def resolve_champion(self, champion: int | str) -> int | None:
+        if isinstance(champion, int) or str(champion).lstrip("-").isdigit():
+            return int(champion)
+        return self.champion_names().get(str(champion).lower())
+
+    def champion(self, champion: int | str, patch: int = PATCH_ID, lane: str | None = None) -> dict | None:
+        """Pick/win rate on `patch` and the patch before it, plus best/worst matchups (None if unknown)."""
+        champion_id = self.resolve_champion(champion)
+        if champion_id is None:
+            return None
+        if lane is not None and lane not in LAYERS:
+            raise ValueError(f"Unknown lane: {lane}")
+
+        prev = self.previous_patch(patch)
+
+        def compute():
+            out = {"champion_id": champion_id, "champion_name": None, "patch": patch, "previous_patch": prev}
+            for label, p in (("current", patch), ("previous", prev)):
+                if p is None:
+                    out[label] = None
+                    continue
+                stats = self.patch_stats(p)
+                name, games, wins = stats["champions"].get(champion_id, (None, 0, 0))
+                out["champion_name"] = out["champion_name"] or name
+                total = stats["total_picks"]
+                out[label] = {
+                    "games": games, "wins": wins,
+                    "pick_rate": games / total if total else 0.0,
+                    "win_rate": wins / games if games else None,
+                }
+            if out["current"] and out["previous"]:
+                out["pick_rate_delta"] = out["current"]["pick_rate"] - out["previous"]["pick_rate"]
+
+            if self.matrix is not None:
+                opp = self.matrix.opponents(champion_id, lane, min_games=MATCHUP_MIN_GAMES)
+                out["lane"] = lane or "ALL"
+                out["best_matchups"] = opp.head(TOP_MATCHUPS).to_dict("records")
+                out["worst_matchups"] = opp.tail(TOP_MATCHUPS).iloc[::-1].to_dict("records")
+            return clean(out)
+
+        tags = [("patch", patch), ("patch", prev), "matchups"]
+        return self.cached(("champion", champion_id, patch, lane), tags, compute)
+
+    def give_up(self, puuid: str) -> dict | None:
+        """giveup_label's per-player label over this player's games on the patch under study."""
+        games = pd.read_sql_query("""
+            SELECT s.puuid, s.game_creation, s.gold_per_min, s.deaths_per_10
+            FROM player_match_stats s JOIN matches m ON m.match_id = s.match_id
+            WHERE s.puuid = ? AND m.patch_id = ?
+        """, self.conn(), params=(puuid, PATCH_ID)).dropna(subset=["gold_per_min", "deaths_per_10"])
+        if games.empty:
+            return None
+        labeled = label_player_games(games)["give_up_game"]
+        total, count = int(labeled.count()), float(labeled.sum())
+        return {"total_games": total, "give_up_count": count, "gave_up": int(count > 0),
+                "player_give_up_rate": count / total if total else None}
+
+    def duo_partners(self, puuid: str) -> list[dict]:
+        if not self.has_table(DUO_TABLE):
+            return []
+        rows = self.conn().execute(f"""
+            SELECT puuid_b AS partner, games_together, share FROM {DUO_TABLE} WHERE puuid_a = ?
+            UNION ALL
+            SELECT puuid_a, games_together, share FROM {DUO_TABLE} WHERE puuid_b = ?
+            ORDER BY games_together DESC
+        """, (puuid, puuid)).fetchall()
+        return [dict(r) for r in rows]
+
+    def player(self, puuid: str) -> dict | None:
+        """Everything known about one player (None if they have no games)."""
+        def compute():
+            conn = self.conn()
+            games = conn.execute("""
+                SELECT m.patch_id, COUNT(*) AS games, SUM(p.win) AS wins
+                FROM participants p JOIN matches m ON m.match_id = p.match_id
+                WHERE p.puuid = ? GROUP BY m.patch_id ORDER BY m.patch_id
+            """, (puuid,)).fetchall()
+            if not games:
+                return None
+            out = {"puuid": puuid, "patches": [dict(r) for r in games]}
+            features = None
+            if self.has_table(FEATURE_TABLE):
+                features = conn.execute(f"SELECT * FROM {FEATURE_TABLE} WHERE puuid = ?", (puuid,)).fetchone()
+            out["features"] = dict(features) if features is not None else None
+            if self.has_table("player_baselines"):
+                out["baselines"] = {w: get_baseline(conn, puuid, w) for w in ("pre_last", "post_first")}
+            out["give_up"] = self.give_up(puuid)
+            out["duo_partners"] = self.duo_partners(puuid)
+            return clean(out)
+
+        # a player's row only changes when they play or the feature/duo tables are rebuilt
+        return self.cached(("player", puuid), [("puuid", puuid), "features", "duos"], compute)
+
+    def stats(self) -> dict:
+        return {"seq": self.seq, "entries": len(self.cache), **self.cache.stats}
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Requests run on a fixed pool of worker threads instead of a thread per
+    request, so each worker keeps its read-only connection (and page cache).
+    """
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], service: QueryService, workers: int = WORKERS) -> None:
+        super().__init__(address, QueryHandler)
+        self.service = service
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+
+    def process_request(self, request, client_address) -> None:
+        self.executor.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_in_thread(self) -> threading.Thread:
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server: QueryServer
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_json(self, status: int, body) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        qs = parse_qs(url.query)
+        service = self.server.service
+        try:
+            if parts == ["stats"]:
+                self.send_json(200, service.stats())
+                return
+            if len(parts) == 2 and parts[0] == "player":
+                body = service.player(parts[1])
+                if body is not None:
+                    self.send_json(200, body)
+                    return
+            if len(parts) == 2 and parts[0] == "champion":
+                patch = int(qs.get("patch", [PATCH_ID])[0])
+                lane = qs.get("lane", [None])[0]
+                body = service.champion(parts[1], patch, lane.upper() if lane else None)
+                if body is not None:
+                    self.send_json(200, body)
+                    return
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(404, {"error": "not found"})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local query service over riot.db")
+    parser.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    parser.add_argument("--matrix", default=str(MATRIX_PATH), help="matchups.npz from matchups.py")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE)
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    args = parser.parse_args()
+
+    service = QueryService(args.db, Path(args.matrix), args.cache_size)
+    srv = QueryServer((args.host, args.port), service, args.workers)
+    print(f"Query service on {srv.base_url} (changelog seq {service.seq})")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Cache stats:", service.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@ import json
 import requests
 from pathlib import Path
 from Config import api_key
+from instrumentation import incr, observe
+from match_payload import loads
 
 AMERICAS = "https://americas.api.riotgames.com"
 PLATFORM  = "https://na1.api.riotgames.com" 
@@ -19,19 +21,29 @@ def riot_headers() -> dict:
     return {"X-Riot-Token": api_key}
 
 def fetch_json(url: str, retries: int = 5, backoff: float = 1.5) -> dict:
+    return loads(fetch_bytes(url, retries, backoff))
+
+def fetch_bytes(url: str, retries: int = 5, backoff: float = 1.5) -> bytes:
+    """Raw response body, for callers that cache it verbatim or decode it themselves."""
     h = riot_headers()
     for attempt in range(retries):
+        t0 = time.perf_counter()
         r = requests.get(url, headers=h, timeout=20)
+        observe("riot_api_request_seconds", time.perf_counter() - t0, status=r.status_code)
 
         if r.status_code == 429:
             wait = int(r.headers.get("Retry-After", "1"))
+            incr("riot_api_retries_total", reason="429")
+            incr("riot_api_retry_sleep_seconds_total", wait)
             time.sleep(wait)
             continue
         if r.status_code in (500, 502, 503, 504):
+            incr("riot_api_retries_total", reason="5xx")
+            incr("riot_api_retry_sleep_seconds_total", backoff ** attempt)
             time.sleep(backoff ** attempt)
             continue
         r.raise_for_status()
-        return r.json()
+        return r.content
     
     raise RuntimeError(f"Failed to fetch after {retries} tries:{url}")
 
@@ -41,6 +53,15 @@ def match_url(match_id: str) -> str:
 def fetch_match(match_id: str) -> dict:
     return fetch_json(match_url(match_id))
 
+def fetch_match_raw(match_id: str) -> bytes:
+    return fetch_bytes(match_url(match_id))
+
+def timeline_url(match_id: str) -> str:
+    return f"{AMERICAS}/lol/match/v5/matches/{match_id}/timeline"
+
+def fetch_timeline_raw(match_id: str) -> bytes:
+    return fetch_bytes(timeline_url(match_id))
+
 def cache_write(obj: dict, path: Path)-> None:
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(json.dumps(obj, ensure_ascii=False), encoding="utf-8")
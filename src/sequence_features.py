@@ -0,0 +1,112 @@
+"""
+Behavioural sequence features: streaks, sessions and gaps between games.
+
+Works on the whole player-game table at once. After one sort by
+(puuid, game_start_time) every feature is a shift/cumsum over the sorted
+columns - a new player, a new session or a new win/loss run is a boolean
+"starts here" column whose cumsum gives a group key - so there is no
+per-player Python loop.
+
+Per game:
+    gap_min       minutes between the previous game's end and this start (NaN for a first game)
+    session_game  position in the session (1-based); a session ends after a gap > SESSION_GAP_MIN
+    session_games games in that session
+    loss_streak   consecutive losses right before this game (win_streak likewise)
+
+window_stats() summarises them over the same baseline/post windows as
+player_performance, and build_player_features merges the result into the
+player feature table.
+"""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+SESSION_GAP_MIN = 30
+TILT_STREAK = 3  # games started after this many straight losses
+
+
+def add_sequence_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Needs puuid, game_start_time, win and optionally game_end_time (ms). Returns
+    a copy sorted by (puuid, game_start_time) with the per-game columns above.
+    """
+    df = df.sort_values(["puuid", "game_start_time"], kind="stable", ignore_index=True)
+    n = len(df)
+    if n == 0:
+        return df.assign(gap_min=pd.Series(dtype="float64"), session_game=0, session_games=0,
+                         loss_streak=0, win_streak=0)
+
+    puuid = df["puuid"].to_numpy()
+    start = df["game_start_time"].to_numpy(dtype="int64")
+    end = df["game_end_time"].to_numpy(dtype="float64") if "game_end_time" in df.columns \
+        else np.full(n, np.nan)
+    end = np.where(np.isnan(end), start, end)
+    win = df["win"].to_numpy(dtype="int64")
+
+    first = np.ones(n, dtype=bool)
+    first[1:] = puuid[1:] != puuid[:-1]
+
+    # gaps: previous row's end, except across players
+    prev_end = np.empty(n)
+    prev_end[0] = np.nan
+    prev_end[1:] = end[:-1]
+    gap = np.where(first, np.nan, np.clip(start - prev_end, 0, None) / 60_000)
+    df["gap_min"] = gap
+
+    # sessions: a new one starts at each player's first game and after a long gap
+    with np.errstate(invalid="ignore"):
+        new_session = first | (gap > SESSION_GAP_MIN)
+    session_key = np.cumsum(new_session)
+    session_start = np.flatnonzero(new_session)
+    session_len = np.diff(np.append(session_start, n))
+    df["session_game"] = np.arange(n) - session_start[session_key - 1] + 1
+    df["session_games"] = session_len[session_key - 1]
+
+    # win/loss runs: position within the run including this game, then shifted by one
+    new_run = first.copy()
+    new_run[1:] |= win[1:] != win[:-1]
+    run_key = np.cumsum(new_run)
+    run_pos = np.arange(n) - np.flatnonzero(new_run)[run_key - 1] + 1
+    prev_loss = np.zeros(n, dtype="int64")
+    prev_win = np.zeros(n, dtype="int64")
+    prev_loss[1:] = np.where(win[:-1] == 0, run_pos[:-1], 0)
+    prev_win[1:] = np.where(win[:-1] == 1, run_pos[:-1], 0)
+    df["loss_streak"] = np.where(first, 0, prev_loss)
+    df["win_streak"] = np.where(first, 0, prev_win)
+    return df
+
+
+def window_rows(df: pd.DataFrame, patch: int, baseline_n: int, post_n: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """The last baseline_n games before patch_id `patch` and the first post_n from it on (df sorted as above)."""
+    pre = df[df["patch_id"] < patch]
+    post = df[df["patch_id"] >= patch]
+    pre = pre[pre.groupby("puuid", sort=False).cumcount(ascending=False) < baseline_n]
+    post = post[post.groupby("puuid", sort=False).cumcount() < post_n]
+    return pre, post
+
+
+def summarise(df: pd.DataFrame, prefix: str) -> pd.DataFrame:
+    """Per-player sequence stats over one window."""
+    g = df.assign(
+        after_tilt=(df["loss_streak"] >= TILT_STREAK).astype("int64"),
+        loss_run=np.where(df["win"] == 0, df["loss_streak"] + 1, 0),
+    ).groupby("puuid", sort=False)
+    return pd.DataFrame({
+        f"{prefix}_gap_min": g["gap_min"].median(),
+        f"{prefix}_session_games": g["session_games"].mean(),
+        f"{prefix}_max_loss_streak": g["loss_run"].max(),
+        f"{prefix}_after_loss_streak": g["after_tilt"].mean(),
+    })
+
+
+def window_stats(df: pd.DataFrame, patch: int, baseline_n: int, post_n: int) -> pd.DataFrame:
+    """baseline_*/post_*/delta_* sequence features per puuid, ready to merge into the feature table."""
+    seq = add_sequence_features(df)
+    pre, post = window_rows(seq, patch, baseline_n, post_n)
+    base, after = summarise(pre, "baseline"), summarise(post, "post")
+    out = base.join(after, how="inner")
+    for col in after.columns:
+        name = col[len("post"):]
+        out["delta" + name] = out[col] - out["baseline" + name]
+    return out.rename_axis("puuid").reset_index()
@@ -0,0 +1,364 @@
+"""
+Patch-partitioned storage: one SQLite file per patch for matches,
+participants and match_cache.
+
+    Data/Raw/shards/riot_p1505.db   matches whose gameVersion is 15.5.x
+    Data/Raw/shards/manifest.json   finalised shards (read-only, compacted)
+
+The crawl tables, ingest_changelog and derived tables stay in riot.db; the
+ingest writer ATTACHes the shard for each match's patch and inserts there
+(see ingest_pipeline --shards). Old patches never change, so once a patch is
+over its shard is finalised: checkpointed, VACUUMed, switched out of WAL and
+made read-only. Queries go through open_window() or open_patches(), which
+ATTACH only the shards overlapping a time window (or the given patches) and
+expose them as temp tables/views with the usual table names, so existing
+SQL (meta_detection) runs unchanged.
+
+Consumers that work on sharded data:
+
+    meta_detection --shards     exact counts over open_window()/open_patches()
+    meta_detection --approx     sketches, maintained in riot.db at ingest time
+    player_baselines, meta_stream, sketches
+                                incremental state updated by the ingest writer
+                                (get_baseline, window_stats, the alert stream)
+    backfill --shards           rewrites each active shard in place
+
+Everything else reads matches/participants from riot.db directly
+(player_performance, duos, matchups, giveup_label, query_service, the
+rebuild_*/replay paths and maintenance archive). Once ingest_pipeline --shards
+has run against a riot.db it records the shard root there (shard_roots), and
+those consumers call require_unsharded() and refuse to run instead of quietly
+working on the matches that happen to still be in riot.db. On a connection from
+open_window()/open_patches() the check passes, since that is shard data.
+
+    python src/shards.py split                  # copy riot.db matches into shards
+    python src/shards.py status
+    python src/shards.py finalize 1504
+    python src/shards.py backup Data/Backup     # copies only shards that changed
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import stat
+from pathlib import Path
+
+from days_since_patch import patch_id
+from db import DEFAULT_DB_PATH, checkpoint, connect_readonly, connect_writer, init_db
+
+SHARD_DIR = DEFAULT_DB_PATH.parent / "shards"
+MANIFEST = "manifest.json"
+SHARDED_TABLES = ("matches", "participants", "match_cache")
+MAX_ATTACHED = 10  # SQLite's default SQLITE_MAX_ATTACHED
+
+
+def init_shard_tables(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shard_roots (
+            root TEXT PRIMARY KEY,
+            since INTEGER NOT NULL DEFAULT (strftime('%s','now'))
+        )
+    """)
+    conn.commit()
+
+
+def mark_sharded(conn: sqlite3.Connection, root: str | Path) -> None:
+    """Record in riot.db that matches are ingested into the shards under `root`."""
+    init_shard_tables(conn)
+    with conn:
+        conn.execute("INSERT OR IGNORE INTO shard_roots (root) VALUES (?)", (str(Path(root).resolve()),))
+
+
+def shard_root(conn: sqlite3.Connection) -> str | None:
+    """The shard root recorded by a sharded ingest, or None for a single-file database."""
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='shard_roots'").fetchone()
+    if not exists:
+        return None
+    row = conn.execute("SELECT root FROM shard_roots ORDER BY since DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def require_unsharded(conn: sqlite3.Connection, consumer: str) -> None:
+    """Raise if `consumer` would read riot.db's matches/participants while new matches go to shards."""
+    root = shard_root(conn)
+    if root is not None:
+        raise RuntimeError(
+            f"{consumer} reads matches/participants from riot.db, but matches are ingested into "
+            f"shards under {root}; it does not support sharded storage (see shards.py)"
+        )
+
+
+def schema_name(patch: int) -> str:
+    return f"p{patch}"
+
+
+class ShardSet:
+    def __init__(self, root: str | Path = SHARD_DIR) -> None:
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def path(self, patch: int) -> Path:
+        return self.root / f"riot_{schema_name(patch)}.db"
+
+    def patches(self) -> list[int]:
+        return sorted(int(p.stem.split("_p")[1]) for p in self.root.glob("riot_p*.db"))
+
+    def manifest(self) -> dict:
+        path = self.root / MANIFEST
+        return json.loads(path.read_text()) if path.exists() else {}
+
+    def _save_manifest(self, manifest: dict) -> None:
+        tmp = self.root / (MANIFEST + ".tmp")
+        tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True))
+        os.replace(tmp, self.root / MANIFEST)
+
+    def is_final(self, patch: int) -> bool:
+        return str(patch) in self.manifest()
+
+    def ensure(self, patch: int) -> Path:
+        """Create the shard file with the standard schema if it does not exist yet."""
+        path = self.path(patch)
+        if not path.exists():
+            conn = connect_writer(path)
+            init_db(conn)
+            conn.close()
+        return path
+
+    def attach(self, conn: sqlite3.Connection, patch: int) -> str:
+        """ATTACH one shard to a writer connection (outside any transaction). Returns its schema name."""
+        return self.attach_many(conn, [patch])[patch]
+
+    def attach_many(self, conn: sqlite3.Connection, patches) -> dict[int, str]:
+        """
+        ATTACH every shard in `patches` to a writer connection (outside any
+        transaction) and return patch -> schema name. To stay under
+        MAX_ATTACHED, only shards outside `patches` are detached, so a schema
+        returned here stays valid until the next call.
+        """
+        wanted = {patch: schema_name(patch) for patch in sorted(set(patches))}
+        if len(wanted) > MAX_ATTACHED:
+            raise RuntimeError(f"{len(wanted)} shards requested; at most {MAX_ATTACHED} can be attached at once")
+        for patch, name in wanted.items():
+            if self.is_final(patch):
+                raise RuntimeError(f"shard {patch} is finalised; refusing to write to it")
+        attached = [r[1] for r in conn.execute("PRAGMA database_list").fetchall() if r[1] not in ("main", "temp")]
+        missing = [p for p, name in wanted.items() if name not in attached]
+        unused = [a for a in attached if a not in wanted.values()]
+        for name in unused[:max(len(attached) + len(missing) - MAX_ATTACHED, 0)]:
+            conn.execute(f"DETACH DATABASE {name}")
+        for patch in missing:
+            conn.execute("ATTACH DATABASE ? AS " + wanted[patch], (str(self.ensure(patch)),))
+        return wanted
+
+    def time_range(self, patch: int) -> tuple[int | None, int | None]:
+        final = self.manifest().get(str(patch))
+        if final:
+            return final["min_ts"], final["max_ts"]
+        conn = connect_readonly(self.path(patch))
+        try:
+            return tuple(conn.execute("SELECT MIN(game_start_timestamp), MAX(game_start_timestamp) FROM matches").fetchone())
+        finally:
+            conn.close()
+
+    def finalize(self, patch: int) -> dict:
+        """Compact a finished patch and make it read-only."""
+        path = self.path(patch)
+        if not path.exists():
+            raise FileNotFoundError(path)
+        conn = sqlite3.connect(path)
+        checkpoint(conn, "TRUNCATE")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("VACUUM")
+        n, lo, hi = conn.execute(
+            "SELECT COUNT(*), MIN(game_start_timestamp), MAX(game_start_timestamp) FROM matches"
+        ).fetchone()
+        conn.close()
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        entry = {"matches": n, "min_ts": lo, "max_ts": hi, "bytes": path.stat().st_size}
+        manifest = self.manifest()
+        manifest[str(patch)] = entry
+        self._save_manifest(manifest)
+        print(f"Finalised shard {patch}: {n} matches, {entry['bytes'] / 2**20:.1f} MB")
+        return entry
+
+    def open_window(self, start_ms: int | None = None, end_ms: int | None = None) -> sqlite3.Connection:
+        """
+        Read-only query connection over the shards overlapping [start_ms, end_ms).
+
+        matches and participants rows in the window are copied into indexed temp
+        tables (a join across UNION ALL views cannot use the shard indexes), so
+        the connection is also a point-in-time snapshot of the window.
+        match_cache is a UNION ALL view - point lookups push down fine - and
+        player_match_stats is recreated over the temp tables.
+        """
+        patches = []
+        for patch in self.patches():
+            lo, hi = self.time_range(patch)
+            if lo is None or (end_ms is not None and lo >= end_ms) or (start_ms is not None and hi < start_ms):
+                continue
+            patches.append(patch)
+
+        window, params = "1", []
+        if start_ms is not None:
+            window += " AND game_start_timestamp >= ?"
+            params.append(start_ms)
+        if end_ms is not None:
+            window += " AND game_start_timestamp < ?"
+            params.append(end_ms)
+        return self._open(patches, window, params)
+
+    def open_patches(self, patch_ids) -> sqlite3.Connection:
+        """Like open_window, over every row of the given patches' shards (one file per patch, no filtering)."""
+        have = set(self.patches())
+        return self._open([p for p in sorted(set(patch_ids)) if p in have], "1", [])
+
+    def _open(self, patches: list[int], window: str, params: list) -> sqlite3.Connection:
+        if len(patches) > MAX_ATTACHED:
+            raise RuntimeError(f"window spans more than {MAX_ATTACHED} patches; narrow it")
+        conn = sqlite3.connect("file::memory:", uri=True)
+        conn.row_factory = sqlite3.Row
+        names = []
+        for patch in patches:
+            name = schema_name(patch)
+            conn.execute(f"ATTACH DATABASE ? AS {name}", (f"{self.path(patch).resolve().as_uri()}?mode=ro",))
+            names.append(name)
+
+        print(f"Window attached shards: {', '.join(names) or 'none'}")
+        if not names:
+            conn.execute("PRAGMA query_only = ON")
+            return conn
+
+        first = names[0]
+        conn.execute(f"CREATE TEMP TABLE matches AS SELECT * FROM {first}.matches WHERE 0")
+        conn.execute(f"CREATE TEMP TABLE participants AS SELECT * FROM {first}.participants WHERE 0")
+        match_cols = [r[1] for r in conn.execute("PRAGMA temp.table_info(matches)").fetchall()]
+        if "patch_id" not in match_cols:
+            conn.execute("ALTER TABLE temp.matches ADD COLUMN patch_id INTEGER")
+            match_cols.append("patch_id")
+        for n, patch in zip(names, patches):
+            # shards finalised before matches.patch_id existed: the shard's patch is the value anyway
+            have = {r[1] for r in conn.execute(f"PRAGMA {n}.table_info(matches)").fetchall()}
+            select = ", ".join(c if c in have else (str(patch) if c == "patch_id" else "NULL") for c in match_cols)
+            conn.execute(f"INSERT INTO temp.matches ({', '.join(match_cols)}) "
+                         f"SELECT {select} FROM {n}.matches WHERE {window}", params)
+            conn.execute(
+                f"INSERT INTO temp.participants SELECT p.* FROM {n}.participants p "
+                f"JOIN {n}.matches m ON m.match_id = p.match_id WHERE {window.replace('game_', 'm.game_')}",
+                params,
+            )
+        conn.executescript("""
+            CREATE UNIQUE INDEX temp.idx_w_matches ON matches(match_id);
+            CREATE INDEX temp.idx_w_matches_start ON matches(game_start_timestamp);
+            CREATE INDEX temp.idx_w_matches_patch ON matches(patch_id, queue_id);
+            CREATE INDEX temp.idx_w_participants_match ON participants(match_id);
+            CREATE INDEX temp.idx_w_participants_puuid ON participants(puuid);
+        """)
+        conn.execute("CREATE TEMP VIEW match_cache AS "
+                     + " UNION ALL ".join(f"SELECT * FROM {n}.match_cache" for n in names))
+        view_sql = conn.execute(
+            f"SELECT sql FROM {first}.sqlite_master WHERE type='view' AND name='player_match_stats'"
+        ).fetchone()[0]
+        conn.execute(view_sql.replace("CREATE VIEW", "CREATE TEMP VIEW", 1))
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def backup(self, dest: str | Path) -> list[int]:
+        """
+        Incremental backup: finalised shards are copied once (they never change
+        again), active shards through the backup API every run. Returns the
+        patches copied.
+        """
+        dest = Path(dest)
+        dest.mkdir(parents=True, exist_ok=True)
+        done_path = dest / MANIFEST
+        done = json.loads(done_path.read_text()) if done_path.exists() else {}
+        manifest = self.manifest()
+        copied = []
+        for patch in self.patches():
+            src, out = self.path(patch), dest / self.path(patch).name
+            if str(patch) in manifest:
+                if done.get(str(patch)) == manifest[str(patch)] and out.exists():
+                    continue
+                shutil.copy2(src, out)
+                done[str(patch)] = manifest[str(patch)]
+            else:
+                reader = connect_readonly(src)
+                target = sqlite3.connect(out)
+                reader.backup(target)
+                target.close()
+                reader.close()
+            copied.append(patch)
+        done_path.write_text(json.dumps(done, indent=2, sort_keys=True))
+        print(f"Backed up shards {copied} to {dest}" if copied else f"Backup in {dest} already current")
+        return copied
+
+
+def split_database(db_path=DEFAULT_DB_PATH, shards: ShardSet | None = None) -> dict[int, int]:
+    """Copy matches/participants/match_cache from a single-file database into per-patch shards."""
+    shards = shards or ShardSet()
+    src = connect_readonly(db_path)
+    src.create_function("patch_id", 1, patch_id, deterministic=True)
+    counts = {r[0]: r[1] for r in src.execute(
+        "SELECT patch_id(game_version), COUNT(*) FROM matches GROUP BY 1"
+    ).fetchall()}
+    src.close()
+
+    for patch, n in sorted(counts.items(), key=lambda kv: (kv[0] is None, kv[0])):
+        if patch is None:
+            print(f"Skipping {n} matches without a parseable gameVersion")
+            continue
+        if shards.is_final(patch):
+            print(f"Shard {patch} already finalised; skipping")
+            continue
+        conn = connect_writer(shards.ensure(patch))
+        conn.create_function("patch_id", 1, patch_id, deterministic=True)
+        conn.execute("ATTACH DATABASE ? AS src", (f"{Path(db_path).resolve().as_uri()}?mode=ro",))
+        in_patch = "SELECT match_id FROM src.matches WHERE patch_id(game_version) = ?"
+        with conn:
+            for table in SHARDED_TABLES:
+                cols = ", ".join(r[1] for r in conn.execute(f"PRAGMA main.table_info({table})").fetchall())
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {table} ({cols}) SELECT {cols} FROM src.{table} "
+                    f"WHERE match_id IN ({in_patch})", (patch,)
+                )
+        conn.execute("DETACH DATABASE src")
+        conn.close()
+        print(f"Shard {patch}: {n} matches")
+    return {p: n for p, n in counts.items() if p is not None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-patch database shards")
+    parser.add_argument("--root", default=str(SHARD_DIR))
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("split", help="copy a single-file DB into shards")
+    p.add_argument("--db", default=str(DEFAULT_DB_PATH))
+    sub.add_parser("status")
+    p = sub.add_parser("finalize")
+    p.add_argument("patch", type=int)
+    p = sub.add_parser("backup")
+    p.add_argument("dest")
+    args = parser.parse_args()
+
+    shards = ShardSet(args.root)
+    if args.cmd == "split":
+        split_database(args.db, shards)
+    elif args.cmd == "finalize":
+        shards.finalize(args.patch)
+    elif args.cmd == "backup":
+        shards.backup(args.dest)
+    else:
+        final = shards.manifest()
+        for patch in shards.patches():
+            lo, hi = shards.time_range(patch)
+            size = shards.path(patch).stat().st_size / 2**20
+            print(f"{patch}: {'final' if str(patch) in final else 'active'}, {size:.1f} MB, ts {lo}..{hi}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Mergeable sketches for approximate meta queries over large windows.
+
+Matches are bucketed by (day of game start, patch_id, queue_id). Per bucket:
+
+    sketch_totals   exact match and pick counts
+    sketch_cm       count-min sketch of picks and wins keyed by champion_id
+                    (CM_DEPTH rows x CM_WIDTH columns, only non-zero cells stored)
+    sketch_hll      one HyperLogLog (HLL_M one-byte registers) of distinct puuids
+                    per champion, plus champion_id 0 for all players in the bucket
+
+insert_match calls update_match_sketches(), a few upserts per match. Any
+window (a set of patches, a time range or both) is answered by summing the
+count-min cells and taking the register-wise max of the HLLs of its buckets,
+so the cost depends on the number of buckets, not on the number of games.
+
+Error bounds (reported with every estimate):
+    games    never under-counted; over by at most e / CM_WIDTH * total_picks
+             with probability 1 - exp(-CM_DEPTH)
+    players  relative standard error 1.04 / sqrt(HLL_M)
+
+    python src/sketches.py                    # (re)build from existing rows
+    python src/meta_detection.py --approx     # meta detection from sketches
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from days_since_patch import patch_id
+from db import connect, init_db
+from shards import require_unsharded
+
+BUCKET_MS = 24 * 3600 * 1000
+CM_WIDTH = 2048
+CM_DEPTH = 4
+HLL_P = 10
+HLL_M = 1 << HLL_P
+ALL_PLAYERS = 0  # sketch_hll champion_id of the bucket-wide distinct player count
+
+_HASH_BITS = 53  # rank bits below the register index; exact in float64 for the bit-length trick
+_CM_PRIME = 2_147_483_647
+_CM_A, _CM_B = (np.random.default_rng(20250318).integers(1, _CM_PRIME, size=(2, CM_DEPTH), dtype=np.int64))
+
+BUCKET_KEY = ("bucket", "patch_id", "queue_id")
+
+
+def create_sketch_tables(conn: sqlite3.Connection) -> None:
+    # patch_id/queue_id are 0 when unknown: NULLs would never conflict in the upserts
+    conn.executescript("""
+    CREATE TABLE IF NOT EXISTS sketch_totals (
+        bucket INTEGER NOT NULL, patch_id INTEGER NOT NULL, queue_id INTEGER NOT NULL,
+        matches INTEGER NOT NULL, picks INTEGER NOT NULL,
+        PRIMARY KEY (bucket, patch_id, queue_id));
+    CREATE TABLE IF NOT EXISTS sketch_cm (
+        bucket INTEGER NOT NULL, patch_id INTEGER NOT NULL, queue_id INTEGER NOT NULL,
+        row INTEGER NOT NULL, col INTEGER NOT NULL,
+        picks INTEGER NOT NULL, wins INTEGER NOT NULL,
+        PRIMARY KEY (bucket, patch_id, queue_id, row, col));
+    CREATE TABLE IF NOT EXISTS sketch_hll (
+        bucket INTEGER NOT NULL, patch_id INTEGER NOT NULL, queue_id INTEGER NOT NULL,
+        champion_id INTEGER NOT NULL, registers BLOB NOT NULL,
+        PRIMARY KEY (bucket, patch_id, queue_id, champion_id));
+    CREATE TABLE IF NOT EXISTS sketch_champions (
+        champion_id INTEGER PRIMARY KEY, champion_name TEXT);
+    CREATE INDEX IF NOT EXISTS idx_sketch_totals_patch ON sketch_totals(patch_id, queue_id);
+    """)
+    conn.commit()
+
+
+def init_sketches(conn: sqlite3.Connection) -> bool:
+    """Create the tables; fresh tables on a populated DB are rebuilt once. Returns True if rebuilt."""
+    new = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='sketch_totals'"
+    ).fetchone() is None
+    create_sketch_tables(conn)
+    if new and conn.execute("SELECT 1 FROM participants LIMIT 1").fetchone():
+        print(f"Built sketches for {rebuild_sketches(conn)} buckets")
+        return True
+    return False
+
+
+def puuid_hash(puuid: str) -> int:
+    return int.from_bytes(hashlib.blake2b(puuid.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def hll_positions(hashes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """(register index, rank) per 64-bit hash: top HLL_P bits pick the register, the rank is
+    1 + the leading zeros of the next _HASH_BITS bits."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    idx = (hashes >> np.uint64(64 - HLL_P)).astype(np.int64)
+    w = (hashes & np.uint64((1 << _HASH_BITS) - 1)).astype(np.float64)
+    _, bit_length = np.frexp(w)
+    return idx, (_HASH_BITS - bit_length + 1).astype(np.uint8)
+
+
+def hll_estimate(registers: np.ndarray) -> float:
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    est = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if est <= 2.5 * m and zeros:
+        est = m * math.log(m / zeros)  # linear counting for small cardinalities
+    return float(est)
+
+
+def cm_columns(champion_ids) -> np.ndarray:
+    """(CM_DEPTH, n) column of each key in each count-min row."""
+    x = np.asarray(champion_ids, dtype=np.int64)
+    return (_CM_A[:, None] * x[None, :] + _CM_B[:, None]) % _CM_PRIME % CM_WIDTH
+
+
+def bucket_of(start_ms: int) -> int:
+    return int(start_ms) // BUCKET_MS
+
+
+def update_match_sketches(conn: sqlite3.Connection, info: dict) -> None:
+    """Called by insert_match inside its transaction."""
+    ts = info.get("gameStartTimestamp") or info.get("gameCreation")
+    parts = [p for p in info.get("participants", []) if p.get("championId") is not None]
+    if ts is None or not parts:
+        return
+    key = (bucket_of(ts), patch_id(info.get("gameVersion")) or 0, info.get("queueId") or 0)
+
+    conn.execute("""
+        INSERT INTO sketch_totals (bucket, patch_id, queue_id, matches, picks) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(bucket, patch_id, queue_id)
+        DO UPDATE SET matches = matches + 1, picks = picks + excluded.picks
+    """, (*key, len(parts)))
+
+    champs = [int(p["championId"]) for p in parts]
+    wins = [int(bool(p.get("win"))) for p in parts]
+    cols = cm_columns(champs)
+    conn.executemany("""
+        INSERT INTO sketch_cm (bucket, patch_id, queue_id, row, col, picks, wins) VALUES (?, ?, ?, ?, ?, 1, ?)
+        ON CONFLICT(bucket, patch_id, queue_id, row, col)
+        DO UPDATE SET picks = picks + 1, wins = wins + excluded.wins
+    """, [(*key, r, int(cols[r, i]), wins[i]) for r in range(CM_DEPTH) for i in range(len(champs))])
+
+    conn.executemany("INSERT OR IGNORE INTO sketch_champions (champion_id, champion_name) VALUES (?, ?)",
+                     [(c, p.get("championName")) for c, p in zip(champs, parts)])
+
+    players = [(c, p["puuid"]) for c, p in zip(champs, parts) if p.get("puuid")]
+    if not players:
+        return
+    idx, rank = hll_positions([puuid_hash(puuid) for _, puuid in players])
+    updates: dict[int, list[tuple[int, int]]] = {}
+    for (champ, _), i, r in zip(players, idx, rank):
+        for c in (champ, ALL_PLAYERS):
+            updates.setdefault(c, []).append((int(i), int(r)))
+    for champ, regs in updates.items():
+        row = conn.execute(
+            "SELECT registers FROM sketch_hll WHERE bucket = ? AND patch_id = ? AND queue_id = ? AND champion_id = ?",
+            (*key, champ),
+        ).fetchone()
+        registers = np.frombuffer(row[0], dtype=np.uint8).copy() if row else np.zeros(HLL_M, np.uint8)
+        changed = row is None
+        for i, r in regs:
+            if r > registers[i]:
+                registers[i] = r
+                changed = True
+        if changed:
+            conn.execute("INSERT OR REPLACE INTO sketch_hll VALUES (?, ?, ?, ?, ?)", (*key, champ, registers.tobytes()))
+
+
+def rebuild_sketches(conn: sqlite3.Connection) -> int:
+    """Recompute every bucket from matches/participants in one vectorised pass. Returns buckets."""
+    require_unsharded(conn, "rebuild_sketches")
+    df = pd.read_sql_query("""
+        SELECT COALESCE(m.game_start_timestamp, m.game_creation) AS ts,
+               COALESCE(m.patch_id, 0) AS patch_id, COALESCE(m.queue_id, 0) AS queue_id,
+               p.match_id, p.champion_id, p.champion_name, p.win, p.puuid
+        FROM participants p JOIN matches m ON m.match_id = p.match_id
+        WHERE COALESCE(m.game_start_timestamp, m.game_creation) IS NOT NULL AND p.champion_id IS NOT NULL
+    """, conn)
+    df["bucket"] = df["ts"] // BUCKET_MS
+    df["win"] = df["win"].fillna(0).astype("int64")
+    key = list(BUCKET_KEY)
+
+    totals = df.groupby(key).agg(matches=("match_id", "nunique"), picks=("match_id", "size"))
+
+    cols = cm_columns(df["champion_id"].to_numpy())
+    cm = pd.concat(
+        [df[key + ["win"]].assign(row=r, col=cols[r]) for r in range(CM_DEPTH)], ignore_index=True
+    ).groupby(key + ["row", "col"]).agg(picks=("win", "size"), wins=("win", "sum")).reset_index()
+
+    idx, rank = hll_positions(np.fromiter((puuid_hash(p) for p in df["puuid"]), dtype=np.uint64, count=len(df)))
+    hll_rows = pd.concat([df[key + ["champion_id"]], df[key].assign(champion_id=ALL_PLAYERS)], ignore_index=True)
+    groups, codes = np.unique(hll_rows.to_numpy(dtype=np.int64), axis=0, return_inverse=True)
+    registers = np.zeros((len(groups), HLL_M), np.uint8)
+    np.maximum.at(registers, (codes.ravel(), np.tile(idx, 2)), np.tile(rank, 2))
+
+    with conn:
+        for table in ("sketch_totals", "sketch_cm", "sketch_hll"):
+            conn.execute(f"DELETE FROM {table}")
+        conn.executemany("INSERT INTO sketch_totals VALUES (?, ?, ?, ?, ?)",
+                         [(*map(int, k), int(r.matches), int(r.picks)) for k, r in totals.iterrows()])
+        conn.executemany("INSERT INTO sketch_cm VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         cm[key + ["row", "col", "picks", "wins"]].itertuples(index=False, name=None))
+        conn.executemany("INSERT INTO sketch_hll VALUES (?, ?, ?, ?, ?)",
+                         [(*map(int, g), registers[i].tobytes()) for i, g in enumerate(groups)])
+        conn.executemany("INSERT OR IGNORE INTO sketch_champions (champion_id, champion_name) VALUES (?, ?)",
+                         df[["champion_id", "champion_name"]].drop_duplicates("champion_id")
+                         .itertuples(index=False, name=None))
+    return len(totals)
+
+
+def _window_clause(patch_ids=None, start_ms: int | None = None, end_ms: int | None = None,
+                   queue_id: int | None = None) -> tuple[str, list]:
+    clauses, params = [], []
+    if patch_ids is not None:
+        clauses.append(f"patch_id IN ({', '.join('?' * len(patch_ids))})")
+        params += list(patch_ids)
+    if start_ms is not None:
+        clauses.append("bucket >= ?")
+        params.append(bucket_of(start_ms))
+    if end_ms is not None:
+        clauses.append("bucket <= ?")
+        params.append(bucket_of(end_ms - 1))
+    if queue_id is not None:
+        clauses.append("queue_id = ?")
+        params.append(queue_id)
+    return " AND ".join(clauses) or "1", params
+
+
+def window_stats(conn: sqlite3.Connection, patch_ids=None, start_ms: int | None = None,
+                 end_ms: int | None = None, queue_id: int | None = None) -> tuple[dict, int]:
+    """
+    Approximate meta_detection.get_window_stats for the buckets of a window:
+    ({champion_name: {games, wins, players, games_error, players_se}}, total_picks).
+    Time bounds are widened to whole BUCKET_MS days.
+    """
+    where, params = _window_clause(patch_ids, start_ms, end_ms, queue_id)
+    total_picks = conn.execute(f"SELECT COALESCE(SUM(picks), 0) FROM sketch_totals WHERE {where}",
+                               params).fetchone()[0]
+
+    picks = np.zeros((CM_DEPTH, CM_WIDTH), np.int64)
+    wins = np.zeros((CM_DEPTH, CM_WIDTH), np.int64)
+    for r, c, n, w in conn.execute(
+            f"SELECT row, col, SUM(picks), SUM(wins) FROM sketch_cm WHERE {where} GROUP BY row, col", params):
+        picks[r, c], wins[r, c] = n, w
+
+    merged: dict[int, np.ndarray] = {}
+    for champ, blob in conn.execute(f"SELECT champion_id, registers FROM sketch_hll WHERE {where}", params):
+        regs = np.frombuffer(blob, dtype=np.uint8)
+        merged[champ] = np.maximum(merged[champ], regs) if champ in merged else regs.copy()
+    merged.pop(ALL_PLAYERS, None)
+
+    names = dict(conn.execute("SELECT champion_id, champion_name FROM sketch_champions").fetchall())
+    champs = sorted(merged)
+    cols = cm_columns(champs)
+    rows = np.arange(CM_DEPTH)[:, None]
+    games = picks[rows, cols].min(axis=0)
+    # wins use the row that gave the games estimate, so wins <= games
+    best = picks[rows, cols].argmin(axis=0)
+    won = wins[best, cols[best, np.arange(len(champs))]]
+
+    games_error = math.ceil(math.e / CM_WIDTH * total_picks)
+    stats: dict = {}
+    for i, champ in enumerate(champs):
+        players = hll_estimate(merged[champ])
+        stats[names.get(champ) or str(champ)] = {
+            "games": int(games[i]),
+            "wins": int(won[i]),
+            "players": players,
+            "games_error": games_error,
+            "players_se": 1.04 / math.sqrt(HLL_M) * players,
+        }
+    return stats, int(total_picks)
+
+
+def distinct_players(conn: sqlite3.Connection, patch_ids=None, start_ms: int | None = None,
+                     end_ms: int | None = None, queue_id: int | None = None) -> float:
+    """Estimated distinct players over a window (merged bucket-wide HLLs)."""
+    where, params = _window_clause(patch_ids, start_ms, end_ms, queue_id)
+    merged = np.zeros(HLL_M, np.uint8)
+    for (blob,) in conn.execute(f"SELECT registers FROM sketch_hll WHERE {where} AND champion_id = ?",
+                                (*params, ALL_PLAYERS)):
+        np.maximum(merged, np.frombuffer(blob, dtype=np.uint8), out=merged)
+    return hll_estimate(merged)
+
+
+def main():
+    conn = connect()
+    init_db(conn)
+    if not init_sketches(conn):
+        print(f"Rebuilt sketches for {rebuild_sketches(conn)} buckets")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import json
+from functools import partial
+
 import numpy
 import pandas as pd
 import numpy as np
@@ -6,6 +8,8 @@ from scipy import stats
 import statsmodels.api as sm
 import statsmodels.formula.api as smf
 
+from strata import MIN_STRATUM_PLAYERS, STRATA, map_strata
+
 def bin_exposure(df: pd.DataFrame, method="tertiles") -> pd.DataFrame:
     df = df.copy()
 
@@ -75,8 +79,33 @@ def run_all(df: pd.DataFrame, bin_method="tertiles") -> dict:
 
     return results
 
+def run_stratified(df: pd.DataFrame, by=("position",), bin_method="tertiles", workers=None,
+                   min_players=MIN_STRATUM_PLAYERS) -> dict:
+    """run_all for the whole population ("ALL") and for each stratum of `by`, strata in parallel."""
+    return map_strata(partial(run_all, bin_method=bin_method), df, by, workers, min_players)
+
 if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Exposure vs give-up / performance tests")
+    parser.add_argument("--bins", choices=["tertiles", "quartiles"], default="tertiles")
+    parser.add_argument("--by", nargs="*", choices=STRATA, default=None,
+                        help="also test within each stratum (player_performance strata columns)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--metric", default="delta_kda",
+                        help="player_performance column tested as the performance delta")
+    args = parser.parse_args()
+
     df = pd.read_csv("Data/Processed/player_performance.csv")
-    results = run_all(df, bin_method='tertiles')
-    out = "Data/Processed/results.json"
-    out.write_text(json.dumps(results, indent=2))
\ No newline at end of file
+    if args.metric not in df.columns:
+        raise RuntimeError(f"player_performance.csv has no {args.metric} column")
+    df["performance_delta"] = df[args.metric]
+    if args.by:
+        results = run_stratified(df, args.by, args.bins, args.workers)
+    else:
+        results = run_all(df, bin_method=args.bins)
+    results = {"metric": args.metric, **results}
+    out = Path("Data/Processed/results.json")
+    out.write_text(json.dumps(results, indent=2, default=str))
+    print(f"Saved test results to {out}")
\ No newline at end of file
@@ -0,0 +1,165 @@
+"""
+Stratification keys shared by meta_detection, player_performance and
+statistical_testing.
+
+A meta shift in one role or one tier disappears in the global population.
+Instead of re-running each script per stratum (one full scan each), the
+stratum columns become extra grouping keys of the same aggregation:
+
+    position  participants.team_position ('UNKNOWN' when empty)
+    queue     matches.queue_id
+    tier      puuids.tier, the crawl stratum from ladder_seeding ('UNKNOWN' for
+              players seeded the old way or databases without the crawl tables)
+
+tier is not the player's own rank: ladder seeds carry the tier of the ladder
+page they came from, and co-players found in their matches inherit the tier
+of the player being crawled. It is a lobby-level approximation, good for
+splitting the population, not for per-player rank questions.
+
+The crawl tables stay in riot.db when matches are sharded, so a shard window
+connection needs attach_tiers() before grouping by tier; without a puuids
+table the tier stratum collapses to 'UNKNOWN' and stratum_sql warns.
+
+Match-level queries (meta_detection) group on the participant's own values.
+Player-level tables (player_performance) carry each player's main position
+and main queue (most games) and their tier, and statistical_testing runs
+its tests once per group of those columns.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable
+
+import pandas as pd
+
+from db import DEFAULT_DB_PATH
+
+UNKNOWN = "UNKNOWN"
+STRATA = ("position", "queue", "tier")
+# player-level column holding each stratum in the player feature table
+PLAYER_COLUMNS = {"position": "main_position", "queue": "main_queue", "tier": "tier"}
+MIN_STRATUM_PLAYERS = 30
+
+
+def check_strata(by: Iterable[str]) -> tuple[str, ...]:
+    by = tuple(by)
+    unknown = [s for s in by if s not in STRATA]
+    if unknown:
+        raise ValueError(f"Unknown strata {unknown}; choose from {STRATA}")
+    return by
+
+
+TIER_SCHEMA = "crawl"  # schema name attach_tiers() gives riot.db on a shard window connection
+
+
+def tier_table(conn: sqlite3.Connection) -> str | None:
+    """Qualified puuids table with a tier column in any attached database, or None."""
+    for _, schema, _ in conn.execute("PRAGMA database_list").fetchall():
+        columns = {r[1] for r in conn.execute(f"PRAGMA {schema}.table_info(puuids)").fetchall()}
+        if "tier" in columns:
+            return "puuids" if schema == "main" else f"{schema}.puuids"
+    return None
+
+
+def has_tiers(conn: sqlite3.Connection) -> bool:
+    return tier_table(conn) is not None
+
+
+def attach_tiers(conn: sqlite3.Connection, db_path=DEFAULT_DB_PATH) -> bool:
+    """ATTACH riot.db read-only so a shard window connection can see puuids.tier. Returns has_tiers()."""
+    if not has_tiers(conn) and Path(db_path).exists():
+        conn.execute(f"ATTACH DATABASE ? AS {TIER_SCHEMA}", (f"{Path(db_path).resolve().as_uri()}?mode=ro",))
+    return has_tiers(conn)
+
+
+def stratum_sql(conn: sqlite3.Connection, by: Iterable[str], p: str = "p", m: str = "m") -> tuple[list[str], str]:
+    """(SELECT expressions aliased to the stratum names, JOIN clause) for participants `p` / matches `m`."""
+    exprs, join = [], ""
+    for s in check_strata(by):
+        if s == "position":
+            exprs.append(f"COALESCE(NULLIF({p}.team_position, ''), '{UNKNOWN}') AS position")
+        elif s == "queue":
+            exprs.append(f"{m}.queue_id AS queue")
+        elif (table := tier_table(conn)) is not None:
+            exprs.append(f"COALESCE(u.tier, '{UNKNOWN}') AS tier")
+            join = f"LEFT JOIN {table} u ON u.puuid = {p}.puuid"
+        else:
+            print(f"Warning: no puuids.tier table on this connection; every row falls in tier={UNKNOWN}")
+            exprs.append(f"'{UNKNOWN}' AS tier")
+    return exprs, join
+
+
+def load_tiers(conn: sqlite3.Connection) -> pd.DataFrame:
+    """puuid -> tier for every labelled player (empty without the crawl tables)."""
+    table = tier_table(conn)
+    if table is None:
+        return pd.DataFrame(columns=["puuid", "tier"])
+    return pd.read_sql_query(f"SELECT puuid, tier FROM {table} WHERE tier IS NOT NULL", conn)
+
+
+def player_strata(games: pd.DataFrame, tiers: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per puuid: main_position and main_queue (most games; ties go to the
+    smallest value) from a player-game frame, and tier from load_tiers.
+    """
+    out = pd.DataFrame({"puuid": games["puuid"].unique()})
+    for column, source in (("main_position", "team_position"), ("main_queue", "queue_id")):
+        if source not in games.columns:
+            out[column] = UNKNOWN
+            continue
+        counts = (
+            pd.DataFrame({"puuid": games["puuid"], column: games[source].mask(games[source] == "")})
+            .groupby(["puuid", column]).size().reset_index(name="n")
+            .sort_values(["puuid", "n", column], ascending=[True, False, True])
+        )
+        out = out.merge(counts.drop_duplicates("puuid")[["puuid", column]], on="puuid", how="left")
+    out["main_position"] = out["main_position"].fillna(UNKNOWN)
+    out = out.merge(tiers, on="puuid", how="left")
+    out["tier"] = out["tier"].fillna(UNKNOWN)
+    return out
+
+
+def stratum_label(by: tuple[str, ...], key) -> str:
+    key = key if isinstance(key, tuple) else (key,)
+    return "/".join(f"{s}={v}" for s, v in zip(by, key)) or "ALL"
+
+
+def map_strata(fn: Callable[[pd.DataFrame], dict], df: pd.DataFrame, by: Iterable[str],
+               workers: int | None = None, min_size: int = MIN_STRATUM_PLAYERS) -> dict[str, dict]:
+    """
+    fn(sub_df) for the whole frame ('ALL') and every group of the PLAYER_COLUMNS
+    of `by`, in a process pool. Groups smaller than min_size are reported as
+    skipped, and a group whose test raises records the error instead.
+    """
+    by = check_strata(by)
+    columns = [PLAYER_COLUMNS[s] for s in by]
+    if "tier" in by and (df["tier"] == UNKNOWN).all():
+        print(f"Warning: no player has a crawl tier; the tier stratum is {UNKNOWN} for everyone")
+    groups = {"ALL": df}
+    skipped = {}
+    if columns:
+        for key, g in df.groupby(columns, sort=True, dropna=False):
+            label = stratum_label(by, key)
+            if len(g) < min_size:
+                skipped[label] = {"skipped": f"{len(g)} players < {min_size}"}
+            else:
+                groups[label] = g
+
+    workers = min(workers or os.cpu_count() or 1, len(groups))
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {label: pool.submit(_safe_call, fn, g) for label, g in groups.items()}
+        for label, fut in futures.items():
+            results[label] = fut.result()
+    results.update(skipped)
+    return results
+
+
+def _safe_call(fn: Callable[[pd.DataFrame], dict], df: pd.DataFrame) -> dict:
+    try:
+        return fn(df)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}", "n_players": int(len(df))}
@@ -0,0 +1,222 @@
+"""
+Synthetic matches/participants rows for benchmarking the analytics pipeline.
+
+Produces a database with the same schema as db.init_db, populated at a
+configurable scale (10k .. 10M participant rows). Games are spread across the
+pre/post patch windows from days_since_patch, player activity is heavy tailed,
+champion picks follow a Zipf distribution and a handful of champions get
+"buffed" on the patch so meta_detection has a real shift to find. Players
+get a ladder tier by skill in a puuids table so strata.py has tiers to split on.
+
+    python src/synthetic_matches.py --rows 1000000 --out Data/Bench/synthetic_1m.db
+"""
+import argparse
+import sqlite3
+import time
+from pathlib import Path
+
+import numpy as np
+
+from db import init_db
+from days_since_patch import ms_since_patch, ms_since_post_patch, ms_since_pre_patch, patch_id
+from ladder_seeding import TIER_QUOTAS
+
+N_CHAMPIONS = 170
+N_BUFFED = 8
+BUFF_FACTOR = 2.5
+RANKED_SOLO_QUEUE = 420
+OTHER_QUEUES = np.array([400, 430, 440, 450])
+POSITIONS = np.array(["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"])
+CHUNK_MATCHES = 20_000
+
+# Patch number for games starting on/after each date (days_since_patch windows)
+PATCH_VERSIONS = [
+    (ms_since_pre_patch() - 14 * 86_400_000, "15.3.651.1000"),
+    (ms_since_pre_patch(), "15.4.655.1000"),
+    (ms_since_pre_patch() + 14 * 86_400_000, "15.5.660.1000"),
+    (ms_since_patch(), "15.6.664.1000"),
+    (ms_since_post_patch(), "15.7.668.1000"),
+]
+
+
+def champion_table() -> list[tuple[int, str]]:
+    """(champion_id, champion_name) for every synthetic champion."""
+    return [(cid, f"Champ{cid:03d}") for cid in range(1, N_CHAMPIONS + 1)]
+
+
+def buffed_champions(seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.choice(np.arange(1, N_CHAMPIONS + 1), size=N_BUFFED, replace=False)
+
+
+def pick_weights(buffed: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    base = 1.0 / np.arange(1, N_CHAMPIONS + 1) ** 0.8
+    pre = base / base.sum()
+    post = base.copy()
+    post[buffed - 1] *= BUFF_FACTOR
+    post /= post.sum()
+    return pre, post
+
+
+def write_tiers(conn: sqlite3.Connection, puuids: np.ndarray, skill: np.ndarray) -> None:
+    """Crawler puuids table with ladder tiers by skill rank, in TIER_QUOTAS proportions (for strata.py)."""
+    tiers = np.array(list(TIER_QUOTAS))
+    shares = np.array(list(TIER_QUOTAS.values()))
+    cut = np.cumsum(shares / shares.sum())
+    rank = np.argsort(np.argsort(skill)) / max(len(skill), 1)
+    tier = tiers[np.minimum(np.searchsorted(cut, rank, side="right"), len(tiers) - 1)]
+    conn.execute("""CREATE TABLE IF NOT EXISTS puuids (
+        puuid TEXT PRIMARY KEY, fetched INTEGER DEFAULT 0, last_error TEXT,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP, tier TEXT)""")
+    conn.executemany("INSERT INTO puuids (puuid, fetched, tier) VALUES (?, 1, ?)", zip(puuids.tolist(), tier.tolist()))
+    conn.commit()
+
+
+def sample_champions(rng: np.random.Generator, n: int, weights: np.ndarray) -> np.ndarray:
+    """10 distinct champions per match via the Gumbel top-k trick (vectorised)."""
+    keys = np.log(weights)[None, :] + rng.gumbel(size=(n, N_CHAMPIONS))
+    return np.argpartition(-keys, 10, axis=1)[:, :10] + 1
+
+
+def sample_lobbies(rng: np.random.Generator, n: int, activity: np.ndarray) -> np.ndarray:
+    """10 distinct players per match, weighted by player activity."""
+    lobbies = rng.choice(len(activity), size=(n, 10), p=activity)
+    while True:
+        s = np.sort(lobbies, axis=1)
+        dup = (s[:, 1:] == s[:, :-1]).any(axis=1)
+        if not dup.any():
+            return lobbies
+        lobbies[dup] = rng.choice(len(activity), size=(int(dup.sum()), 10), p=activity)
+
+
+def version_for(ts: np.ndarray) -> np.ndarray:
+    starts = np.array([s for s, _ in PATCH_VERSIONS])
+    names = np.array([v for _, v in PATCH_VERSIONS])
+    idx = np.clip(np.searchsorted(starts, ts, side="right") - 1, 0, len(names) - 1)
+    return names[idx]
+
+
+def generate(db_path: str | Path, n_rows: int, n_players: int | None = None,
+             ranked_share: float = 0.9, seed: int = 42) -> Path:
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    if db_path.exists():
+        db_path.unlink()
+
+    n_matches = max(1, n_rows // 10)
+    # ~60 games per player on average, like a snowballed crawl
+    n_players = n_players or max(50, n_rows // 60)
+    rng = np.random.default_rng(seed)
+
+    puuids = np.array([f"synth-{i:08d}-" + "p" * 62 for i in range(n_players)])
+    activity = rng.pareto(1.5, size=n_players) + 1.0
+    activity /= activity.sum()
+    skill = rng.normal(0.0, 1.0, size=n_players)
+
+    buffed = buffed_champions(seed)
+    pre_w, post_w = pick_weights(buffed)
+    names = dict(champion_table())
+    is_buffed = np.zeros(N_CHAMPIONS + 1, dtype=bool)
+    is_buffed[buffed] = True
+
+    # A week either side of the analysis windows so range filters have work to do
+    t_start = ms_since_pre_patch() - 7 * 86_400_000
+    t_end = ms_since_post_patch() + 7 * 86_400_000
+    patch_ts = ms_since_patch()
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF;")
+    conn.execute("PRAGMA synchronous = OFF;")
+    init_db(conn)
+    write_tiers(conn, puuids, skill)
+
+    t0 = time.time()
+    written = 0
+    for c0 in range(0, n_matches, CHUNK_MATCHES):
+        n = min(CHUNK_MATCHES, n_matches - c0)
+        match_no = np.arange(c0, c0 + n)
+        start_ts = np.sort(rng.integers(t_start, t_end, size=n))
+        duration = rng.integers(15 * 60, 40 * 60, size=n)
+        queue = np.where(rng.random(n) < ranked_share, RANKED_SOLO_QUEUE, rng.choice(OTHER_QUEUES, size=n))
+        versions = version_for(start_ts)
+
+        post = start_ts >= patch_ts
+        champs = np.empty((n, 10), dtype=np.int64)
+        if (~post).any():
+            champs[~post] = sample_champions(rng, int((~post).sum()), pre_w)
+        if post.any():
+            champs[post] = sample_champions(rng, int(post.sum()), post_w)
+        lobbies = sample_lobbies(rng, n, activity)
+
+        # Buffed champs and stronger players tilt the coin a little
+        edge = (is_buffed[champs[:, :5]].sum(1) - is_buffed[champs[:, 5:]].sum(1)) * 0.03
+        edge += (skill[lobbies[:, :5]].sum(1) - skill[lobbies[:, 5:]].sum(1)) * 0.02
+        blue_win = rng.random(n) < np.clip(0.5 + edge, 0.05, 0.95)
+
+        match_ids = np.char.add("NA1_", (5_000_000_000 + match_no).astype(str))
+        conn.executemany(
+            """INSERT INTO matches (match_id, game_creation, game_duration, game_end_timestamp,
+                   game_mode, game_type, game_version, platform_id, queue_id, map_id,
+                   game_name, game_start_timestamp, patch_id)
+               VALUES (?, ?, ?, ?, 'CLASSIC', 'MATCHED_GAME', ?, 'NA1', ?, 11, '', ?, ?)""",
+            zip(match_ids.tolist(), (start_ts - 60_000).tolist(), duration.tolist(),
+                (start_ts + duration * 1000).tolist(), versions.tolist(), queue.tolist(), start_ts.tolist(),
+                [patch_id(v) for v in versions.tolist()]),
+        )
+
+        # participant columns, flattened match-major
+        m = np.repeat(np.arange(n), 10)
+        slot = np.tile(np.arange(10), n)
+        players = lobbies.ravel()
+        champ = champs.ravel()
+        minutes = duration[m] / 60.0
+        team = np.where(slot < 5, 100, 200)
+        win = np.where(slot < 5, blue_win[m], ~blue_win[m]).astype(np.int64)
+        s = skill[players]
+        kills = rng.poisson(np.clip(5 + s + win, 0.5, None))
+        deaths = rng.poisson(np.clip(5 - s - win, 0.5, None))
+        assists = rng.poisson(7 + 2 * win)
+        gold = (rng.normal(380 + 25 * s, 40) * minutes).astype(np.int64)
+        cs = (np.clip(rng.normal(6.0 + 0.6 * s, 1.2), 0, None) * minutes).astype(np.int64)
+        damage = (np.clip(rng.normal(700 + 80 * s, 200), 50, None) * minutes).astype(np.int64)
+        position = POSITIONS[slot % 5]
+
+        conn.executemany(
+            """INSERT INTO participants (
+                   match_id, participant_id, puuid, summoner_name, riot_id_game_name, riot_id_tagline,
+                   team_id, champion_id, champion_name, champion_transform,
+                   win, kills, deaths, assists, total_damage_dealt_to_champions,
+                   total_minions_killed, neutral_minions_killed, vision_score,
+                   gold_earned, champ_level, role, lane, team_position)
+               VALUES (?, ?, ?, '', '', 'NA1', ?, ?, ?, 0, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'SOLO', ?, ?)""",
+            zip(match_ids[m].tolist(), (slot + 1).tolist(), puuids[players].tolist(),
+                team.tolist(), champ.tolist(), [names[c] for c in champ.tolist()],
+                win.tolist(), kills.tolist(), deaths.tolist(), assists.tolist(), damage.tolist(),
+                cs.tolist(), rng.integers(0, 30, size=len(m)).tolist(), rng.integers(5, 60, size=len(m)).tolist(),
+                gold.tolist(), rng.integers(11, 19, size=len(m)).tolist(), position.tolist(), position.tolist()),
+        )
+        conn.commit()
+        written += n * 10
+        print(f"[{written}/{n_matches * 10}] participant rows written ({time.time() - t0:.1f}s)")
+
+    conn.execute("ANALYZE;")
+    conn.commit()
+    conn.close()
+    print(f"Synthetic DB ready: {db_path.resolve()} ({n_matches} matches, {n_players} players)")
+    return db_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic riot.db")
+    parser.add_argument("--rows", type=int, default=100_000, help="participant rows (10 per match)")
+    parser.add_argument("--players", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    out = args.out or f"Data/Bench/synthetic_{args.rows}_{args.seed}.db"
+    generate(out, args.rows, args.players, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Match-v5 timelines stored as packed per-match arrays.
+
+A timeline has one frame per minute with a block per participant. Instead of
+a row per (match, frame, participant) we keep one match_timelines row per
+match holding an int32 array of shape (frames, participants, len(FRAME_FIELDS))
+in C order, plus the frame timestamps. Loading is np.frombuffer on the blob -
+no per-frame Python objects - and stack_timelines() joins many matches into
+one contiguous array with offsets.
+
+Participant axis is participantId order (1..10), which maps to puuid through
+participants.participant_id.
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import Iterable
+
+import numpy as np
+
+from match_payload import loads
+
+# (column name, participantFrame path)
+FRAME_FIELDS = (
+    ("total_gold", ("totalGold",)),
+    ("current_gold", ("currentGold",)),
+    ("xp", ("xp",)),
+    ("level", ("level",)),
+    ("minions_killed", ("minionsKilled",)),
+    ("jungle_minions_killed", ("jungleMinionsKilled",)),
+    ("x", ("position", "x")),
+    ("y", ("position", "y")),
+    ("damage_to_champions", ("damageStats", "totalDamageDoneToChampions")),
+)
+FIELD_INDEX = {name: i for i, (name, _) in enumerate(FRAME_FIELDS)}
+DTYPE = np.dtype("<i4")
+
+
+def _get(frame: dict, path: tuple[str, ...]) -> int:
+    v = frame
+    for key in path:
+        v = v.get(key) if isinstance(v, dict) else None
+        if v is None:
+            return 0
+    return int(v)
+
+
+def pack_timeline(raw: bytes | str) -> tuple[int, int, bytes, bytes]:
+    """Raw timeline response -> (n_frames, n_participants, frame_ms blob, frames blob)."""
+    info = loads(raw).get("info", {})
+    frames = info.get("frames", [])
+    pids = sorted({int(pid) for f in frames for pid in f.get("participantFrames", {})})
+    arr = np.zeros((len(frames), len(pids), len(FRAME_FIELDS)), dtype=DTYPE)
+    frame_ms = np.zeros(len(frames), dtype=DTYPE)
+    for i, frame in enumerate(frames):
+        frame_ms[i] = frame.get("timestamp", 0)
+        pframes = frame.get("participantFrames", {})
+        for j, pid in enumerate(pids):
+            pf = pframes.get(str(pid))
+            if pf is not None:
+                arr[i, j] = [_get(pf, path) for _, path in FRAME_FIELDS]
+    return len(frames), len(pids), frame_ms.tobytes(), arr.tobytes()
+
+
+def insert_timeline(conn: sqlite3.Connection, match_id: str, packed: tuple[int, int, bytes, bytes],
+                    schema: str = "main") -> None:
+    n_frames, n_participants, frame_ms, frames = packed
+    conn.execute(
+        f"""INSERT OR REPLACE INTO {schema}.match_timelines
+            (match_id, n_frames, n_participants, n_fields, frame_ms, frames)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+        (match_id, n_frames, n_participants, len(FRAME_FIELDS), frame_ms, frames),
+    )
+
+
+def _unpack(n_frames: int, n_participants: int, n_fields: int, frame_ms: bytes, frames: bytes):
+    ms = np.frombuffer(frame_ms, dtype=DTYPE)
+    arr = np.frombuffer(frames, dtype=DTYPE).reshape(n_frames, n_participants, n_fields)
+    return ms, arr
+
+
+def load_timeline(conn: sqlite3.Connection, match_id: str) -> tuple[np.ndarray, np.ndarray] | None:
+    """(frame_ms (F,), frames (F, P, len(FRAME_FIELDS))) read-only views over the stored blob."""
+    row = conn.execute(
+        "SELECT n_frames, n_participants, n_fields, frame_ms, frames FROM match_timelines WHERE match_id = ?",
+        (match_id,),
+    ).fetchone()
+    return None if row is None else _unpack(*row)
+
+
+def stack_timelines(conn: sqlite3.Connection, match_ids: Iterable[str] | None = None,
+                    n_participants: int = 10):
+    """
+    Many matches as one array: returns (match_ids, offsets, frame_ms, frames) where
+    frames[offsets[i]:offsets[i + 1]] is match i. Only matches with n_participants.
+    """
+    query = "SELECT match_id, n_frames, frame_ms, frames FROM match_timelines WHERE n_participants = ?"
+    params: list = [n_participants]
+    if match_ids is not None:
+        query += " AND match_id IN (SELECT value FROM json_each(?))"
+        params.append(json.dumps(list(match_ids)))
+    rows = conn.execute(query + " ORDER BY match_id", params).fetchall()
+
+    ids = [r[0] for r in rows]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([r[1] for r in rows], out=offsets[1:])
+    frame_ms = np.frombuffer(b"".join(r[2] for r in rows), dtype=DTYPE)
+    frames = np.frombuffer(b"".join(r[3] for r in rows), dtype=DTYPE) \
+        .reshape(int(offsets[-1]), n_participants, len(FRAME_FIELDS))
+    return ids, offsets, frame_ms, frames
+
+
+def per_minute_deltas(frames: np.ndarray, field: str) -> np.ndarray:
+    """Frame-to-frame change of one field, e.g. gold earned per minute: (F-1, P)."""
+    return np.diff(frames[:, :, FIELD_INDEX[field]], axis=0)
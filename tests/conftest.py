@@ -0,0 +1,55 @@
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+# riot_api reads the key at import time; the tests never call the API
+os.environ.setdefault("RIOT_API_KEY", "RGAPI-test")
+
+from synthetic_matches import generate  # noqa: E402
+
+SYNTHETIC_ROWS = 20_000
+
+
+@pytest.fixture(scope="session")
+def synthetic_db(tmp_path_factory) -> Path:
+    """A small synthetic riot.db, shared by every test (treat it as read-only)."""
+    return generate(tmp_path_factory.mktemp("synthetic") / "riot.db", SYNTHETIC_ROWS, seed=3)
+
+
+@pytest.fixture(scope="session")
+def match_infos(synthetic_db) -> list[tuple[str, dict]]:
+    """(match_id, match-v5 style info dict) for every synthetic match, in start-time order."""
+    conn = sqlite3.connect(synthetic_db)
+    conn.row_factory = sqlite3.Row
+    infos: dict[str, dict] = {}
+    for r in conn.execute("""
+        SELECT m.match_id, m.game_start_timestamp, m.game_version, m.game_duration, m.queue_id,
+               p.puuid, p.champion_id, p.champion_name, p.win, p.gold_earned, p.deaths
+        FROM matches m JOIN participants p ON p.match_id = m.match_id
+        ORDER BY m.game_start_timestamp, m.match_id, p.participant_id
+    """):
+        info = infos.setdefault(r["match_id"], {
+            "gameStartTimestamp": r["game_start_timestamp"], "gameVersion": r["game_version"],
+            "gameDuration": r["game_duration"], "queueId": r["queue_id"], "participants": [],
+        })
+        info["participants"].append({
+            "puuid": r["puuid"], "championId": r["champion_id"], "championName": r["champion_name"],
+            "win": bool(r["win"]), "goldEarned": r["gold_earned"], "deaths": r["deaths"],
+        })
+    conn.close()
+    return list(infos.items())
+
+
+@pytest.fixture
+def empty_db(tmp_path) -> sqlite3.Connection:
+    """A fresh database with the standard schema."""
+    from db import init_db
+
+    conn = sqlite3.connect(tmp_path / "riot.db")
+    init_db(conn)
+    yield conn
+    conn.close()
@@ -0,0 +1,49 @@
+import sqlite3
+from collections import Counter
+from itertools import combinations
+
+import numpy as np
+
+from duos import co_occurrence, find_duos, incidence_matrix, load_team_rows
+
+
+def naive_pairs(rows) -> tuple[Counter, Counter]:
+    """Games together per (puuid_a < puuid_b) pair and games per player, by brute force."""
+    together, games = Counter(), Counter()
+    for _, team in rows.groupby(["match_id", "team_id"]):
+        players = sorted(set(team["puuid"]))
+        games.update(players)
+        together.update(combinations(players, 2))
+    return together, games
+
+
+def test_duo_pairs_match_naive_count(synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    rows = load_team_rows(conn)
+    conn.close()
+    together, games = naive_pairs(rows)
+
+    duos = find_duos(rows, min_games=2, min_share=0.0)
+    expected = {pair: n for pair, n in together.items() if n >= 2}
+    assert len(expected) > 100
+    got = {(r.puuid_a, r.puuid_b): r.games_together for r in duos.itertuples()}
+    assert got == expected
+    for r in duos.itertuples():
+        assert (r.games_a, r.games_b) == (games[r.puuid_a], games[r.puuid_b])
+        assert r.share == r.games_together / min(r.games_a, r.games_b)
+
+    strict = find_duos(rows, min_games=3, min_share=0.05)
+    assert set(zip(strict["puuid_a"], strict["puuid_b"])) == {
+        (a, b) for (a, b), n in together.items() if n >= 3 and n / min(games[a], games[b]) >= 0.05
+    }
+
+
+def test_blocked_product_matches_single_block(synthetic_db):
+    conn = sqlite3.connect(synthetic_db)
+    a, _ = incidence_matrix(load_team_rows(conn))
+    conn.close()
+    full = co_occurrence(a, min_games=1, block=a.shape[1])
+    blocked = co_occurrence(a, min_games=1, block=7)
+    key = lambda t: sorted(zip(*(x.tolist() for x in t)))
+    assert key(full) == key(blocked)
+    assert np.all(full[0] < full[1])
@@ -0,0 +1,14 @@
+import pandas as pd
+
+from giveup_model import feature_columns
+
+COLUMNS = ["puuid", "baseline_kda", "baseline_gold", "post_kda", "post_gold", "post_deaths", "post_ngames",
+           "post_gap_min", "delta_kda", "delta_gold", "delta_deaths", "delta_ngames", "exposure_meta", "gave_up"]
+
+
+def test_default_feature_set_leaves_out_the_label_window():
+    df = pd.DataFrame(columns=COLUMNS)
+    assert feature_columns(df) == ["baseline_kda", "baseline_gold", "post_kda", "post_gap_min", "delta_kda",
+                                   "exposure_meta"]
+    assert feature_columns(df, "baseline") == ["baseline_kda", "baseline_gold"]
+    assert set(feature_columns(df, "all")) == set(COLUMNS) - {"puuid", "gave_up"}
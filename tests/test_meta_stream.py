@@ -0,0 +1,67 @@
+import numpy as np
+
+from meta_stream import (CLOCK, MAX_LATENESS_MS, MIN_GAMES, SLOTS, THRESHOLD, WARMUP_MATCHES, ChampionState,
+                         create_meta_stream_tables, update_match_meta_stream)
+
+SHIFT_AT = 20_000
+assert SHIFT_AT > WARMUP_MATCHES
+
+
+def run(state: ChampionState, rates: np.ndarray, seed: int = 0) -> list[tuple[int, str]]:
+    """Feed one champion picked in each match with probability rates[t - 1]; returns (t, kind) alerts."""
+    rng = np.random.default_rng(seed)
+    alerts = []
+    for t, p in enumerate(rates, start=1):
+        picks = int(rng.random() < p * SLOTS)
+        if not picks:
+            continue
+        for kind, baseline, current, stat in state.observe(t, picks, int(rng.random() < 0.5)):
+            alerts.append((t, kind))
+            assert stat >= THRESHOLD
+            assert (state.pick_cusum if kind == "pick" else state.win_cusum) == 0.0
+    return alerts
+
+
+def test_stationary_pick_rate_raises_no_alert():
+    state = ChampionState(None, 7, "Champ007")
+    assert run(state, np.full(2 * SHIFT_AT, 0.01)) == []
+    assert state.games > MIN_GAMES
+
+
+def test_pick_shift_alerts_then_resets():
+    state = ChampionState(None, 7, "Champ007")
+    rates = np.concatenate([np.full(SHIFT_AT, 0.01), np.full(SHIFT_AT, 0.02)])
+    alerts = run(state, rates)
+    picks = [t for t, kind in alerts if kind == "pick"]
+    assert picks and min(picks) > SHIFT_AT
+    # first alert within a few thousand matches of the shift, and the reset lets it fire again
+    assert min(picks) - SHIFT_AT < 5_000
+    assert len(picks) > 1
+    assert state.alerted_at == max(t for t, _ in alerts)
+
+
+def match(start: int, champion_id: int = 7) -> dict:
+    return {"queueId": 420, "gameStartTimestamp": start,
+            "participants": [{"championId": champion_id, "championName": "Champ007", "win": True}]}
+
+
+def clock(conn) -> tuple[int, int]:
+    return conn.execute("SELECT games, last_start FROM meta_stream_state WHERE champion_id = ?", (CLOCK,)).fetchone()
+
+
+def test_late_matches_are_skipped(empty_db):
+    create_meta_stream_tables(empty_db)
+    start = 1_742_292_000_000
+    for i in range(5):
+        update_match_meta_stream(empty_db, f"NA1_{i}", match(start + i * 60_000))
+    newest = start + 4 * 60_000
+    assert clock(empty_db) == (5, newest)
+
+    update_match_meta_stream(empty_db, "NA1_late", match(newest - MAX_LATENESS_MS - 1))
+    assert clock(empty_db) == (5, newest)
+    # a little out of order is still counted, without moving the newest start back
+    update_match_meta_stream(empty_db, "NA1_jitter", match(newest - 60_000))
+    assert clock(empty_db) == (6, newest)
+
+    update_match_meta_stream(empty_db, "NA1_normal_queue", {**match(newest), "queueId": 400})
+    assert clock(empty_db)[0] == 6
@@ -0,0 +1,86 @@
+import random
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from days_since_patch import PATCH_ID
+from player_baselines import (BASELINE_N, METRICS, WINDOWS, get_baseline, init_baselines, rebuild_baselines,
+                              update_match_baselines, welford_add, welford_remove)
+
+
+def expected_baselines(db_path) -> dict[tuple[str, str], pd.DataFrame]:
+    """Both windows for every player, recomputed directly with pandas."""
+    conn = sqlite3.connect(db_path)
+    games = pd.read_sql_query("""
+        SELECT p.puuid, m.game_start_timestamp AS ts, m.patch_id, m.game_duration, p.gold_earned, p.deaths
+        FROM participants p JOIN matches m ON m.match_id = p.match_id
+        WHERE m.patch_id <= ? AND m.game_duration > 0
+    """, conn, params=(PATCH_ID,))
+    conn.close()
+    assert not games.duplicated(["puuid", "ts"]).any()
+    games["gold_per_min"] = games["gold_earned"] / (games["game_duration"] / 60.0)
+    games["deaths_per_10"] = games["deaths"] / (games["game_duration"] / 600.0)
+    games = games.sort_values(["puuid", "ts"])
+    pre = games[games["patch_id"] < PATCH_ID].groupby("puuid").tail(BASELINE_N)
+    post = games[games["patch_id"] == PATCH_ID].groupby("puuid").head(BASELINE_N)
+    out = {}
+    for window, frame in (("pre_last", pre), ("post_first", post)):
+        agg = frame.groupby("puuid").agg(
+            count=("ts", "size"), max_ts=("ts", "max"),
+            **{f"{m}_mean": (m, "mean") for m in METRICS},
+            **{f"{m}_std": (m, lambda s: s.std(ddof=0)) for m in METRICS},
+        )
+        out[window] = agg
+    return out
+
+
+def assert_matches(conn, expected) -> None:
+    for window in WINDOWS:
+        frame = expected[window]
+        assert len(frame) > 50
+        for puuid, row in frame.iterrows():
+            got = get_baseline(conn, puuid, window)
+            assert got is not None
+            assert got["count"] == row["count"]
+            assert got["max_ts"] == row["max_ts"]
+            for m in METRICS:
+                assert got[f"{m}_mean"] == pytest.approx(row[f"{m}_mean"], rel=1e-9)
+                assert got[f"{m}_std"] == pytest.approx(row[f"{m}_std"], rel=1e-6, abs=1e-9)
+
+
+def test_welford_window_matches_numpy():
+    rng = np.random.default_rng(0)
+    xs = rng.normal(400, 50, size=200)
+    n, mean, m2 = 0, 0.0, 0.0
+    for i, x in enumerate(xs):
+        n, mean, m2 = welford_add(n, mean, m2, x)
+        if i >= BASELINE_N:
+            n, mean, m2 = welford_remove(n, mean, m2, xs[i - BASELINE_N])
+    window = xs[-BASELINE_N:]
+    assert n == BASELINE_N
+    assert mean == pytest.approx(window.mean(), rel=1e-12)
+    assert m2 / n == pytest.approx(window.var(), rel=1e-9)
+
+
+def test_rebuild_matches_pandas(synthetic_db, tmp_path):
+    conn = sqlite3.connect(synthetic_db)
+    dest = sqlite3.connect(tmp_path / "copy.db")
+    conn.backup(dest)
+    conn.close()
+    init_baselines(dest)  # fresh table on a populated DB: rebuilt here
+    assert_matches(dest, expected_baselines(synthetic_db))
+    assert rebuild_baselines(dest) > 0
+    assert_matches(dest, expected_baselines(synthetic_db))
+    dest.close()
+
+
+def test_out_of_order_ingest_matches_pandas(synthetic_db, match_infos, empty_db):
+    init_baselines(empty_db)
+    shuffled = [info for _, info in match_infos]
+    random.Random(1).shuffle(shuffled)
+    with empty_db:
+        for info in shuffled:
+            update_match_baselines(empty_db, info)
+    assert_matches(empty_db, expected_baselines(synthetic_db))
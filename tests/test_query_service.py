@@ -0,0 +1,77 @@
+import sqlite3
+
+import pytest
+
+from db import connect_writer, init_feature_tables, set_watermark
+from query_service import FEATURE_BUILDS, LRUCache, QueryService
+
+
+@pytest.fixture
+def service(synthetic_db, tmp_path):
+    db = tmp_path / "riot.db"
+    db.write_bytes(synthetic_db.read_bytes())
+    svc = QueryService(db, matrix_path=tmp_path / "matchups.npz", refresh_seconds=3600)
+    yield svc, db
+    svc.conn().close()
+
+
+def ingest(db, patch: int) -> None:
+    """Append a changelog row for one existing match of `patch`, as an ingest would."""
+    conn = sqlite3.connect(db)
+    with conn:
+        conn.execute("INSERT INTO ingest_changelog (match_id) SELECT match_id FROM matches WHERE patch_id = ? LIMIT 1",
+                     (patch,))
+    conn.close()
+
+
+def test_put_after_evict_is_dropped():
+    cache = LRUCache(10)
+    generation = cache.generation
+    cache.evict(["index"])
+    cache.put("k", 1, ["index"], generation)
+    assert cache.get("k") is None
+    assert cache.stats["stale_puts"] == 1
+    cache.put("k", 1, ["index"], cache.generation)
+    assert cache.get("k") == 1
+
+
+def test_new_changelog_rows_evict_only_their_patch(service):
+    svc, db = service
+    patches = [r[0] for r in svc.conn().execute("SELECT DISTINCT patch_id FROM matches ORDER BY 1")]
+    first, last = patches[0], patches[-1]
+    svc.patch_stats(first)
+    svc.patch_stats(last)
+    assert ("patch_stats", first) in svc.cache.entries
+
+    ingest(db, last)
+    result = svc.refresh(force=True)
+    assert result["patches"] == [last]
+    assert ("patch_stats", last) not in svc.cache.entries
+    assert ("patch_stats", first) in svc.cache.entries
+    assert svc.refresh(force=True) is None
+
+
+def test_value_computed_across_refresh_is_not_cached(service):
+    svc, db = service
+    patch = svc.conn().execute("SELECT MAX(patch_id) FROM matches").fetchone()[0]
+
+    def compute():
+        ingest(db, patch)
+        svc.refresh(force=True)
+        return {"stale": True}
+
+    assert svc.cached(("probe", patch), [("patch", patch)], compute) == {"stale": True}
+    assert ("probe", patch) not in svc.cache.entries
+    assert svc.cache.stats["stale_puts"] == 1
+
+
+def test_feature_rebuild_without_new_matches_evicts(service):
+    svc, db = service
+    svc.cached(("features_probe",), ["features"], lambda: 1)
+    conn = connect_writer(db)
+    init_feature_tables(conn)
+    with conn:
+        set_watermark(conn, FEATURE_BUILDS, 1)
+    conn.close()
+    assert svc.refresh(force=True)["evicted"] == 1
+    assert ("features_probe",) not in svc.cache.entries
@@ -0,0 +1,137 @@
+import json
+import os
+import sqlite3
+
+import pytest
+
+from db import connect_writer, init_db
+from shards import MAX_ATTACHED, ShardSet, split_database
+
+
+def attached(conn) -> set[str]:
+    return {r[1] for r in conn.execute("PRAGMA database_list").fetchall()} - {"main", "temp"}
+
+
+def test_split_round_trip(synthetic_db, tmp_path):
+    shards = ShardSet(tmp_path / "shards")
+    counts = split_database(synthetic_db, shards)
+    src = sqlite3.connect(synthetic_db)
+    expected = dict(src.execute("SELECT patch_id, COUNT(*) FROM matches GROUP BY patch_id").fetchall())
+    assert counts == expected
+    assert shards.patches() == sorted(expected)
+
+    patch = sorted(expected)[1]
+    window = shards.open_patches([patch])
+    for table, key in (("matches", "match_id"), ("participants", "match_id, participant_id")):
+        got = window.execute(f"SELECT * FROM {table} ORDER BY {key}").fetchall()
+        want = src.execute(
+            f"SELECT * FROM {table} WHERE match_id IN (SELECT match_id FROM matches WHERE patch_id = ?) "
+            f"ORDER BY {key}", (patch,)
+        ).fetchall()
+        assert [tuple(r) for r in got] == want
+    assert window.execute("SELECT COUNT(*) FROM player_match_stats").fetchone()[0] == \
+        window.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+    window.close()
+
+    lo, hi = src.execute("SELECT MIN(game_start_timestamp), MAX(game_start_timestamp) FROM matches").fetchone()
+    start, end = lo + (hi - lo) // 3, lo + 2 * (hi - lo) // 3
+    window = shards.open_window(start, end)
+    want = src.execute("SELECT COUNT(*) FROM matches WHERE game_start_timestamp >= ? AND game_start_timestamp < ?",
+                       (start, end)).fetchone()[0]
+    assert window.execute("SELECT COUNT(*) FROM matches").fetchone()[0] == want
+    window.close()
+    src.close()
+
+
+def test_finalize_is_read_only(synthetic_db, tmp_path):
+    shards = ShardSet(tmp_path / "shards")
+    counts = split_database(synthetic_db, shards)
+    patch = min(counts)
+    entry = shards.finalize(patch)
+    assert entry["matches"] == counts[patch]
+    assert shards.is_final(patch)
+    assert shards.time_range(patch) == (entry["min_ts"], entry["max_ts"])
+    assert not os.stat(shards.path(patch)).st_mode & 0o222
+    conn = connect_writer(tmp_path / "main.db")
+    with pytest.raises(RuntimeError):
+        shards.attach(conn, patch)
+    conn.close()
+
+
+def test_attach_many_never_detaches_requested(tmp_path):
+    shards = ShardSet(tmp_path / "shards")
+    conn = connect_writer(tmp_path / "main.db")
+    init_db(conn)
+    patches = list(range(1501, 1501 + MAX_ATTACHED + 2))
+
+    names = shards.attach_many(conn, patches[:MAX_ATTACHED])
+    assert attached(conn) == set(names.values())
+    with pytest.raises(RuntimeError):
+        shards.attach_many(conn, patches[:MAX_ATTACHED + 1])
+
+    keep = [patches[0], patches[-1]]
+    names = shards.attach_many(conn, keep)
+    assert set(names.values()) <= attached(conn)
+    assert len(attached(conn)) == MAX_ATTACHED
+    for name in names.values():
+        conn.execute(f"SELECT COUNT(*) FROM {name}.matches").fetchone()
+    conn.close()
+
+
+def test_finalised_patch_match_is_rejected_not_raised(tmp_path):
+    from ingest_pipeline import pending_match_ids, write_batch
+    from match_id_grabber import init_db as init_crawl_tables
+    from match_payload import decode_match
+    from mock_riot_server import synth_store
+    from player_baselines import init_baselines
+    from sketches import init_sketches
+    from meta_stream import init_meta_stream
+
+    store = synth_store(4, 40)
+    batch = []
+    for (match_id, raw), version in zip(store.matches.items(), ("15.6.664.1", "15.5.660.1") * 2):
+        payload = json.loads(raw)
+        payload["info"]["gameVersion"] = version
+        raw = json.dumps(payload).encode()
+        batch.append((match_id, raw, decode_match(raw), None))
+    conn = connect_writer(tmp_path / "main.db")
+    init_db(conn)
+    init_crawl_tables(conn)
+    init_baselines(conn)
+    init_sketches(conn)
+    init_meta_stream(conn)
+    conn.executemany("INSERT INTO match_ids(match_id) VALUES(?)", [(m,) for m, *_ in batch])
+    conn.commit()
+
+    shards = ShardSet(tmp_path / "shards")
+    shards.ensure(1505)
+    shards.finalize(1505)
+    assert write_batch(conn, batch, shards) == (2, 2)
+    assert shards.open_patches([1506]).execute("SELECT COUNT(*) FROM matches").fetchone()[0] == 2
+    assert pending_match_ids(conn) == []
+    conn.close()
+
+
+def test_sharded_riot_db_refuses_single_file_consumers(synthetic_db, tmp_path):
+    from duos import load_team_rows
+    from player_baselines import init_baselines, rebuild_baselines
+    from shards import mark_sharded, require_unsharded
+
+    db = tmp_path / "riot.db"
+    db.write_bytes(synthetic_db.read_bytes())
+    conn = connect_writer(db)
+    init_baselines(conn)
+    assert len(load_team_rows(conn)) > 0
+    shards = ShardSet(tmp_path / "shards")
+    mark_sharded(conn, shards.root)
+    with pytest.raises(RuntimeError, match="sharded"):
+        load_team_rows(conn)
+    with pytest.raises(RuntimeError, match="sharded"):
+        rebuild_baselines(conn)
+    conn.close()
+
+    split_database(db, shards)
+    window = shards.open_patches(shards.patches()[:1])
+    require_unsharded(window, "duos")
+    assert len(load_team_rows(window)) > 0
+    window.close()
@@ -0,0 +1,72 @@
+import math
+import sqlite3
+
+import pytest
+
+from days_since_patch import PATCH_ID, PRE_PATCH_IDS, RANKED_SOLO_QUEUE
+from sketches import (HLL_M, create_sketch_tables, distinct_players, rebuild_sketches, update_match_sketches,
+                      window_stats)
+
+SKETCH_TABLES = ("sketch_totals", "sketch_cm", "sketch_hll")
+HLL_SE = 1.04 / math.sqrt(HLL_M)
+
+
+@pytest.fixture(scope="module")
+def sketched_db(synthetic_db, tmp_path_factory):
+    """Copy of the synthetic database with sketches rebuilt from its rows."""
+    src = sqlite3.connect(synthetic_db)
+    conn = sqlite3.connect(tmp_path_factory.mktemp("sketches") / "riot.db")
+    src.backup(conn)
+    src.close()
+    create_sketch_tables(conn)
+    rebuild_sketches(conn)
+    yield conn
+    conn.close()
+
+
+def dump(conn) -> dict[str, list]:
+    return {t: conn.execute(f"SELECT * FROM {t} ORDER BY 1, 2, 3, 4, 5").fetchall() for t in SKETCH_TABLES}
+
+
+def exact_stats(conn, patch_ids) -> dict[str, dict]:
+    rows = conn.execute(f"""
+        SELECT p.champion_name, COUNT(*), SUM(p.win), COUNT(DISTINCT p.puuid)
+        FROM participants p JOIN matches m ON m.match_id = p.match_id
+        WHERE m.patch_id IN ({', '.join('?' * len(patch_ids))}) AND m.queue_id = ?
+        GROUP BY p.champion_name
+    """, (*patch_ids, RANKED_SOLO_QUEUE)).fetchall()
+    return {name: {"games": g, "wins": w, "players": n} for name, g, w, n in rows}
+
+
+def test_incremental_equals_rebuild(sketched_db, match_infos, empty_db):
+    create_sketch_tables(empty_db)
+    with empty_db:
+        for _, info in match_infos:
+            update_match_sketches(empty_db, info)
+    assert dump(empty_db) == dump(sketched_db)
+
+
+@pytest.mark.parametrize("patch_ids", [(PATCH_ID,), PRE_PATCH_IDS])
+def test_estimates_within_bounds(sketched_db, patch_ids):
+    exact = exact_stats(sketched_db, patch_ids)
+    approx, total = window_stats(sketched_db, patch_ids=patch_ids, queue_id=RANKED_SOLO_QUEUE)
+    assert total == sum(s["games"] for s in exact.values())
+    assert set(approx) == set(exact)
+    for name, want in exact.items():
+        got = approx[name]
+        # count-min never under-counts and stays within its error bound
+        assert want["games"] <= got["games"] <= want["games"] + got["games_error"]
+        assert got["wins"] <= got["games"]
+        assert got["players"] == pytest.approx(want["players"], abs=4 * got["players_se"] + 1)
+
+
+def test_merged_hll_counts_window_players(sketched_db):
+    patch_ids = (*PRE_PATCH_IDS, PATCH_ID)
+    exact = sketched_db.execute(f"""
+        SELECT COUNT(DISTINCT p.puuid) FROM participants p JOIN matches m ON m.match_id = p.match_id
+        WHERE m.patch_id IN ({', '.join('?' * len(patch_ids))})
+    """, patch_ids).fetchone()[0]
+    estimate = distinct_players(sketched_db, patch_ids=patch_ids)
+    assert estimate == pytest.approx(exact, rel=4 * HLL_SE)
+    # registers only grow when buckets are merged, so a sub-window never estimates more
+    assert distinct_players(sketched_db, patch_ids=(PATCH_ID,)) <= estimate